@@ -90,14 +90,21 @@ class BESSCLI(cli.CLI):
 
     def get_prompt(self):
         if self.softnic.is_connected():
-            return '%s:%d $ ' % self.softnic.peer
+            if isinstance(self.softnic.peer, tuple):
+                return '%s:%d $ ' % self.softnic.peer
+            else:
+                return '%s $ ' % self.softnic.peer
         else:
             return '<disconnected> $ '
 
 def connect_softnic():
     s = SoftNIC()
     try:
-        s.connect()
+        # the Unix domain socket has less overhead, if bessd listens on it
+        s.connect('unix:' + s.DEF_UNIX_PATH, fallback=True)
+        if s.fallback_reason:
+            print >> sys.stderr, 'Connected over TCP instead (%s)' % \
+                    s.fallback_reason
     except s.APIError as e:
         print >> sys.stderr, e.message
     return s
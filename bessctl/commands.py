@@ -19,6 +19,7 @@ import signal
 import sugar
 from port import *
 from module import *
+from graph import *
 
 # extention for configuration files.
 CONF_EXT = 'bess'
@@ -118,12 +119,12 @@ def get_var_attrs(cli, var_token, partial_word):
         if var_token == 'DRIVER':
             var_type = 'name'
             var_desc = 'name of a port driver'
-            var_candidates = cli.softnic.list_drivers()
+            var_candidates = cli.softnic.list_drivers(cached=True)
 
         elif var_token == 'MCLASS':
             var_type = 'name'
             var_desc = 'name of a module class'
-            var_candidates = cli.softnic.list_mclasses()
+            var_candidates = cli.softnic.list_mclasses(cached=True)
 
         elif var_token == '[NEW_MODULE]':
             var_type = 'name'
@@ -132,12 +133,32 @@ def get_var_attrs(cli, var_token, partial_word):
         elif var_token == 'MODULE':
             var_type = 'name'
             var_desc = 'name of an existing module instance'
-            var_candidates = [m['name'] for m in cli.softnic.list_modules()]
+            modules = cli.softnic.list_modules(cached=True)
+            var_candidates = [m['name'] for m in modules]
 
         elif var_token == 'MODULE...':
             var_type = 'name+'
             var_desc = 'one or more module names'
-            var_candidates = [m['name'] for m in cli.softnic.list_modules()]
+            modules = cli.softnic.list_modules(cached=True)
+            var_candidates = [m['name'] for m in modules]
+
+        elif var_token == 'NEW_TC':
+            var_type = 'name'
+            var_desc = 'name of the new traffic class'
+
+        elif var_token == 'TC':
+            var_type = 'name'
+            var_desc = 'name of a traffic class'
+            tcs = cli.softnic.list_tcs()
+            var_candidates = [c['name'] for c in tcs if 'name' in c]
+
+        elif var_token == '[TASKID]':
+            var_type = 'gate'
+            var_desc = 'task of the module (default 0)'
+
+        elif var_token == '[WINDOW]':
+            var_type = 'gate'
+            var_desc = 'length of the sliding window in seconds (default 10)'
 
         elif var_token == '[NEW_PORT]':
             var_type = 'name'
@@ -146,12 +167,14 @@ def get_var_attrs(cli, var_token, partial_word):
         elif var_token == 'PORT':
             var_type = 'name'
             var_desc = 'name of a port'
-            var_candidates = [p['name'] for p in cli.softnic.list_ports()]
+            ports = cli.softnic.list_ports(cached=True)
+            var_candidates = [p['name'] for p in ports]
 
         elif var_token == 'PORT...':
             var_type = 'name+'
             var_desc = 'one or more port names'
-            var_candidates = [p['name'] for p in cli.softnic.list_ports()]
+            ports = cli.softnic.list_ports(cached=True)
+            var_candidates = [p['name'] for p in ports]
 
         elif var_token == 'CONF':
             var_type = 'confname'
@@ -164,6 +187,21 @@ def get_var_attrs(cli, var_token, partial_word):
             var_desc = 'configuration filename'
             var_candidates = complete_filename(partial_word)
 
+        elif var_token == 'PCAP_FILE':
+            var_type = 'filename'
+            var_desc = 'pcap file of Ethernet frames'
+            var_candidates = complete_filename(partial_word)
+
+        elif var_token == '[PCAP_ARGS...]':
+            var_type = 'map'
+            var_desc = 'count (default 32), sample (random ones instead ' \
+                    'of the first ones), seed, max_size'
+
+        elif var_token == 'LOG_FILE':
+            var_type = 'filename'
+            var_desc = 'message log filename'
+            var_candidates = complete_filename(partial_word)
+
         elif var_token == '[OGATE]':
             var_type = 'gate'
             var_desc = 'output gate of a module (default 0)'
@@ -180,6 +218,17 @@ def get_var_attrs(cli, var_token, partial_word):
             var_type = 'map'
             var_desc = 'initial configuration for port'
 
+        elif var_token == '[TC_ARGS...]':
+            var_type = 'map'
+            var_desc = 'wid, parent, priority, share, share_resource, ' \
+                    'limit, max_burst (e.g., limit={"packet": 1000000})'
+
+        elif var_token == '[BALANCE_ARGS...]':
+            var_type = 'map'
+            var_desc = 'interval (sec), dry_run, slack, min_gain, and ' \
+                    'for "watch", threshold and patience (e.g., ' \
+                    'threshold=0.3, patience=5)'
+
         elif var_token == '[MODULE_ARGS...]':
             var_type = 'pyobj'
             var_desc = 'initial configuration for module'
@@ -309,7 +358,8 @@ def history(cli):
     else:
         cli.err('"readline" not available')
 
-@cmd('daemon connect [HOST] [PORT]', 'Connect to BESS daemon')
+@cmd('daemon connect [HOST] [PORT]',
+        'Connect to BESS daemon (HOST can be "unix:<socket path>")')
 def daemon_connect(cli, host, port):
     kwargs = {}
 
@@ -353,7 +403,8 @@ def warn(cli, msg, func):
 @cmd('daemon start', 'Start BESS daemon in the local machine')
 def daemon_start(cli):
     def do_start():
-        cmd = 'sudo %s/core/bessd -k' % os.path.dirname(cli.this_dir)
+        cmd = 'sudo %s/core/bessd -k -u %s' % \
+                (os.path.dirname(cli.this_dir), cli.softnic.DEF_UNIX_PATH)
 
         cli.softnic.disconnect()
 
@@ -362,7 +413,11 @@ def daemon_start(cli):
         except subprocess.CalledProcessError:
             raise cli.CommandError('Cannot start BESS daemon')
         else:
-            cli.softnic.connect()
+            cli.softnic.connect('unix:' + cli.softnic.DEF_UNIX_PATH,
+                    fallback=True)
+            if cli.softnic.fallback_reason:
+                cli.fout.write('  Connected over TCP instead (%s)\n' % \
+                        cli.softnic.fallback_reason)
 
     daemon_exists = False
 
@@ -405,6 +460,21 @@ def daemon_stop(cli):
 
     warn(cli, 'BESS daemon will be killed.', do_stop)
 
+@cmd('record start LOG_FILE', 'Record messages to BESS daemon in a log file')
+def record_start(cli, log_file):
+    try:
+        cli.softnic.start_recording(log_file)
+    except (IOError, ValueError) as e:
+        raise cli.CommandError('Cannot record to "%s": %s' % (log_file, e))
+
+    if cli.interactive:
+        cli.fout.write('Recording. Replay the log with ' \
+                'libbess-python/replay.py\n')
+
+@cmd('record stop', 'Stop recording messages to BESS daemon')
+def record_stop(cli):
+    cli.softnic.stop_recording()
+
 @staticmethod
 def _choose_arg(arg, kwargs):
     if kwargs:
@@ -423,26 +493,34 @@ def _choose_arg(arg, kwargs):
         return arg
 
 # NOTE: the name of this function is used below
-def _do_run_file(cli, conf_file):
+# With a graph, the script is run offline and its pipeline is applied at the
+# end (see graph.py), instead of pausing workers all along.
+def _do_run_file(cli, conf_file, graph=None):
     if not os.path.exists(conf_file):
         cli.err('Cannot open file "%s"' % conf_file)
         return
 
     xformed = sugar.xform_file(conf_file)
 
+    if graph is not None:
+        softnic = GraphSoftNIC(cli.softnic, graph)
+    else:
+        softnic = cli.softnic
+
     new_globals = {
             '__builtins__': __builtins__,
-            'softnic': cli.softnic,
+            'softnic': softnic,
             'ConfError': ConfError,
             '__bess_env__': __bess_env__,
             '__bess_module__': __bess_module__,
         }
 
-    class_names = cli.softnic.list_mclasses()
+    class_names = cli.softnic.list_mclasses(cached=True)
 
     # Add the special Port class. TODO: per-driver classes
     new_globals['Port'] = type('Port', (Port,), 
-            {'softnic': cli.softnic, 'choose_arg': _choose_arg})
+            {'softnic': cli.softnic, 'choose_arg': _choose_arg,
+             'graph': graph})
 
     # Add SoftNIC module classes
     for name in class_names:
@@ -450,13 +528,18 @@ def _do_run_file(cli, conf_file):
             raise cli.InternalError('Invalid module class name: %s' % name)
 
         new_globals[name] = type(name, (Module,),
-                {'softnic': cli.softnic, 'choose_arg': _choose_arg})
+                {'softnic': cli.softnic, 'choose_arg': _choose_arg,
+                 'graph': graph})
 
     code = compile(xformed, conf_file, 'exec')
 
-    cli.softnic.pause_all()
+    if graph is None:
+        cli.softnic.pause_all()
+
     try:
         exec(code, new_globals)
+        if graph is not None:
+            cli.fout.write('  %s\n' % graph.apply())
         cli.fout.write('Done.\n')
     except cli.softnic.Error:
         raise
@@ -481,9 +564,10 @@ def _do_run_file(cli, conf_file):
         cli.fout.write(''.join(traceback.format_exception_only(t, v)))
 
     finally:
-        cli.softnic.resume_all()
+        if graph is None:
+            cli.softnic.resume_all()
 
-def _run_file(cli, conf_file, env_map):
+def _run_file(cli, conf_file, env_map, graph=None):
     if env_map:
         try:
             original_env = copy.copy(os.environ)
@@ -491,13 +575,13 @@ def _run_file(cli, conf_file, env_map):
             for k, v in env_map.iteritems():
                 os.environ[k] = str(v)
 
-            _do_run_file(cli, conf_file)
+            _do_run_file(cli, conf_file, graph)
         finally:
             os.environ.clear()
             for k, v in original_env.iteritems():
                 os.environ[k] = v
     else:
-            _do_run_file(cli, conf_file)
+            _do_run_file(cli, conf_file, graph)
 
 @cmd('run CONF [ENV_VARS...]', 'Run a *.bess configuration in "conf/"')
 def run_conf(cli, conf, env_map):
@@ -510,6 +594,51 @@ def run_conf(cli, conf, env_map):
 def run_file(cli, conf_file, env_map):
     _run_file(cli, os.path.expanduser(conf_file), env_map)
 
+@cmd('run atomic CONF [ENV_VARS...]',
+        'Run a *.bess configuration in "conf/", applied in one request')
+def run_atomic_conf(cli, conf, env_map):
+    target_dir = '%s/conf' % cli.this_dir
+    basename = os.path.expanduser('%s.%s' % (conf, CONF_EXT))
+    conf_file = os.path.join(target_dir, basename)
+    _run_file(cli, conf_file, env_map, Graph(cli.softnic))
+
+@cmd('run atomic file CONF_FILE [ENV_VARS]',
+        'Run a configuration file, applied in one request')
+def run_atomic_file(cli, conf_file, env_map):
+    _run_file(cli, os.path.expanduser(conf_file), env_map, Graph(cli.softnic))
+
+@cmd('run incremental CONF [ENV_VARS...]',
+        'Change the pipeline to a *.bess configuration in "conf/"')
+def run_incremental_conf(cli, conf, env_map):
+    target_dir = '%s/conf' % cli.this_dir
+    basename = os.path.expanduser('%s.%s' % (conf, CONF_EXT))
+    conf_file = os.path.join(target_dir, basename)
+    _run_file(cli, conf_file, env_map, IncrementalGraph(cli.softnic))
+
+@cmd('run incremental file CONF_FILE [ENV_VARS]',
+        'Change the pipeline to a configuration file')
+def run_incremental_file(cli, conf_file, env_map):
+    _run_file(cli, os.path.expanduser(conf_file), env_map,
+            IncrementalGraph(cli.softnic))
+
+# Only the workers that may run the modules are paused, so that the rest of
+# the pipeline keeps running. Returns the paused ones.
+def _pause_workers(cli, modules):
+    wids = cli.softnic.get_affected_workers(modules)
+    paused = []
+    try:
+        for wid in wids:
+            cli.softnic.pause_worker(wid)
+            paused.append(wid)
+    except:
+        _resume_workers(cli, paused)
+        raise
+    return wids
+
+def _resume_workers(cli, wids):
+    for wid in wids:
+        cli.softnic.resume_worker(wid)
+
 @cmd('add port DRIVER [NEW_PORT] [PORT_ARGS...]', 'Add a new port')
 def add_port(cli, driver, port, args):
     ret = cli.softnic.create_port(driver, port, args)
@@ -519,11 +648,7 @@ def add_port(cli, driver, port, args):
 
 @cmd('add module MCLASS [NEW_MODULE] [MODULE_ARGS...]', 'Add a new module')
 def add_module(cli, mclass, module, args):
-    cli.softnic.pause_all()
-    try:
-        ret = cli.softnic.create_module(mclass, module, args)
-    finally:
-        cli.softnic.resume_all()
+    ret = cli.softnic.create_module(mclass, module, args)
 
     if module is None:
         cli.fout.write('  The new module "%s" has been created\n' % ret['name'])
@@ -538,11 +663,11 @@ def add_connection(cli, m1, m2, ogate, igate):
     if igate is None:
         igate = 0
 
-    cli.softnic.pause_all()
+    wids = _pause_workers(cli, [m1])
     try:
         cli.softnic.connect_modules(m1, m2, ogate)
     finally:
-        cli.softnic.resume_all()
+        _resume_workers(cli, wids)
 
 @cmd('delete port PORT', 'Delete a port')
 def delete_port(cli, port):
@@ -550,11 +675,11 @@ def delete_port(cli, port):
 
 @cmd('delete module MODULE', 'Delete a module')
 def delete_module(cli, module):
-    cli.softnic.pause_all()
+    wids = _pause_workers(cli, [module])
     try:
         cli.softnic.destroy_module(module)
     finally:
-        cli.softnic.resume_all()
+        _resume_workers(cli, wids)
 
 @cmd('delete connection MODULE ogate [OGATE]', 
     'Delete a connection between two modules')
@@ -562,11 +687,153 @@ def delete_connection(cli, module, ogate):
     if ogate is None:
         ogate = 0
 
-    cli.softnic.pause_all()
+    wids = _pause_workers(cli, [module])
     try:
         cli.softnic.disconnect_modules(module, ogate)
     finally:
-        cli.softnic.resume_all()
+        _resume_workers(cli, wids)
+
+@cmd('load templates MODULE PCAP_FILE [PCAP_ARGS...]',
+        'Load packet templates of a Rewrite module from a pcap file')
+def load_templates(cli, module, pcap_file, args):
+    # libbess-python is in sys.path only after bessctl has started
+    import pcapfile
+
+    args = args or {}
+    for key in args:
+        if key not in ('count', 'sample', 'seed', 'max_size'):
+            raise cli.CommandError('Unknown argument "%s"' % key)
+
+    try:
+        templates = pcapfile.select(pcap_file, **args)
+    except (IOError, pcapfile.PcapError) as e:
+        raise cli.CommandError(str(e))
+
+    if not templates:
+        raise cli.CommandError('No packet to load from %s' % pcap_file)
+
+    wids = _pause_workers(cli, [module])
+    try:
+        cli.softnic.query_module(module, {'templates': templates})
+    finally:
+        _resume_workers(cli, wids)
+
+    cli.fout.write('  %d templates (%d-%d bytes) loaded to %s\n' % \
+            (len(templates), min(len(p) for p in templates),
+             max(len(p) for p in templates), module))
+
+# TCs are changed only while their worker is paused
+def _pause_worker_of_tc(cli, tc=None, wid=0):
+    if tc is not None:
+        for c in cli.softnic.list_tcs():
+            if c.get('name') == tc:
+                wid = c['wid']
+                break
+        else:
+            return []   # the request will fail anyway
+
+    cli.softnic.pause_worker(wid)
+    return [wid]
+
+@cmd('add tc NEW_TC [TC_ARGS...]', 'Add a new traffic class')
+def add_tc(cli, tc, args):
+    args = dict(args or {})
+    wid = args.pop('wid', None)
+    parent = args.pop('parent', None)
+
+    if parent is not None:
+        wids = _pause_worker_of_tc(cli, tc=parent)
+    else:
+        wids = _pause_worker_of_tc(cli, wid=wid or 0)
+
+    try:
+        cli.softnic.add_tc(tc, wid, parent, **args)
+    finally:
+        _resume_workers(cli, wids)
+
+@cmd('update tc TC [TC_ARGS...]', 'Change the parameters of a traffic class')
+def update_tc(cli, tc, args):
+    wids = _pause_worker_of_tc(cli, tc=tc)
+    try:
+        cli.softnic.update_tc(tc, **(args or {}))
+    finally:
+        _resume_workers(cli, wids)
+
+@cmd('delete tc TC', 'Delete a traffic class')
+def delete_tc(cli, tc):
+    wids = _pause_worker_of_tc(cli, tc=tc)
+    try:
+        cli.softnic.delete_tc(tc)
+    finally:
+        _resume_workers(cli, wids)
+
+# A task in a default TC is moved from its worker, which is paused as well
+@cmd('attach task MODULE tc TC [TASKID]', 'Attach a task to a traffic class')
+def attach_task(cli, module, tc, taskid):
+    wids = _pause_worker_of_tc(cli, tc=tc)
+    try:
+        for t in cli.softnic.list_tasks():
+            if t['name'] == module and t['taskid'] == (taskid or 0) and \
+                    t['wid'] >= 0 and t['wid'] not in wids:
+                cli.softnic.pause_worker(t['wid'])
+                wids.append(t['wid'])
+    except:
+        _resume_workers(cli, wids)
+        raise
+
+    try:
+        cli.softnic.attach_task(module, taskid or 0, tc=tc)
+    finally:
+        _resume_workers(cli, wids)
+
+def _balancer(cli, args):
+    # libbess-python is in sys.path only after bessctl has started
+    import balance
+
+    keys = ('slack', 'min_gain')
+    return balance.Balancer(cli.softnic,
+            **dict((k, v) for k, v in args.iteritems() if k in keys))
+
+def _print_plan(cli, plan):
+    cli.fout.write('  %-8s%10s%10s\n' % ('worker', 'load%', 'planned%'))
+    for wid in sorted(plan.before):
+        cli.fout.write('  W%-7d%10.1f%10.1f\n' % \
+                (wid, plan.before[wid] * 100, plan.after[wid] * 100))
+
+    for m, tid, old, new in plan.moves:
+        cli.fout.write('  %s %s:%d  W%d -> W%d\n' % \
+                ('moved' if plan.applied else 'to move', m, tid, old, new))
+
+@cmd('balance [BALANCE_ARGS...]',
+        'Move tasks between workers once, by their measured load')
+def balance_once(cli, args):
+    args = args or {}
+    balancer = _balancer(cli, args)
+
+    plan = balancer.balance(interval=args.get('interval', 1.0),
+            dry_run=args.get('dry_run', False))
+
+    _print_plan(cli, plan)
+    if not plan.applied:
+        cli.fout.write('  No task has been moved.\n')
+
+@cmd('balance watch [BALANCE_ARGS...]',
+        'Keep moving tasks between workers as their load changes')
+def balance_watch(cli, args):
+    args = args or {}
+    balancer = _balancer(cli, args)
+
+    try:
+        for plan in balancer.watch(interval=args.get('interval', 1.0),
+                threshold=args.get('threshold', 0.2),
+                patience=args.get('patience', 3)):
+            cli.fout.write('\n%s  imbalance %.1f%%\n' % \
+                    (time.strftime('%X'), plan.imbalance * 100))
+
+            if plan.applied:
+                _print_plan(cli, plan)
+    except KeyboardInterrupt:
+        pass
 
 @cmd('show status', 'Show the overall status')
 def show_status(cli):
@@ -608,9 +875,23 @@ def show_status(cli):
     else:
         cli.fout.write('(none)\n')
 
+# (node name, gateid) -> (timestamp, # of packets), from get_all_stats()
+def _gate_stats(stats):
+    gates = stats['gates']
+    timestamp = stats['timestamp']
+
+    return dict(((name, gate), (timestamp, pkts)) for name, gate, pkts in \
+            zip(gates['module'], gates['gate'], gates.get('pkts', [])))
+
 # last_stats: a map of (node name, gateid) -> (timestamp, # of packets)
 def _draw_pipeline(cli, last_stats = None):
-    modules = sorted(cli.softnic.list_modules())
+    # modules and the stats of all their gates, in one round trip
+    with cli.softnic.pipeline() as p:
+        modules = p.list_modules()
+        stats = p.get_all_stats()
+
+    modules = sorted(modules.result())
+    stats = stats.result()
     names = []
     node_labels = {}
 
@@ -626,6 +907,13 @@ def _draw_pipeline(cli, last_stats = None):
 
     port_inc_list = []
 
+    gates = stats['gates']
+    new_stats = _gate_stats(stats)
+
+    num_gates = {}
+    for name in gates['module']:
+        num_gates[name] = num_gates.get(name, 0) + 1
+
     try:
         f = subprocess.Popen('graph-easy', shell=True,
                 stdin=subprocess.PIPE, 
@@ -635,31 +923,30 @@ def _draw_pipeline(cli, last_stats = None):
         for m in modules:
             print >> f.stdin, '[%s]' % node_labels[m['name']]
 
-        for name in names:
-            gates = cli.softnic.get_module_info(name)['gates']
-
-            for gate in gates:
-                edge_attr = ''
-                if last_stats != None:
-                    if 'pkts' in gate:
-                        last_time, last_pkts = last_stats[(name, gate['gate'])]
-                        new_time, new_pkts = gate['timestamp'], gate['pkts']
-                        last_stats[(name, gate['gate'])] = (new_time, new_pkts)
+        for i, name in enumerate(gates['module']):
+            ogate = gates['gate'][i]
+            edge_attr = ''
 
+            if last_stats != None:
+                if (name, ogate) in new_stats:
+                    new_time, new_pkts = new_stats[(name, ogate)]
+                    if (name, ogate) in last_stats:
+                        last_time, last_pkts = last_stats[(name, ogate)]
                         pps = (new_pkts - last_pkts) / (new_time - last_time)
                         edge_attr = 'label:%d;' % int(pps)
-                else:
-                    if len(gates) > 1:
-                        edge_attr = 'label:%d;' % gate['gate']
+                    last_stats[(name, ogate)] = (new_time, new_pkts)
+            else:
+                if num_gates[name] > 1:
+                    edge_attr = 'label:%d;' % ogate
 
-                if edge_attr != '':
-                    edge_attr = '{%s}' % edge_attr
+            if edge_attr != '':
+                edge_attr = '{%s}' % edge_attr
 
-                print >> f.stdin, '[%s] ->%s [%s]' % (
-                        node_labels[name],
-                        edge_attr,
-                        node_labels[gate['name']],
-                    )
+            print >> f.stdin, '[%s] ->%s [%s]' % (
+                    node_labels[name],
+                    edge_attr,
+                    node_labels[gates['name'][i]],
+                )
         output, error = f.communicate()
         f.wait()
         return output
@@ -667,6 +954,28 @@ def _draw_pipeline(cli, last_stats = None):
         raise cli.CommandError('"graph-easy" program is not availabe? ' \
                 'Check if the package "libgraph-easy-perl" is installed.')
 
+@cmd('show client stats', 'Show the latency of requests made by this client')
+def show_client_stats(cli):
+    stats = cli.softnic.get_stats()
+
+    if not stats:
+        raise cli.CommandError('No request has been timed yet.')
+
+    cli.fout.write('  %-24s %-7s %8s %10s %10s %10s %10s\n' % \
+            ('Command', 'Phase', 'Count', 'p50 (us)', 'p90 (us)',
+             'p99 (us)', 'max (us)'))
+
+    for cmd in sorted(stats):
+        for phase in cli.softnic.PHASES:
+            hist = stats[cmd][phase]
+            cli.fout.write('  %-24s %-7s %8d %10.1f %10.1f %10.1f %10.1f\n' % \
+                    (cmd if phase == cli.softnic.PHASES[0] else '', phase,
+                     hist.count,
+                     hist.percentile(50) * 1e6,
+                     hist.percentile(90) * 1e6,
+                     hist.percentile(99) * 1e6,
+                     hist.max * 1e6))
+
 @cmd('show pipeline', 'Show the current datapath pipeline')
 def show_pipeline(cli):
     cli.fout.write(_draw_pipeline(cli))
@@ -679,10 +988,8 @@ def _group(number):
         s = s[:-3]
     return s + ','.join(reversed(groups))
 
-def _show_port(cli, port):
+def _show_port(cli, port, port_stats):
     cli.fout.write('  %s/%s\n' % (port['name'], port['driver']))
-    
-    port_stats = cli.softnic.get_port_stats(port['name'])
 
     cli.fout.write('    Incoming (external -> BESS):\n')
     cli.fout.write('      packets: %s\n' % _group(port_stats['inc']['packets']))
@@ -694,6 +1001,13 @@ def _show_port(cli, port):
     cli.fout.write('      dropped: %s\n' % _group(port_stats['out']['dropped']))
     cli.fout.write('      bytes  : %s\n' % _group(port_stats['out']['bytes']))
 
+def _show_ports(cli, ports):
+    with cli.softnic.pipeline() as p:
+        stats = [p.get_port_stats(port['name']) for port in ports]
+
+    for port, port_stats in zip(ports, stats):
+        _show_port(cli, port, port_stats.result())
+
 @cmd('show port', 'Show the status of all ports')
 def show_port_all(cli):
     ports = cli.softnic.list_ports()
@@ -701,25 +1015,25 @@ def show_port_all(cli):
     if not ports:
         raise cli.CommandError('There is no active port to show.')
     else:
-        for port in ports:
-            _show_port(cli, port)
+        _show_ports(cli, ports)
 
 @cmd('show port PORT...', 'Show the status of spcified ports')
 def show_port_list(cli, port_names):
     ports = cli.softnic.list_ports()
 
     port_names = list(set(port_names))
+    selected = []
     for port_name in port_names:
         for port in ports:
             if port_name == port['name']:
-                _show_port(cli, port)
+                selected.append(port)
                 break
         else:
             raise cli.CommandError('Port "%s" doest not exist' % port_name)
 
-def _show_module(cli, module):
-    info = cli.softnic.get_module_info(module['name'])
+    _show_ports(cli, selected)
 
+def _show_module(cli, info):
     cli.fout.write('  %s::%s' % (info['name'], info['mclass']))
 
     if 'desc' in info:
@@ -736,6 +1050,13 @@ def _show_module(cli, module):
         cli.fout.write('    Dump:\n')
         cli.fout.write('      %s' % info['dump'])
 
+def _show_modules(cli, modules):
+    with cli.softnic.pipeline() as p:
+        infos = [p.get_module_info(module['name']) for module in modules]
+
+    for info in infos:
+        _show_module(cli, info.result())
+
 @cmd('show module', 'Show the status of all modules')
 def show_module_all(cli):
     modules = cli.softnic.list_modules()
@@ -743,8 +1064,7 @@ def show_module_all(cli):
     if not modules:
         raise cli.CommandError('There is no active module to show.')
     else:
-        for module in modules:
-            _show_module(cli, module)
+        _show_modules(cli, modules)
 
 
 @cmd('show module MODULE...', 'Show the status of specified modules')
@@ -752,25 +1072,46 @@ def show_module_list(cli, module_names):
     modules = cli.softnic.list_modules()
 
     module_names = list(set(module_names))
+    selected = []
     for module_name in module_names:
         for module in modules:
             if module_name == module['name']:
-                _show_module(cli, module)
+                selected.append(module)
                 break
         else:
             raise cli.CommandError('Module "%s" doest not exist' % module_name)
 
+    _show_modules(cli, selected)
+
+def _tc_label(c):
+    if 'name' in c:
+        return c['name']
+    return '<default %d>' % c['id']
+
+@cmd('show tc', 'Show the traffic classes of all workers')
+def show_tc(cli):
+    tcs = cli.softnic.list_tcs()
+
+    if not tcs:
+        raise cli.CommandError('There is no traffic class to show.')
+
+    for c in sorted(tcs, key=lambda c: (c['wid'], c['id'])):
+        cli.fout.write('  %s (worker %d)\n' % (_tc_label(c), c['wid']))
+        cli.fout.write('    parent: %s, priority: %d, share: %d (%s)\n' % \
+                (c.get('parent', '<root>'), c['priority'], c['share'],
+                 c['share_resource']))
+
+        for key in ('limit', 'max_burst'):
+            if c[key]:
+                cli.fout.write('    %s: %s\n' % (key, ', '.join('%s %s' % \
+                        (_group(v), r) for r, v in sorted(c[key].items()))))
+
+        tasks = ['%s:%d' % (t['name'], t['taskid']) for t in c['tasks']]
+        cli.fout.write('    tasks: %s\n' % (', '.join(tasks) or '(none)'))
+
 @cmd('monitor pipeline', 'Monitor the datapath pipeline')
 def monitor_pipeline(cli):
-    modules = sorted(cli.softnic.list_modules())
-   
-    last_stats = {}
-    for module in modules:
-        gates = cli.softnic.get_module_info(module['name'])['gates']
-
-        for gate in gates:
-            last_stats[(module['name'], gate['gate'])] = \
-                    (gate['timestamp'], gate['pkts'])
+    last_stats = _gate_stats(cli.softnic.get_all_stats())
 
     try:
         while True:
@@ -845,20 +1186,37 @@ def _monitor_ports(cli, *ports):
 
     cli.fout.write('Monitoring ports: %s\n' % ', '.join(ports))
 
-    last = {}
-    now = {}
+    # one request for all ports, with a single timestamp
+    def get_all_stats():
+        stats = cli.softnic.get_all_stats()
+        columns = stats['ports']
+
+        ret = {}
+        for i, port in enumerate(columns['name']):
+            if port not in ports:
+                continue
+
+            ret[port] = {'timestamp': stats['timestamp']}
+            for pdir in ('inc', 'out'):
+                ret[port][pdir] = {}
+                for key in ('packets', 'dropped', 'bytes'):
+                    ret[port][pdir][key] = columns['%s_%s' % (pdir, key)][i]
+
+        for port in ports:
+            if port not in ret:
+                raise cli.CommandError('Port "%s" does not exist' % port)
 
-    for port in ports:
-        last[port] = cli.softnic.get_port_stats(port)
+        return ret
+
+    last = get_all_stats()
     
     try:
         while True:
             time.sleep(1)
 
-            for port in ports:
-                now[port] = cli.softnic.get_port_stats(port)
+            now = get_all_stats()
 
-            print_header(now[port]['timestamp'])
+            print_header(now[ports[-1]]['timestamp'])
 
             for port in ports:
                 print_delta('%s/%s' % (port, drivers[port]), 
@@ -871,11 +1229,197 @@ def _monitor_ports(cli, *ports):
                         get_total(last.values()),
                         get_total(now.values())))
 
-            for port in ports:
-                last[port] = now[port]
+            last = now
+    except KeyboardInterrupt:
+        pass
+
+
+@cmd('monitor worker', 'Monitor the utilization of all workers')
+def monitor_worker(cli):
+
+    def get_delta(old, new):
+        delta = {}
+        for key in ('cycles_busy', 'cycles_idle', 'rounds', 'batches',
+                'packets', 'bits'):
+            delta[key] = new[key] - old[key]
+
+        return delta
+
+    def print_header(timestamp):
+        print
+        print '%-20s%6s%8s%10s%10s%12s%10s%10s' % \
+                (time.strftime('%X') + str(timestamp % 1)[1:8], \
+                 'core', 'busy%', 'Mpps', 'Mbps', 'Mrounds/s', \
+                 'pkts/bat', 'cyc/pkt')
+
+        print '-' * 86
+
+    def print_delta(worker, delta, sec_diff):
+        cycles = delta['cycles_busy'] + delta['cycles_idle']
+        packets = delta['packets']
+        batches = delta['batches']
+
+        if worker['running']:
+            name = 'W%d' % worker['wid']
+        else:
+            name = 'W%d (paused)' % worker['wid']
+
+        print '%-20s%6d%8.1f%10.3f%10.1f%12.3f%10.1f%10.1f' % (name,
+                worker['core'],
+                delta['cycles_busy'] * 100.0 / cycles if cycles else 0.0,
+                packets / sec_diff / 1e6,
+                delta['bits'] / sec_diff / 1e6,
+                delta['rounds'] / sec_diff / 1e6,
+                float(packets) / batches if batches else 0.0,
+                float(delta['cycles_busy']) / packets if packets else 0.0)
+
+    def get_workers():
+        return dict((w['wid'], w) for w in cli.softnic.list_workers())
+
+    last = get_workers()
+    if not last:
+        raise cli.CommandError('No worker to monitor')
+
+    try:
+        while True:
+            time.sleep(1)
+
+            now = get_workers()
+
+            print_header(max(w['timestamp'] for w in now.itervalues()))
+
+            # workers added since the last round are shown from the next one
+            for wid in sorted(now):
+                if wid not in last:
+                    continue
+
+                sec_diff = now[wid]['timestamp'] - last[wid]['timestamp']
+                print_delta(now[wid], get_delta(last[wid], now[wid]),
+                        sec_diff)
+
+            print '-' * 86
+
+            last = now
     except KeyboardInterrupt:
         pass
 
+@cmd('monitor tc', 'Monitor the usage of all named traffic classes')
+def monitor_tc(cli):
+
+    def print_header(timestamp):
+        print
+        print '%-20s%10s%10s%10s%12s%12s' % \
+                (time.strftime('%X') + str(timestamp % 1)[1:8], \
+                 'CPU%', 'Mpps', 'Mbps', 'Mcnt/s', 'throttled%')
+
+        print '-' * 74
+
+    def print_delta(name, old, new):
+        sec_diff = new['timestamp'] - old['timestamp']
+        cycles = new['tsc_hz'] * sec_diff
+
+        print '%-20s%10.1f%10.3f%10.1f%12.3f%12.1f' % (name,
+                (new['cycle'] - old['cycle']) * 100.0 / cycles,
+                (new['packet'] - old['packet']) / sec_diff / 1e6,
+                (new['bit'] - old['bit']) / sec_diff / 1e6,
+                (new['count'] - old['count']) / sec_diff / 1e6,
+                (new['cycles_throttled'] - old['cycles_throttled']) * \
+                        100.0 / cycles)
+
+    def get_stats():
+        with cli.softnic.pipeline() as p:
+            futures = [p.get_tc_stats(name) for name in names]
+
+        return dict((name, f.result()) for name, f in zip(names, futures))
+
+    names = sorted(c['name'] for c in cli.softnic.list_tcs() if 'name' in c)
+    if not names:
+        raise cli.CommandError('No traffic class to monitor')
+
+    last = get_stats()
+
+    try:
+        while True:
+            time.sleep(1)
+
+            now = get_stats()
+
+            print_header(now[names[-1]]['timestamp'])
+
+            for name in names:
+                print_delta(name, last[name], now[name])
+
+            print '-' * 74
+
+            last = now
+    except KeyboardInterrupt:
+        pass
+
+@cmd('monitor latency MODULE [WINDOW]',
+        'Monitor the latency percentiles measured by a Measure module')
+def monitor_latency(cli, module, window):
+    try:
+        # libbess-python is in sys.path only after bessctl has started
+        import latency
+    except ImportError:
+        raise cli.CommandError('NumPy is required to monitor latency')
+
+    percentiles = (50, 99, 99.9)
+
+    def format_ns(ns):
+        if ns is None:
+            return '-'
+        if ns == float('inf'):
+            return 'overflow'
+        return '%.1f' % (ns / 1000.0)
+
+    def print_header(timestamp):
+        print
+        print '%-20s%12s%12s%12s%12s%12s' % \
+                (time.strftime('%X') + str(timestamp % 1)[1:8], \
+                 'Mpps', 'p50(us)', 'p99(us)', 'p99.9(us)', 'max(us)')
+
+        print '-' * 80
+
+    def print_row(name, sec, result):
+        packets, values, max_ns = result
+
+        print '%-20s%12.3f%12s%12s%12s%12s' % (name,
+                packets / sec / 1e6,
+                format_ns(values[0]), format_ns(values[1]),
+                format_ns(values[2]), format_ns(max_ns))
+
+    def query():
+        return cli.softnic.query_module(module, {'type': 'histogram'})
+
+    if window is None:
+        window = 10
+
+    if window < 1:
+        raise cli.CommandError('The window must be at least 1 second')
+
+    snapshots = latency.LatencyWindow(window)
+    snapshots.add(query())
+
+    try:
+        while True:
+            time.sleep(1)
+
+            now = query()
+            snapshots.add(now)
+
+            first = snapshots.snapshots[0][0]
+            last = snapshots.snapshots[-2][0]
+
+            print_header(now['timestamp'])
+            print_row('last 1s', now['timestamp'] - last,
+                    snapshots.percentiles(percentiles, 1))
+            print_row('last %ds' % (len(snapshots.snapshots) - 1),
+                    now['timestamp'] - first,
+                    snapshots.percentiles(percentiles))
+            print '-' * 80
+    except KeyboardInterrupt:
+        pass
 
 @cmd('monitor port', 'Monitor the current traffic of all ports')
 def monitor_port_all(cli):
@@ -907,11 +1451,11 @@ def tcpdump_module(cli, module_name, ogate, opts):
     cli.fout.write('  Running: %s\n' % tcpdump_cmd)
     proc = subprocess.Popen(tcpdump_cmd, shell=True, preexec_fn = os.setsid)
 
-    cli.softnic.pause_all()
+    wids = _pause_workers(cli, [module_name])
     try:
         cli.softnic.enable_tcpdump(fifo, module_name, ogate)
     finally:
-        cli.softnic.resume_all()
+        _resume_workers(cli, wids)
 
     try:
         proc.wait()
@@ -919,11 +1463,11 @@ def tcpdump_module(cli, module_name, ogate, opts):
         # kill all descendants in the process group
         os.killpg(proc.pid, signal.SIGTERM)
     finally:
-        cli.softnic.pause_all()
+        wids = _pause_workers(cli, [module_name])
         try:
             cli.softnic.disable_tcpdump(module_name, ogate)
         finally:
-            cli.softnic.resume_all()
+            _resume_workers(cli, wids)
 
         try:
             os.close(fd)
@@ -0,0 +1,272 @@
+import re
+
+# A pipeline built offline by a configuration script, to be applied by the
+# daemon all at once (see core/graph.h). While a Graph is in use, modules,
+# connections, and tasks are recorded here instead of being requested one
+# by one, so that workers are paused only while the daemon applies it.
+#
+# Ports are still created right away, as modules may refer to them.
+class Graph(object):
+    def __init__(self, softnic):
+        self.softnic = softnic
+        self.modules = []       # Module objects, in the order of creation
+        self.desc = {'modules': [], 'edges': [], 'tasks': []}
+
+    # returns the name of the port
+    def add_port(self, driver, name, arg):
+        return self.softnic.create_port(driver, name, arg)['name']
+
+    def add_module(self, module, mclass, name, arg):
+        entry = {'mclass': mclass}
+        if name is not None:
+            entry['name'] = name
+        if arg is not None:
+            entry['arg'] = arg
+
+        self.desc['modules'].append(entry)
+        self.modules.append(module)
+
+        return len(self.modules) - 1
+
+    # modules recorded here are referred to by index, as they may have no
+    # name yet. Others should exist in the daemon.
+    def _ref(self, module):
+        if isinstance(module, str):
+            for i, entry in enumerate(self.desc['modules']):
+                if entry.get('name') == module:
+                    return i
+            return module
+
+        if getattr(module, 'graph_index', None) is not None:
+            return module.graph_index
+
+        return module.name
+
+    def add_edge(self, m1, gate, m2):
+        self.desc['edges'].append(
+                {'m1': self._ref(m1), 'gate': gate, 'm2': self._ref(m2)})
+
+    # to a TC created beforehand (tc), or a default one on worker wid
+    def add_task(self, m, tid, tc=None, wid=None):
+        task = {'name': self._ref(m), 'taskid': tid}
+        if tc is not None:
+            task['tc'] = tc
+        else:
+            task['wid'] = wid
+
+        self.desc['tasks'].append(task)
+
+    # returns a summary of what has been done
+    def apply(self):
+        ret = self.softnic.apply_graph(self.desc)
+
+        for module, name in zip(self.modules, ret['modules']):
+            module.name = name
+            module.graph_index = None
+
+        return '%d modules, %d connections, %d tasks' % \
+                (len(self.desc['modules']), len(self.desc['edges']),
+                 len(self.desc['tasks']))
+
+# args are compared as the daemon sees them (e.g., tuples become lists)
+def _canonical(arg):
+    # libbess-python is in sys.path only after bessctl has started
+    import message
+
+    if arg is None:
+        return None
+
+    return message.decode(message.encode(arg))
+
+# 'sink10' comes after 'sink9', as default names are given in order
+def _natural_key(name):
+    return [int(s) if s.isdigit() else s for s in re.split(r'(\d+)', name)]
+
+def _refers_to(arg, names):
+    if isinstance(arg, str):
+        return arg in names
+    if isinstance(arg, dict):
+        return any(_refers_to(v, names) for v in arg.itervalues())
+    if isinstance(arg, list):
+        return any(_refers_to(v, names) for v in arg)
+    return False
+
+# first one (in name order) of the unclaimed entries that match
+def _match(live, claimed, pred):
+    for name in sorted(live, key=_natural_key):
+        if name not in claimed and pred(live[name]):
+            return name
+
+    return None
+
+# A Graph applied to the pipeline already in the daemon ("run incremental"):
+# only the differences are applied. Modules whose class or arg has changed
+# are recreated, unchanged ones are left running untouched (with their
+# counters, tasks, and connections that are still wanted), and modules and
+# ports that are not in the script any more are destroyed.
+#
+# Modules and ports without a name are matched to existing ones of the same
+# class (driver) and arg, in the order of their names. Tasks of unchanged
+# modules are assumed to be attached already.
+class IncrementalGraph(Graph):
+    def __init__(self, softnic):
+        Graph.__init__(self, softnic)
+
+        self.live_ports = dict((p['name'], p) for p in softnic.list_ports())
+
+        names = [m['name'] for m in softnic.list_modules()]
+        with softnic.pipeline() as p:
+            futures = [p.get_module_info(name) for name in names]
+
+        self.live_modules = dict((name, f.result()) \
+                for name, f in zip(names, futures))
+
+        self.claimed_ports = set()
+        self.changed_ports = []     # (name, driver, arg) to be recreated
+
+    # New ports are created right away. Changed ones are recreated when the
+    # graph is applied, as modules using them must be destroyed first.
+    def add_port(self, driver, name, arg):
+        arg = _canonical(arg)
+
+        def same(port):
+            return port['driver'] == driver and \
+                    _canonical(port.get('arg')) == arg
+
+        if name is None:
+            name = _match(self.live_ports, self.claimed_ports, same)
+            if name is None:
+                return self.softnic.create_port(driver, None, arg)['name']
+
+        elif name in self.claimed_ports:
+            raise self.softnic.APIError('Port %s is already used' % name)
+
+        elif name not in self.live_ports:
+            return self.softnic.create_port(driver, name, arg)['name']
+
+        elif not same(self.live_ports[name]):
+            self.changed_ports.append((name, driver, arg))
+
+        self.claimed_ports.add(name)
+        return name
+
+    def apply(self):
+        desired = self.desc['modules']
+        live = self.live_modules
+
+        changed_ports = set(name for name, _, _ in self.changed_ports)
+
+        def same(info, entry):
+            arg = _canonical(entry.get('arg'))
+            return info['mclass'] == entry['mclass'] and \
+                    _canonical(info.get('arg')) == arg and \
+                    not _refers_to(arg, changed_ports)
+
+        # index in desired -> name of the existing module to keep
+        kept = {}
+        claimed = set()
+
+        for i, entry in enumerate(desired):
+            name = entry.get('name')
+            if name in live:
+                claimed.add(name)
+                if same(live[name], entry):
+                    kept[i] = name
+
+        for i, entry in enumerate(desired):
+            if 'name' not in entry:
+                name = _match(live, claimed, lambda info: same(info, entry))
+                if name is not None:
+                    claimed.add(name)
+                    kept[i] = name
+
+        kept_names = set(kept.itervalues())
+
+        # new (or recreated) modules, by their index in desired
+        new = {}
+        desc = {'modules': [], 'edges': [], 'tasks': []}
+        for i, entry in enumerate(desired):
+            if i not in kept:
+                new[i] = len(desc['modules'])
+                desc['modules'].append(entry)
+
+        def ref(r):
+            if isinstance(r, int):
+                return kept.get(r, new.get(r))
+            return r
+
+        # connections to destroyed modules go away with them
+        existing = set()
+        for name in kept_names:
+            for gate in live[name]['gates']:
+                if gate['name'] in kept_names:
+                    existing.add((name, gate['gate'], gate['name']))
+
+        wanted = set()
+        for edge in self.desc['edges']:
+            m1 = ref(edge['m1'])
+            m2 = ref(edge['m2'])
+            if (m1, edge['gate'], m2) in existing:
+                wanted.add((m1, edge['gate'], m2))
+            else:
+                desc['edges'].append(
+                        {'m1': m1, 'gate': edge['gate'], 'm2': m2})
+
+        for task in self.desc['tasks']:
+            if not (isinstance(task['name'], int) and task['name'] in kept):
+                desc['tasks'].append(dict(task, name=ref(task['name'])))
+
+        disconnected = [(m1, gate) for m1, gate, m2 in sorted(existing) \
+                if (m1, gate, m2) not in wanted]
+        destroyed = [name for name in live if name not in kept_names]
+        removed_ports = [name for name in self.live_ports \
+                if name not in self.claimed_ports]
+
+        futures = []
+        applied = None
+        with self.softnic.batch() as b:
+            for m1, gate in disconnected:
+                futures.append(b.disconnect_modules(m1, gate))
+            for name in destroyed:
+                futures.append(b.destroy_module(name))
+            for name, _, _ in self.changed_ports:
+                futures.append(b.destroy_port(name))
+            for name in removed_ports:
+                futures.append(b.destroy_port(name))
+            for name, driver, arg in self.changed_ports:
+                futures.append(b.create_port(driver, name, arg))
+            if desc['modules'] or desc['edges'] or desc['tasks']:
+                applied = b.apply_graph(desc)
+                futures.append(applied)
+
+        for f in futures:
+            f.result()      # raises the first error, if any
+
+        for i, module in enumerate(self.modules):
+            if i in kept:
+                module.name = kept[i]
+            else:
+                module.name = applied.result()['modules'][new[i]]
+            module.graph_index = None
+
+        return '%d modules unchanged, %d created, %d destroyed; ' \
+                '%d connections made, %d removed' % \
+                (len(kept), len(desc['modules']), len(destroyed),
+                 len(desc['edges']), len(disconnected))
+
+# Stands in for the SoftNIC object in a script that builds a Graph: tasks are
+# attached as part of the graph, and everything else goes to the daemon.
+class GraphSoftNIC(object):
+    def __init__(self, softnic, graph):
+        self._softnic = softnic
+        self._graph = graph
+
+    def __getattr__(self, name):
+        return getattr(self._softnic, name)
+
+    def attach_task(self, m, tid, tc=None, wid=None):
+        if (tc is None) == (wid is None):
+            raise self._softnic.APIError('You should specify either ' \
+                    '"tc" or "wid", but not both')
+
+        self._graph.add_task(m, tid, tc, wid)
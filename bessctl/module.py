@@ -1,8 +1,17 @@
 from port import Port
 
 class Module(object):
+    graph = None    # a Graph, if the script is built offline (see graph.py)
+
     def __init__(self, name = None, arg = None, **kwargs):
         self.name = '<uninitialized>'
+
+        if self.graph is not None:
+            self.graph_index = self.graph.add_module(self,
+                    self.__class__.__name__, name,
+                    self.choose_arg(arg, kwargs))
+            self.name = name if name is not None else '<pending>'
+            return
  
         ret = self.softnic.create_module(self.__class__.__name__, name, 
                 self.choose_arg(arg, kwargs))
@@ -46,7 +55,10 @@ class Module(object):
             assert False, '%s is not a module' % next_mod
 
         #print 'Connecting %s[%d] -> %s' % (self.name, gate, next_mod.name)
-        self.softnic.connect_modules(self.name, next_mod.name, gate)
+        if self.graph is not None:
+            self.graph.add_edge(self, gate, next_mod)
+        else:
+            self.softnic.connect_modules(self.name, next_mod.name, gate)
         return next_mod     # for a->b->c syntax
 
     def query(self, arg = None, **kwargs):
@@ -1,8 +1,15 @@
 class Port(object):
+    graph = None    # a Graph, if the script is built offline (see graph.py)
+
     def __init__(self, driver = 'PMD', name = None, arg = None, **kwargs):
         self.name = '<uninitialized>'
         self.driver = driver
 
+        if self.graph is not None:
+            self.name = self.graph.add_port(driver, name,
+                    self.choose_arg(arg, kwargs))
+            return
+
         ret = self.softnic.create_port(driver, name, 
                 self.choose_arg(arg, kwargs))
 
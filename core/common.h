@@ -23,6 +23,9 @@ ct_assert(MAX_QUEUES_PER_DIR < QUEUE_UNKNOWN);
 extern const struct global_opts {
 	int wid_to_core[MAX_WORKERS];
 	uint16_t port;		/* TCP port for controller (0 for default) */
+	const char *unix_path;	/* AF_UNIX socket for controller (optional) */
+	const char *unix_group;	/* if set, only its members can connect */
+	int shm_stats_ms;	/* interval of counter export (0 if disabled) */
 	int foreground;		/* If 1, not daemonized */
 	int kill_existing;	/* If 1, kill existing BESS instance */
 	int print_tc_stats;	/* If 1, print TC stats every second */
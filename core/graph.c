@@ -0,0 +1,591 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <stdint.h>
+#include <string.h>
+#include <errno.h>
+
+#include <rte_malloc.h>
+
+#include "graph.h"
+#include "module.h"
+#include "worker.h"
+
+/* A module in the description: either a new one (idx >= 0),
+ * or an existing one (m) */
+struct graph_ref {
+	int idx;
+	struct module *m;
+};
+
+struct graph_module {
+	const char *name;		/* NULL for a default name */
+	const struct mclass *mclass;
+	struct snobj *arg;
+	struct module *m;		/* once created */
+};
+
+struct graph_edge {
+	struct graph_ref m1;
+	gate_t gate;
+	struct graph_ref m2;
+};
+
+struct graph_task {
+	struct graph_ref m;
+	task_id_t tid;
+	int wid;
+	struct tc *c;			/* NULL for a default TC on wid */
+};
+
+struct graph {
+	int num_modules;
+	struct graph_module *modules;
+
+	int num_edges;
+	struct graph_edge *edges;
+
+	int num_tasks;
+	struct graph_task *tasks;
+};
+
+static struct snobj *get_list(struct snobj *arg, const char *key,
+		int *num)
+{
+	struct snobj *l = snobj_map_get(arg, key);
+
+	*num = 0;
+
+	if (!l)
+		return NULL;
+
+	if (snobj_type(l) != TYPE_LIST)
+		return snobj_err(EINVAL, "'%s' must be a list", key);
+
+	*num = snobj_size(l);
+	return NULL;
+}
+
+static void free_graph(struct graph *g)
+{
+	rte_free(g->modules);
+	rte_free(g->edges);
+	rte_free(g->tasks);
+}
+
+static int find_new_module(const struct graph *g, const char *name)
+{
+	for (int i = 0; i < g->num_modules; i++) {
+		if (g->modules[i].name && strcmp(g->modules[i].name, name) == 0)
+			return i;
+	}
+
+	return -1;
+}
+
+/* section[i] is the entry that has the reference, for error messages */
+static struct snobj *resolve_ref(const struct graph *g, struct snobj *ref,
+		struct graph_ref *r, const char *section, int i)
+{
+	const char *name;
+
+	r->idx = -1;
+	r->m = NULL;
+
+	if (!ref)
+		return snobj_err(EINVAL, "%s[%d]: Missing module", section, i);
+
+	if (snobj_type(ref) == TYPE_INT) {
+		int64_t idx = snobj_int_get(ref);
+
+		if (idx < 0 || idx >= g->num_modules)
+			return snobj_err(EINVAL, "%s[%d]: No module at index "
+					"%ld in 'modules'", section, i,
+					(long)idx);
+
+		r->idx = idx;
+		return NULL;
+	}
+
+	name = snobj_str_get(ref);
+	if (!name)
+		return snobj_err(EINVAL, "%s[%d]: A module must be a name "
+				"or an index", section, i);
+
+	r->idx = find_new_module(g, name);
+	if (r->idx < 0) {
+		r->m = find_module(name);
+		if (!r->m)
+			return snobj_err(ENOENT, "%s[%d]: No module '%s' found",
+					section, i, name);
+	}
+
+	return NULL;
+}
+
+static const struct mclass *ref_mclass(const struct graph *g,
+		const struct graph_ref *r)
+{
+	return r->idx >= 0 ? g->modules[r->idx].mclass : r->m->mclass;
+}
+
+static struct module *ref_module(const struct graph *g,
+		const struct graph_ref *r)
+{
+	return r->idx >= 0 ? g->modules[r->idx].m : r->m;
+}
+
+static int same_ref(const struct graph_ref *a, const struct graph_ref *b)
+{
+	return a->idx == b->idx && a->m == b->m;
+}
+
+static struct snobj *parse_modules(struct graph *g, struct snobj *list)
+{
+	for (int i = 0; i < g->num_modules; i++) {
+		struct snobj *entry = snobj_list_get(list, i);
+		struct graph_module *gm = &g->modules[i];
+		const char *mclass_name;
+
+		if (snobj_type(entry) != TYPE_MAP)
+			return snobj_err(EINVAL, "modules[%d]: must be a map", i);
+
+		mclass_name = snobj_eval_str(entry, "mclass");
+		if (!mclass_name)
+			return snobj_err(EINVAL, "modules[%d]: Missing 'mclass' "
+					"field", i);
+
+		gm->mclass = find_mclass(mclass_name);
+		if (!gm->mclass)
+			return snobj_err(ENOENT, "modules[%d]: No mclass '%s' "
+					"found", i, mclass_name);
+
+		gm->arg = snobj_eval(entry, "arg");
+
+		gm->name = snobj_eval_str(entry, "name");
+		if (!gm->name)
+			continue;
+
+		if (find_module(gm->name))
+			return snobj_err(EEXIST, "modules[%d]: Module '%s' "
+					"already exists", i, gm->name);
+
+		if (find_new_module(g, gm->name) < i)
+			return snobj_err(EEXIST, "modules[%d]: Module '%s' "
+					"appears twice", i, gm->name);
+	}
+
+	return NULL;
+}
+
+static struct snobj *parse_edges(struct graph *g, struct snobj *list)
+{
+	for (int i = 0; i < g->num_edges; i++) {
+		struct snobj *entry = snobj_list_get(list, i);
+		struct graph_edge *e = &g->edges[i];
+		struct snobj *err;
+		uint64_t gate;
+
+		if (snobj_type(entry) != TYPE_MAP)
+			return snobj_err(EINVAL, "edges[%d]: must be a map", i);
+
+		if ((err = resolve_ref(g, snobj_map_get(entry, "m1"), &e->m1,
+						"edges", i)) ||
+		    (err = resolve_ref(g, snobj_map_get(entry, "m2"), &e->m2,
+						"edges", i)))
+			return err;
+
+		gate = snobj_eval_uint(entry, "gate");
+		if (gate >= MAX_OUTPUT_GATES)
+			return snobj_err(EINVAL, "edges[%d]: 'gate' must be "
+					"less than %d", i, MAX_OUTPUT_GATES);
+
+		e->gate = gate;
+
+		if (!ref_mclass(g, &e->m2)->process_batch)
+			return snobj_err(EINVAL, "edges[%d]: Module class '%s' "
+					"has no input gate", i,
+					ref_mclass(g, &e->m2)->name);
+
+		if (e->m1.m && e->gate < e->m1.m->allocated_gates &&
+				e->m1.m->gates[e->gate].m)
+			return snobj_err(EBUSY, "edges[%d]: '%s'[%hu] is already "
+					"connected", i, e->m1.m->name, e->gate);
+
+		for (int j = 0; j < i; j++) {
+			if (same_ref(&g->edges[j].m1, &e->m1) &&
+					g->edges[j].gate == e->gate)
+				return snobj_err(EBUSY, "edges[%d]: The output "
+						"gate is already used by "
+						"edges[%d]", i, j);
+		}
+	}
+
+	return NULL;
+}
+
+/* "tc" (a TC created by the user), or "wid" (for a default TC) */
+static struct snobj *parse_task_tc(struct snobj *entry, struct graph_task *t,
+		int i)
+{
+	const char *tc_name = snobj_eval_str(entry, "tc");
+	uint64_t wid;
+
+	if (tc_name) {
+		if (snobj_eval_exists(entry, "wid"))
+			return snobj_err(EINVAL, "tasks[%d]: Either 'tc' or "
+					"'wid' must be given, but not both", i);
+
+		if (!(t->c = find_tc(tc_name)))
+			return snobj_err(ENOENT, "tasks[%d]: No TC '%s' found",
+					i, tc_name);
+
+		if (!cdlist_is_empty(&t->c->pgroups))
+			return snobj_err(EBUSY, "tasks[%d]: TC '%s' has child "
+					"classes", i, tc_name);
+
+		t->wid = get_sched_wid(t->c->s);
+		return NULL;
+	}
+
+	wid = snobj_eval_uint(entry, "wid");
+	if (wid >= MAX_WORKERS)
+		return snobj_err(EINVAL, "tasks[%d]: 'wid' must be "
+				"between 0 and %d", i, MAX_WORKERS - 1);
+
+	t->wid = wid;
+
+	if (!is_worker_active(t->wid))
+		return snobj_err(EINVAL, "tasks[%d]: Worker %d does not "
+				"exist", i, t->wid);
+
+	return NULL;
+}
+
+static struct snobj *parse_tasks(struct graph *g, struct snobj *list)
+{
+	for (int i = 0; i < g->num_tasks; i++) {
+		struct snobj *entry = snobj_list_get(list, i);
+		struct graph_task *t = &g->tasks[i];
+		struct snobj *err;
+		uint64_t tid;
+
+		if (snobj_type(entry) != TYPE_MAP)
+			return snobj_err(EINVAL, "tasks[%d]: must be a map", i);
+
+		err = resolve_ref(g, snobj_map_get(entry, "name"), &t->m,
+				"tasks", i);
+		if (err)
+			return err;
+
+		tid = snobj_eval_uint(entry, "taskid");
+		if (tid >= MAX_TASKS_PER_MODULE)
+			return snobj_err(EINVAL, "tasks[%d]: 'taskid' must be "
+					"between 0 and %d", i,
+					MAX_TASKS_PER_MODULE - 1);
+
+		t->tid = tid;
+
+		err = parse_task_tc(entry, t, i);
+		if (err)
+			return err;
+
+		for (int j = 0; j < i; j++) {
+			if (same_ref(&g->tasks[j].m, &t->m) &&
+					g->tasks[j].tid == t->tid)
+				return snobj_err(EBUSY, "tasks[%d]: The task is "
+						"already attached by tasks[%d]",
+						i, j);
+		}
+	}
+
+	return NULL;
+}
+
+/* Tasks of new modules can be checked only once they are created */
+static struct snobj *check_tasks(const struct graph *g)
+{
+	for (int i = 0; i < g->num_tasks; i++) {
+		const struct graph_task *t = &g->tasks[i];
+		struct module *m = ref_module(g, &t->m);
+
+		if (!m->tasks[t->tid])
+			return snobj_err(ENOENT, "tasks[%d]: Task %s:%hu does "
+					"not exist", i, m->name, t->tid);
+
+		if (task_is_attached(m->tasks[t->tid]))
+			return snobj_err(EBUSY, "tasks[%d]: Task %s:%hu is "
+					"already attached to a TC", i,
+					m->name, t->tid);
+	}
+
+	return NULL;
+}
+
+/* Undoes the first num_edges edges and destroys all new modules */
+static void rollback(struct graph *g, int num_edges)
+{
+	for (int i = num_edges - 1; i >= 0; i--) {
+		struct graph_edge *e = &g->edges[i];
+
+		/* edges of new modules go away with them */
+		if (e->m1.m)
+			disconnect_modules(e->m1.m, e->gate);
+	}
+
+	for (int i = g->num_modules - 1; i >= 0; i--) {
+		if (g->modules[i].m) {
+			destroy_module(g->modules[i].m);
+			g->modules[i].m = NULL;
+		}
+	}
+}
+
+static struct snobj *apply(struct graph *g)
+{
+	struct snobj *err;
+	struct snobj *names;
+
+	for (int i = 0; i < g->num_modules; i++) {
+		struct graph_module *gm = &g->modules[i];
+
+		gm->m = create_module(gm->name, gm->mclass, gm->arg, &err);
+		if (!gm->m) {
+			/* the error is from the module class */
+			snobj_map_set(err, "index", snobj_int(i));
+			rollback(g, 0);
+			return err;
+		}
+	}
+
+	for (int i = 0; i < g->num_edges; i++) {
+		struct graph_edge *e = &g->edges[i];
+		struct module *m1 = ref_module(g, &e->m1);
+		struct module *m2 = ref_module(g, &e->m2);
+		int ret;
+
+		ret = connect_modules(m1, e->gate, m2);
+		if (ret < 0) {
+			err = snobj_err(-ret, "edges[%d]: Connection "
+					"'%s'[%hu]->'%s' failed",
+					i, m1->name, e->gate, m2->name);
+			rollback(g, i);
+			return err;
+		}
+	}
+
+	err = check_tasks(g);
+	if (err) {
+		rollback(g, g->num_edges);
+		return err;
+	}
+
+	for (int i = 0; i < g->num_tasks; i++) {
+		struct graph_task *t = &g->tasks[i];
+		struct module *m = ref_module(g, &t->m);
+
+		if (t->c)
+			assign_tc(m->tasks[t->tid], t->c);
+		else
+			assign_default_tc(workers[t->wid]->s, m->tasks[t->tid]);
+	}
+
+	names = snobj_list();
+	for (int i = 0; i < g->num_modules; i++)
+		snobj_list_add(names, snobj_str(g->modules[i].m->name));
+
+	return names;
+}
+
+/* New modules are not run by any worker until they are connected from
+ * existing ones, or their tasks are attached */
+static uint64_t workers_to_pause(const struct graph *g)
+{
+	struct module **modules;
+	uint64_t wids = 0;
+	int n = 0;
+
+	modules = rte_zmalloc("graph_m1", sizeof(*modules) * (g->num_edges ? : 1),
+			0);
+	if (!modules)
+		return ~0ull;
+
+	for (int i = 0; i < g->num_edges; i++) {
+		if (g->edges[i].m1.m)
+			modules[n++] = g->edges[i].m1.m;
+	}
+
+	wids = get_affected_workers(modules, n);
+	rte_free(modules);
+
+	for (int i = 0; i < g->num_tasks; i++)
+		wids |= (1ull << g->tasks[i].wid);
+
+	return wids;
+}
+
+struct snobj *apply_graph(struct snobj *arg)
+{
+	struct graph g = {};
+
+	struct snobj *r;
+	struct snobj *names;
+
+	uint64_t paused;
+
+	if (!arg || snobj_type(arg) != TYPE_MAP)
+		return snobj_err(EINVAL, "Argument must be a map");
+
+	if ((r = get_list(arg, "modules", &g.num_modules)) ||
+	    (r = get_list(arg, "edges", &g.num_edges)) ||
+	    (r = get_list(arg, "tasks", &g.num_tasks)))
+		return r;
+
+	g.modules = rte_zmalloc("graph_modules",
+			sizeof(struct graph_module) * (g.num_modules ? : 1), 0);
+	g.edges = rte_zmalloc("graph_edges",
+			sizeof(struct graph_edge) * (g.num_edges ? : 1), 0);
+	g.tasks = rte_zmalloc("graph_tasks",
+			sizeof(struct graph_task) * (g.num_tasks ? : 1), 0);
+	if (!g.modules || !g.edges || !g.tasks) {
+		r = snobj_err(ENOMEM, "Out of memory");
+		goto out;
+	}
+
+	if ((r = parse_modules(&g, snobj_map_get(arg, "modules"))) ||
+	    (r = parse_edges(&g, snobj_map_get(arg, "edges"))) ||
+	    (r = parse_tasks(&g, snobj_map_get(arg, "tasks"))))
+		goto out;
+
+	paused = pause_workers(workers_to_pause(&g));
+
+	names = apply(&g);
+
+	resume_workers(paused);
+
+	/* e.g., tasks of new modules that are not in "tasks" */
+	adopt_orphan_tasks();
+
+	if (snobj_type(names) != TYPE_LIST) {
+		r = names;	/* error */
+		goto out;
+	}
+
+	printf("Graph applied: %d modules, %d edges, %d tasks\n",
+			g.num_modules, g.num_edges, g.num_tasks);
+
+	r = snobj_map();
+	snobj_map_set(r, "modules", names);
+
+out:
+	free_graph(&g);
+	return r;
+}
+
+static int cmp_module(const void *a, const void *b)
+{
+	uintptr_t x = (uintptr_t)*(const struct module * const *)a;
+	uintptr_t y = (uintptr_t)*(const struct module * const *)b;
+
+	return (x > y) - (x < y);
+}
+
+static int module_index(const struct module **sorted, int n,
+		const struct module *m)
+{
+	const struct module **p;
+
+	p = bsearch(&m, sorted, n, sizeof(*sorted), cmp_module);
+
+	return p ? p - sorted : -1;
+}
+
+uint64_t get_affected_workers(struct module **modules, int num_modules)
+{
+	const struct module **all;
+	char *target;
+	char *visited;
+	int *stack;
+
+	uint64_t wids = 0;
+	int n = 0;
+	int cnt;
+
+	{
+		const struct module *arr[16];
+
+		while ((cnt = list_modules(arr, 16, n)) > 0)
+			n += cnt;
+	}
+
+	all = rte_zmalloc("affected", sizeof(*all) * (n ? : 1), 0);
+	target = rte_zmalloc("affected", n ? : 1, 0);
+	visited = rte_zmalloc("affected", n ? : 1, 0);
+	stack = rte_zmalloc("affected", sizeof(*stack) * (n ? : 1), 0);
+	if (!all || !target || !visited || !stack) {
+		wids = ~0ull;	/* to be safe */
+		goto out;
+	}
+
+	n = list_modules(all, n, 0);
+	qsort(all, n, sizeof(*all), cmp_module);
+
+	for (int i = 0; i < num_modules; i++) {
+		int idx = module_index(all, n, modules[i]);
+		if (idx >= 0)
+			target[idx] = 1;
+	}
+
+	for (int wid = 0; wid < MAX_WORKERS; wid++) {
+		struct task *t;
+		int top = 0;
+
+		if (!is_worker_active(wid))
+			continue;
+
+		memset(visited, 0, n);
+
+		cdlist_for_each_entry(t, &all_tasks, all_tasks) {
+			int idx;
+
+			if (!t->c || t->c->s != workers[wid]->s)
+				continue;
+
+			idx = module_index(all, n, t->m);
+			if (idx >= 0 && !visited[idx]) {
+				visited[idx] = 1;
+				stack[top++] = idx;
+			}
+		}
+
+		/* depth-first search, along the output gates */
+		while (top > 0) {
+			const struct module *m = all[stack[--top]];
+
+			if (target[stack[top]]) {
+				wids |= (1ull << wid);
+				break;
+			}
+
+			for (int i = 0; i < m->allocated_gates; i++) {
+				int idx;
+
+				if (!m->gates[i].m)
+					continue;
+
+				idx = module_index(all, n, m->gates[i].m);
+				if (idx >= 0 && !visited[idx]) {
+					visited[idx] = 1;
+					stack[top++] = idx;
+				}
+			}
+		}
+	}
+
+out:
+	rte_free(all);
+	rte_free(target);
+	rte_free(visited);
+	rte_free(stack);
+
+	return wids;
+}
@@ -0,0 +1,37 @@
+#ifndef _GRAPH_H_
+#define _GRAPH_H_
+
+#include <stdint.h>
+
+#include "snobj.h"
+
+/* Adds a whole pipeline to the current one, all or nothing (see
+ * "apply_graph" in snctl.c). The description is a map:
+ *
+ *   {"modules": [{"name": "src", "mclass": "Source", "arg": ...}, ...],
+ *    "edges": [{"m1": "src", "gate": 0, "m2": 1}, ...],
+ *    "tasks": [{"name": "src", "taskid": 0, "wid": 0}, ...]}
+ *
+ * Modules are created in order ("name" and "arg" are optional).
+ * Edges and tasks refer to a module either by name (of a new or existing
+ * module), or by its index in "modules" (e.g., if it has no name).
+ * "gate" and "taskid" default to 0. A task can be attached to a TC created
+ * beforehand with "tc" (by name) instead of "wid".
+ *
+ * The description is checked as a whole before anything is changed.
+ * Then only the affected workers are paused while it is applied: those
+ * running existing modules that get new connections, and those that get
+ * tasks. If anything fails (e.g., the init of a module), all changes are
+ * undone.
+ *
+ * Returns {"modules": [names of the new modules]}, or an error. */
+struct snobj *apply_graph(struct snobj *arg);
+
+struct module;
+
+/* Bitmask of the active workers (bit wid) that may run any of the modules:
+ * those with a task of the module, or of a module upstream of it.
+ * A change to the modules needs only these workers to be paused. */
+uint64_t get_affected_workers(struct module **modules, int num_modules);
+
+#endif
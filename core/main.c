@@ -20,6 +20,7 @@
 #include "worker.h"
 #include "driver.h"
 #include "syslog.h"
+#include "shmstats.h"
 
 const struct global_opts global_opts;
 static struct global_opts *opts = (struct global_opts *)&global_opts;
@@ -27,7 +28,8 @@ static struct global_opts *opts = (struct global_opts *)&global_opts;
 static void print_usage(char *exec_name)
 {
 	fprintf(stderr, "Usage: %s" \
-			" [-t] [-c <core list>] [-p <port>] [-f] [-k]\n\n",
+			" [-t] [-c <core list>] [-p <port>] [-u <path>]" \
+			" [-g <group>] [-m <msec>] [-f] [-k]\n\n",
 			exec_name);
 
 	fprintf(stderr, "  %-16s Dump the size of internal data structures\n",
@@ -37,6 +39,15 @@ static void print_usage(char *exec_name)
 	fprintf(stderr, "  %-16s Specifies the TCP port on which SoftNIC" \
 			" listens for controller connections\n",
 			"-p <port>");
+	fprintf(stderr, "  %-16s Also listens on a Unix domain socket" \
+			" (e.g., /var/run/bessd.sock)\n",
+			"-u <path>");
+	fprintf(stderr, "  %-16s Only the group can connect to the socket" \
+			" of -u (anyone if not given)\n",
+			"-g <group>");
+	fprintf(stderr, "  %-16s Exports port/gate counters to " \
+			SHM_STATS_PATH " every <msec> milliseconds\n",
+			"-m <msec>");
 	fprintf(stderr, "  %-16s Run BESS in foreground mode " \
 			" (for developers)\n",
 			"-f");
@@ -54,7 +65,7 @@ static void parse_args(int argc, char **argv)
 
 	num_workers = 0;
 
-	while ((c = getopt(argc, argv, ":tc:p:fks")) != -1) {
+	while ((c = getopt(argc, argv, ":tc:p:u:g:m:fks")) != -1) {
 		switch (c) {
 		case 't':
 			dump_types();
@@ -65,6 +76,22 @@ static void parse_args(int argc, char **argv)
 			sscanf(optarg, "%hu", &opts->port);
 			break;
 
+		case 'u':
+			opts->unix_path = optarg;
+			break;
+
+		case 'g':
+			opts->unix_group = optarg;
+			break;
+
+		case 'm':
+			sscanf(optarg, "%d", &opts->shm_stats_ms);
+			if (opts->shm_stats_ms <= 0) {
+				fprintf(stderr, "Invalid interval for -m\n");
+				print_usage(argv[0]);
+			}
+			break;
+
 		case 'f':
 			opts->foreground = 1;
 			break;
@@ -301,7 +328,11 @@ int main(int argc, char **argv)
 	init_mempool();
 	init_drivers();
 
-	setup_master(opts->port);
+	setup_master(opts->port, opts->unix_path, opts->unix_group);
+
+	if (opts->shm_stats_ms && setup_shm_stats(opts->shm_stats_ms) < 0)
+		fprintf(stderr, "WARNING: counters are not exported to " \
+				SHM_STATS_PATH "\n");
 
 	/* signal the parent that all initialization has been finished */
 	if (!opts->foreground) {
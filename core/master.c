@@ -6,11 +6,14 @@
 #include <errno.h>
 #include <sched.h>
 #include <assert.h>
+#include <grp.h>
 
 #include <netinet/tcp.h>
 
 #include <sys/socket.h>
+#include <sys/stat.h>
 #include <sys/epoll.h>
+#include <sys/un.h>
 
 #include <rte_config.h>
 #include <rte_lcore.h>
@@ -20,6 +23,9 @@
 #include "worker.h"
 #include "snobj.h"
 #include "snctl.h"
+#include "shmstats.h"
+#include "subscribe.h"
+#include "time.h"
 
 /* Port this SoftNIC instance listens on. 
  * Panda came up with this default number */
@@ -30,6 +36,7 @@
 
 static struct {
 	int listen_fd;
+	int unix_fd;		/* -1 if no Unix domain socket is used */
 	int epoll_fd;
 
 	struct client *lock_holder;	/* NULL if unlocked */
@@ -37,6 +44,7 @@ static struct {
 	struct cdlist_head clients_all;
 	struct cdlist_head clients_lock_waiting;
 	struct cdlist_head clients_pause_holding;
+	struct cdlist_head clients_subscribed;
 } master;
 
 static void reset_core_affinity()
@@ -114,12 +122,107 @@ static int init_listen_fd(uint16_t port)
 	return listen_fd;
 }
 
-static struct client *init_client(int fd, struct sockaddr_in c_addr)
+static const char *unix_sock_path;	/* removed on exit */
+
+static void remove_unix_path()
+{
+	unlink(unix_sock_path);
+}
+
+static int init_unix_listen_fd(const char *path, const char *group)
+{
+	struct sockaddr_un s_addr;
+	struct stat st;
+
+	int listen_fd;
+
+	if (strlen(path) >= sizeof(s_addr.sun_path)) {
+		fprintf(stderr, "Error: too long socket path '%s'\n", path);
+		exit(EXIT_FAILURE);
+	}
+
+	if ((listen_fd = socket(AF_UNIX, SOCK_STREAM, 0)) < 0) {
+		perror("Channel socket(AF_UNIX) failed");
+		exit(EXIT_FAILURE);
+	}
+
+	memset(&s_addr, 0, sizeof(s_addr));
+
+	s_addr.sun_family = AF_UNIX;
+	strcpy(s_addr.sun_path, path);
+
+	/* a stale one from a previous instance? (pidfile ensures uniqueness)
+	 * Anything other than a socket is not ours to remove. */
+	if (lstat(path, &st) == 0) {
+		if (!S_ISSOCK(st.st_mode)) {
+			fprintf(stderr, "Error: '%s' exists and is not "
+					"a socket\n", path);
+			exit(EXIT_FAILURE);
+		}
+
+		unlink(path);
+	}
+
+	if (bind(listen_fd, (struct sockaddr *)&s_addr, sizeof(s_addr)) < 0) {
+		perror("bind(AF_UNIX)");
+		exit(EXIT_FAILURE);
+	}
+
+	/* bessd runs as root, so clients could not connect with the mode
+	 * given by its umask. Without a group, any local user can, as with
+	 * the TCP port on the loopback interface. */
+	if (group) {
+		struct group *gr = getgrnam(group);
+
+		if (!gr) {
+			fprintf(stderr, "Error: no group '%s'\n", group);
+			exit(EXIT_FAILURE);
+		}
+
+		if (chown(path, -1, gr->gr_gid) < 0 || chmod(path, 0660) < 0) {
+			perror("chown/chmod(AF_UNIX)");
+			exit(EXIT_FAILURE);
+		}
+	} else if (chmod(path, 0666) < 0) {
+		perror("chmod(AF_UNIX)");
+		exit(EXIT_FAILURE);
+	}
+
+	unix_sock_path = path;
+	atexit(remove_unix_path);
+
+	if (listen(listen_fd, 0) < 0) {
+		perror("listen(AF_UNIX)");
+		exit(EXIT_FAILURE);
+	}
+
+	printf("Master: listening on %s\n", path);
+
+	return listen_fd;
+}
+
+static const char *client_name(struct client *c)
+{
+	static char buf[64];
+
+	if (c->is_unix)
+		return "(unix)";
+
+	snprintf(buf, sizeof(buf), "%s:%hu",
+			inet_ntoa(c->addr.sin_addr), c->addr.sin_port);
+
+	return buf;
+}
+
+static struct client *init_client(int fd, struct sockaddr_in c_addr,
+		int is_unix)
 {
 	struct client *c;
 
 	/* because this is just optimization, we can ignore errors */
-	setsockopt(fd, IPPROTO_TCP, TCP_NODELAY, &(int){1}, sizeof(int));
+	if (!is_unix)
+		setsockopt(fd, IPPROTO_TCP, TCP_NODELAY, 
+				&(int){1}, sizeof(int));
 
 	c = rte_zmalloc("client", sizeof(struct client), 0);
 	if (!c) 
@@ -127,6 +230,7 @@ static struct client *init_client(int fd, struct sockaddr_in c_addr)
 
 	c->fd = fd;
 	c->addr = c_addr;
+	c->is_unix = is_unix;
 	c->buf_size = INIT_BUF_SIZE;
 
 	c->buf = rte_zmalloc("client_buf", c->buf_size, 0);
@@ -138,14 +242,14 @@ static struct client *init_client(int fd, struct sockaddr_in c_addr)
 	cdlist_add_tail(&master.clients_all, &c->master_all);
 	cdlist_item_init(&c->master_lock_waiting);
 	cdlist_item_init(&c->master_pause_holding);
+	cdlist_item_init(&c->master_subscribed);
 
 	return c;
 }
 
 static void close_client(struct client *c)
 {
-	printf("Master: client %s:%hu disconnected\n", 
-			inet_ntoa(c->addr.sin_addr), c->addr.sin_port);
+	printf("Master: client %s disconnected\n", client_name(c));
 
 	close(c->fd);
 
@@ -167,6 +271,11 @@ static void close_client(struct client *c)
 		cdlist_del(&c->master_pause_holding);
 	}
 
+	if (c->sub) {
+		cdlist_del(&c->master_subscribed);
+		free_subscription(c->sub);
+	}
+
 	cdlist_del(&c->master_lock_waiting);
 	cdlist_del(&c->master_all);
 
@@ -185,16 +294,22 @@ static struct client *accept_client(int listen_fd)
 
 	struct epoll_event ev;
 
+	int is_unix = (listen_fd == master.unix_fd);
 	int ret;
 
-	conn_fd = accept(listen_fd, (struct sockaddr *)&c_addr, 
-			&addrlen);
+	memset(&c_addr, 0, sizeof(c_addr));
+
+	if (is_unix)
+		conn_fd = accept(listen_fd, NULL, NULL);
+	else
+		conn_fd = accept(listen_fd, (struct sockaddr *)&c_addr, 
+				&addrlen);
 	if (conn_fd < 0) {
 		perror("accept()");
 		return NULL;
 	}
 
-	c = init_client(conn_fd, c_addr);
+	c = init_client(conn_fd, c_addr, is_unix);
 	if (!c) {
 		close(conn_fd);
 		return NULL;
@@ -213,66 +328,102 @@ static struct client *accept_client(int listen_fd)
 	return c;
 }
 
-static void request_done(struct client *c)
+/* starts sending r to the client (a response or a pushed message) */
+static int start_send(struct client *c, struct snobj *r)
 {
 	struct epoll_event ev;
 
-	struct snobj *q = NULL;
-	struct snobj *r = NULL;
+	char *buf;
 
 	int ret;
 
-	q = snobj_decode(c->buf, c->msg_len);
-	if (!q) {
-		fprintf(stderr, "Incorrect message\n");
-		goto err;
-	}
-
-	r = handle_request(c, q);
-
 	ev.events = EPOLLOUT;
 	ev.data.ptr = c;
 
 	ret = epoll_ctl(master.epoll_fd, EPOLL_CTL_MOD, c->fd, &ev);
 	if (ret < 0) {
 		perror("epoll_ctl(EPOLL_CTL_MOD, listen_fd, OUT)");
-		goto err;
+		return -1;
 	}
 
-	{
-		char *buf;
+	c->buf_off = 0;
+	c->msg_len_off = 0;
+
+	c->msg_len = snobj_encode(r, &buf, 0);
+	if (c->msg_len == 0) {
+		fprintf(stderr, "Encoding error\n");
+		return -1;
+	}
 
-		c->buf_off = 0;
-		c->msg_len_off = 0;
+	/* XXX: DRY */
+	if (c->msg_len > c->buf_size) {
+		char *new_buf;
 
-		c->msg_len = snobj_encode(r, &buf, 0);
-		if (c->msg_len == 0) {
-			fprintf(stderr, "Encoding error\n");
-			goto err;
+		if (c->msg_len > MAX_BUF_SIZE)  {
+			fprintf(stderr, "too large response was attempted\n");
+			_FREE(buf);
+			return -1;
 		}
 
-		/* XXX: DRY */
-		if (c->msg_len > c->buf_size) {
-			char *new_buf;
+		new_buf = rte_realloc(c->buf, c->msg_len, 0);
+		if (!new_buf) {
+			_FREE(buf);
+			return -1;
+		}
 
-			if (c->msg_len > MAX_BUF_SIZE)  {
-				fprintf(stderr, "too large response was attempted\n");
-				goto err;
-			}
+		c->buf = new_buf;
+		c->buf_size = c->msg_len;
+	}
 
-			new_buf = rte_realloc(c->buf, c->msg_len, 0);
-			if (!new_buf)
-				goto err;
+	memcpy(c->buf, buf, c->msg_len);
 
-			c->buf = new_buf;
-			c->buf_size = c->msg_len;
-		}
+	if (buf)
+		_FREE(buf);
 
-		memcpy(c->buf, buf, c->msg_len);
+	return 0;
+}
 
-		if (buf)
-			_FREE(buf);
+/* the client may have (un)subscribed with the request */
+static void update_subscription(struct client *c)
+{
+	if (c->sub && !cdlist_is_hooked(&c->master_subscribed)) {
+		cdlist_add_tail(&master.clients_subscribed, 
+				&c->master_subscribed);
+	} else if (!c->sub && cdlist_is_hooked(&c->master_subscribed)) {
+		cdlist_del(&c->master_subscribed);
+		cdlist_item_init(&c->master_subscribed);
 	}
+}
+
+static void push_stats(struct client *c)
+{
+	struct snobj *r;
+
+	r = make_push(c->sub);
+
+	if (start_send(c, r) < 0)
+		close_client(c);
+
+	snobj_free(r);
+}
+
+static void request_done(struct client *c)
+{
+	struct snobj *q = NULL;
+	struct snobj *r = NULL;
+
+	q = snobj_decode(c->buf, c->msg_len);
+	if (!q) {
+		fprintf(stderr, "Incorrect message\n");
+		goto err;
+	}
+
+	r = handle_request(c, q);
+
+	update_subscription(c);
+
+	if (start_send(c, r) < 0)
+		goto err;
 
 	snobj_free(q);
 	snobj_free(r);
@@ -297,11 +448,16 @@ static void response_done(struct client *c)
 	if (ret < 0) {
 		perror("epoll_ctl(EPOLL_CTL_MOD, listen_fd, IN)");
 		close_client(c);
+		return;
 	}
 
 	c->buf_off = 0;
 	c->msg_len = 0;
 	c->msg_len_off = 0;
+
+	/* a push that became due while the client was busy */
+	if (c->sub && c->sub->next_push_ms <= get_monotonic_ms())
+		push_stats(c);
 }
 
 static void client_recv(struct client *c)
@@ -369,9 +525,11 @@ static void client_send(struct client *c)
 
 	if (c->msg_len_off < sizeof(c->msg_len)) {
 		sent = send(c->fd, ((char *)&c->msg_len) + c->msg_len_off, 
-				sizeof(c->msg_len) - c->msg_len_off, MSG_NOSIGNAL);
+				sizeof(c->msg_len) - c->msg_len_off, 
+				MSG_NOSIGNAL | MSG_DONTWAIT);
 		if (sent < 0) {
-			close_client(c);
+			if (errno != EAGAIN && errno != EWOULDBLOCK)
+				close_client(c);
 			return;
 		}
 
@@ -380,10 +538,12 @@ static void client_send(struct client *c)
 		return;
 	}
 
+	/* not to block other clients, if this one is slow to receive */
 	sent = send(c->fd, c->buf + c->buf_off, c->msg_len - c->buf_off, 
-			MSG_NOSIGNAL);
+			MSG_NOSIGNAL | MSG_DONTWAIT);
 	if (sent < 0) {
-		close_client(c);
+		if (errno != EAGAIN && errno != EWOULDBLOCK)
+			close_client(c);
 		return;
 	}
 
@@ -396,7 +556,8 @@ static void client_send(struct client *c)
 		response_done(c);
 }
 
-void init_server(uint16_t port)
+void init_server(uint16_t port, const char *unix_path,
+		const char *unix_group)
 {
 	struct epoll_event ev;
 
@@ -418,9 +579,26 @@ void init_server(uint16_t port)
 		perror("epoll_ctl(EPOLL_CTL_ADD, listen_fd)");
 		exit(EXIT_FAILURE);
 	}
+
+	master.unix_fd = -1;
+
+	if (unix_path) {
+		master.unix_fd = init_unix_listen_fd(unix_path, unix_group);
+
+		ev.events = EPOLLIN;
+		ev.data.fd = master.unix_fd;
+
+		ret = epoll_ctl(master.epoll_fd, EPOLL_CTL_ADD, 
+				master.unix_fd, &ev);
+		if (ret < 0) {
+			perror("epoll_ctl(EPOLL_CTL_ADD, unix_fd)");
+			exit(EXIT_FAILURE);
+		}
+	}
 }
 
-void setup_master(uint16_t port) 
+void setup_master(uint16_t port, const char *unix_path,
+		const char *unix_group)
 {
 	reset_core_affinity();
 	
@@ -429,49 +607,107 @@ void setup_master(uint16_t port)
 	cdlist_head_init(&master.clients_all);
 	cdlist_head_init(&master.clients_lock_waiting);
 	cdlist_head_init(&master.clients_pause_holding);
+	cdlist_head_init(&master.clients_subscribed);
 
-	init_server(port);
+	init_server(port, unix_path, unix_group);
 }
 
-void run_master() 
+/* epoll_wait() timeout until the next periodic task, or -1 if none */
+static int next_timeout()
 {
+	int timeout = shm_stats_timeout();
 	struct client *c;
+	int64_t now;
 
-	struct epoll_event ev;
+	if (cdlist_is_empty(&master.clients_subscribed))
+		return timeout;
 
-	int ret;
+	now = get_monotonic_ms();
 
-again:
-	ret = epoll_wait(master.epoll_fd, &ev, 1, -1);
-	if (ret <= 0) {
-		perror("epoll_wait()");
-		goto again;
+	cdlist_for_each_entry(c, &master.clients_subscribed, master_subscribed) {
+		int64_t remaining;
+
+		/* busy clients get the push when done, see response_done() */
+		if (!is_client_idle(c))
+			continue;
+
+		remaining = c->sub->next_push_ms - now;
+		if (remaining < 0)
+			remaining = 0;
+
+		if (timeout < 0 || remaining < timeout)
+			timeout = remaining;
+	}
+
+	return timeout;
+}
+
+static void poll_subscriptions()
+{
+	struct client *c;
+	struct client *next;
+	int64_t now;
+
+	if (cdlist_is_empty(&master.clients_subscribed))
+		return;
+
+	now = get_monotonic_ms();
+
+	cdlist_for_each_entry_safe(c, next, &master.clients_subscribed, 
+			master_subscribed) {
+		if (is_client_idle(c) && c->sub->next_push_ms <= now)
+			push_stats(c);
 	}
+}
 
-	if (ev.data.fd == master.listen_fd) {
-		if ((c = accept_client(master.listen_fd)) == NULL)
-			goto again;
+static void handle_event(struct epoll_event *ev)
+{
+	struct client *c;
 
-		printf("Master: a new client from %s:%hu\n", 
-				inet_ntoa(c->addr.sin_addr), 
-				c->addr.sin_port);
+	if (ev->data.fd == master.listen_fd || 
+			(master.unix_fd >= 0 && ev->data.fd == master.unix_fd)) {
+		if ((c = accept_client(ev->data.fd)) == NULL)
+			return;
+
+		printf("Master: a new client from %s\n", client_name(c));
 	} else {
-		c = ev.data.ptr;
+		c = ev->data.ptr;
 
-		if (ev.events & (EPOLLERR | EPOLLHUP)) {
+		if (ev->events & (EPOLLERR | EPOLLHUP)) {
 			close_client(c);
-			goto again;
+			return;
 		}
 
-		if (ev.events & EPOLLIN) {
+		if (ev->events & EPOLLIN) {
 			client_recv(c);
-		} else if (ev.events & EPOLLOUT) {
+		} else if (ev->events & EPOLLOUT) {
 			client_send(c);
 		} else {
-			fprintf(stderr, "Unknown epoll event %u\n", ev.events);
+			fprintf(stderr, "Unknown epoll event %u\n", ev->events);
 			close_client(c);
 		}
 	}
+}
+
+void run_master() 
+{
+	struct epoll_event ev;
+
+	int ret;
+
+again:
+	ret = epoll_wait(master.epoll_fd, &ev, 1, next_timeout());
+	if (ret < 0) {
+		perror("epoll_wait()");
+		goto again;
+	}
+
+	if (ret > 0)
+		handle_event(&ev);
+
+	/* periodic tasks, which are due when epoll_wait() times out */
+	poll_shm_stats();
+	poll_subscriptions();
 
 	/* loop forever */
 	goto again;
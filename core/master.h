@@ -7,12 +7,15 @@
 
 #include "utils/cdlist.h"
 
+struct subscription;
+
 /* the protocol is simple for both requests and responses:
  * 4-byte length, followed by a message (encoded 'message_t') */
 
 struct client {
 	int fd;
-	struct sockaddr_in addr;
+	struct sockaddr_in addr;	/* not used for Unix domain sockets */
+	int is_unix;
 
 	/* buf                                               buf+buf_size
 	 * [*********************                 |          )
@@ -26,9 +29,12 @@ struct client {
 
 	int holding_lock;	/* 0 or the depth of nested locking */
 
+	struct subscription *sub;	/* stats pushed to this client, if any */
+
 	struct cdlist_item master_all;
 	struct cdlist_item master_lock_waiting;
 	struct cdlist_item master_pause_holding;
+	struct cdlist_item master_subscribed;
 };
 
 static inline int is_holding_lock(struct client *c)
@@ -46,7 +52,16 @@ static inline int is_holding_pause(struct client *c)
 	return cdlist_is_hooked(&c->master_pause_holding);
 }
 
-void setup_master(uint16_t port);
+/* neither receiving a request nor sending a message */
+static inline int is_client_idle(struct client *c)
+{
+	return c->msg_len_off == 0 && c->msg_len == 0;
+}
+
+/* unix_path is optional (can be NULL). If unix_group is given, only its
+ * members can connect to unix_path. */
+void setup_master(uint16_t port, const char *unix_path,
+		const char *unix_group);
 
 /* The main run loop of the channel thread. Never returns. */
 void run_master();
@@ -196,6 +196,11 @@ struct module *create_module(const char *name,
 		goto fail;
 	}
 
+	if (arg && snobj_type(arg) != TYPE_NIL) {
+		snobj_acquire(arg);
+		m->arg = arg;
+	}
+
 	return m;
 
 fail:
@@ -237,6 +242,7 @@ void destroy_module(struct module *m)
 
 	ns_remove(m->name);
 
+	snobj_free(m->arg);
 	rte_free(m->name);
 	rte_free(m->gates);
 	rte_free(m);
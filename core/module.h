@@ -56,6 +56,9 @@ struct module {
 
 	const struct mclass *mclass;
 
+	/* as given to create_module(), or NULL. For get_module_info */
+	struct snobj *arg;
+
 	struct task *tasks[MAX_TASKS_PER_MODULE];
 
 	/* frequently access fields should be below */
@@ -9,18 +9,37 @@
 #define min(a, b) (a < b ? a : b)
 #endif
 
-/* XXX: currently doesn't support multiple workers */
-struct measure_priv {
-	struct histogram hist;
-
-	uint64_t start_time;
-	int warmup;		/* second */
+/* Updated only by its own worker, and merged only by queries. Each shard
+ * is on its own cache lines, so that workers running the module at the
+ * same time do not bounce them. */
+struct measure_shard {
+	struct histogram hist;		/* allocated in measure_init() */
 
 	uint64_t pkt_cnt;
 	uint64_t bytes_cnt;
 	uint64_t total_latency;
+} __rte_cache_aligned;
+
+struct measure_priv {
+	struct measure_shard *shards;	/* [MAX_WORKERS] */
+
+	uint64_t start_time;
+	int warmup;		/* second */
 };
 
+static void measure_deinit(struct module *m)
+{
+	struct measure_priv *priv = get_priv(m);
+
+	if (!priv->shards)
+		return;
+
+	for (int i = 0; i < MAX_WORKERS; i++)
+		rte_free(priv->shards[i].hist.global_histogram);
+
+	rte_free(priv->shards);
+}
+
 static struct snobj *measure_init(struct module *m, struct snobj *arg)
 {
 	struct measure_priv *priv = get_priv(m);
@@ -28,35 +47,101 @@ static struct snobj *measure_init(struct module *m, struct snobj *arg)
 	if (arg)
 		priv->warmup = snobj_eval_int(arg, "warmup");
 
-	init_hist(&priv->hist);
+	/* not in priv, which is not aligned to cache lines */
+	priv->shards = rte_zmalloc("measure_shards",
+			sizeof(struct measure_shard) * MAX_WORKERS,
+			RTE_CACHE_LINE_SIZE);
+	if (!priv->shards)
+		return snobj_err(ENOMEM, "Out of memory");
+
+	/* for every worker, even one launched later, so that the datapath
+	 * never allocates */
+	for (int i = 0; i < MAX_WORKERS; i++) {
+		init_hist(&priv->shards[i].hist);
+		if (!priv->shards[i].hist.global_histogram) {
+			measure_deinit(m);
+			return snobj_err(ENOMEM, "Out of memory");
+		}
+	}
 
 	priv->start_time = get_time();
 
 	return NULL;
 }
 
+/* Only the buckets with any packet are listed: "buckets" has their indices
+ * (in increasing order), and "counts" the number of packets in each.
+ * Bucket i is for the latency in [i, i + 1) * "bucket_ns". */
+static void add_histogram(struct snobj *r, const struct measure_shard *shards)
+{
+	struct snobj *buckets = snobj_list();
+	struct snobj *counts = snobj_list();
+
+	const histo_count_t *hists[MAX_WORKERS];
+	int num_hists = 0;
+
+	uint64_t above_threshold = 0;
+
+	for (int i = 0; i < MAX_WORKERS; i++) {
+		if (shards[i].hist.global_histogram)
+			hists[num_hists++] = shards[i].hist.global_histogram;
+
+		above_threshold += shards[i].hist.above_threshold;
+	}
+
+	for (int i = 0; num_hists && i < HISTO_BUCKETS; i++) {
+		histo_count_t cnt = 0;
+
+		for (int j = 0; j < num_hists; j++)
+			cnt += hists[j][i];
+
+		if (cnt) {
+			snobj_list_add(buckets, snobj_int(i));
+			snobj_list_add(counts, snobj_uint(cnt));
+		}
+	}
+
+	snobj_map_set(r, "bucket_ns", snobj_int(HISTO_TIME));
+	snobj_map_set(r, "buckets", buckets);
+	snobj_map_set(r, "counts", counts);
+	snobj_map_set(r, "above_threshold", snobj_uint(above_threshold));
+}
+
 struct snobj *measure_query(struct module *m, struct snobj *q)
 {
 	struct measure_priv *priv = get_priv(m);
 
-	struct snobj *r = snobj_map();
+	struct snobj *r;
+
+	uint64_t pkt_total = 0;
+	uint64_t byte_total = 0;
+	uint64_t latency_total = 0;
 
-	uint64_t pkt_total = priv->pkt_cnt;
 	const char* query = snobj_eval_str(q, "type");
 
 	if (!query)
 		return snobj_err(ENOTSUP, "Missing 'type' field");
 
+	for (int i = 0; i < MAX_WORKERS; i++) {
+		pkt_total += priv->shards[i].pkt_cnt;
+		byte_total += priv->shards[i].bytes_cnt;
+		latency_total += priv->shards[i].total_latency;
+	}
+
+	r = snobj_map();
 	snobj_map_set(r, "timestamp", snobj_double(get_epoch_time()));
 	snobj_map_set(r, "packets", snobj_int(pkt_total));
 
 	if (strcmp(query, "bw") == 0) {
-		uint64_t byte_total = priv->bytes_cnt;
 		uint64_t bits = (byte_total + pkt_total * 24) * 8;
 		snobj_map_set(r, "bits", snobj_int(bits));
 	} else if (strcmp(query, "latency") == 0) {
 		snobj_map_set(r, "total_latency_ns", 
-				snobj_int(priv->total_latency * 100ul));
+				snobj_int(latency_total * 100ul));
+	} else if (strcmp(query, "histogram") == 0) {
+		snobj_map_set(r, "total_latency_ns", 
+				snobj_int(latency_total * 100ul));
+		add_histogram(r, priv->shards);
 	} else {
 		snobj_free(r);
 		return snobj_err(ENOTSUP, "Not supported query");
@@ -81,12 +166,15 @@ static void
 measure_process_batch(struct module *m, struct pkt_batch *batch)
 {
 	struct measure_priv *priv = get_priv(m);
+	struct measure_shard *shard = &priv->shards[ctx.wid];
 
 	uint64_t time = get_time();
 	int i = 0;
 
-	if (time - priv->start_time >= priv->warmup) {
-		priv->pkt_cnt += batch->cnt;
+	if (time - priv->start_time >= 
+			priv->warmup * (HISTO_TIMEUNIT_MULT / HISTO_TIME)) 
+	{
+		shard->pkt_cnt += batch->cnt;
 
 		for (i = 0; i < batch->cnt; i++) {
 			uint64_t pkt_time;
@@ -98,10 +186,10 @@ measure_process_batch(struct module *m, struct pkt_batch *batch)
 				else
 					continue;
 
-				priv->bytes_cnt += batch->pkts[i]->mbuf.pkt_len;
-				priv->total_latency += diff;
+				shard->bytes_cnt += batch->pkts[i]->mbuf.pkt_len;
+				shard->total_latency += diff;
 
-				record_latency(&priv->hist, diff);
+				record_latency(&shard->hist, diff);
 			}
 		}
 	}
@@ -113,6 +201,7 @@ static const struct mclass measure = {
 	.name 		= "Measure",
 	.priv_size	= sizeof(struct measure_priv),
 	.init 		= measure_init,
+	.deinit 	= measure_deinit,
 	.process_batch 	= measure_process_batch,
 	.query		= measure_query,
 };
@@ -40,6 +40,10 @@ static struct snobj *handle_templates(struct rewrite_priv *priv,
 	priv->next_turn = 0;
 	priv->num_templates = 0;
 
+	/* packets pass through unmodified */
+	if (templates->size == 0)
+		return NULL;
+
 	for (i = 0; i < templates->size; i++) {
 		struct snobj *template = snobj_list_get(templates, i);
 
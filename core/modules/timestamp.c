@@ -3,12 +3,17 @@
 #include "../module.h"
 #include "../utils/histogram.h"
 
-/* XXX: currently doesn't support multiple workers */
+/* per worker, on its own cache line (see measure.c) */
+struct timestamp_shard {
+	uint64_t out_pkt_cnt;
+	uint64_t out_bytes_cnt;
+} __rte_cache_aligned;
+
 struct timestamp_priv {
+	struct timestamp_shard *shards;	/* [MAX_WORKERS] */
+
 	uint64_t start_time;
 	int64_t warmup;
-	uint64_t out_pkt_cnt;
-	uint64_t out_bytes_cnt;
 };
 
 static struct snobj *timestamp_init(struct module *m, struct snobj *arg)
@@ -18,9 +23,22 @@ static struct snobj *timestamp_init(struct module *m, struct snobj *arg)
 	if (arg)
 		priv->warmup = snobj_eval_int(arg, "warmup");
 
+	priv->shards = rte_zmalloc("timestamp_shards",
+			sizeof(struct timestamp_shard) * MAX_WORKERS,
+			RTE_CACHE_LINE_SIZE);
+	if (!priv->shards)
+		return snobj_err(ENOMEM, "Out of memory");
+
 	return NULL;
 }
 
+static void timestamp_deinit(struct module *m)
+{
+	struct timestamp_priv *priv = get_priv(m);
+
+	rte_free(priv->shards);
+}
+
 static struct snobj *timestamp_query(struct module *m, struct snobj *q)
 {
 	struct timestamp_priv *priv = get_priv(m);
@@ -30,8 +48,10 @@ static struct snobj *timestamp_query(struct module *m, struct snobj *q)
 	uint64_t pkt_total = 0;
 	uint64_t byte_total = 0;
 
-	pkt_total += priv->out_pkt_cnt;
-	byte_total += priv->out_bytes_cnt;
+	for (int i = 0; i < MAX_WORKERS; i++) {
+		pkt_total += priv->shards[i].out_pkt_cnt;
+		byte_total += priv->shards[i].out_bytes_cnt;
+	}
 
 	snobj_map_set(r, "packets", snobj_int(pkt_total));
 	snobj_map_set(r, "bytes", snobj_int(byte_total));
@@ -54,6 +74,7 @@ static void
 timestamp_process_batch(struct module *m, struct pkt_batch *batch)
 {
 	struct timestamp_priv *priv = get_priv(m);
+	struct timestamp_shard *shard = &priv->shards[ctx.wid];
 
 	int account_for_packet = 0;
 	uint64_t time = get_time();
@@ -65,11 +86,11 @@ timestamp_process_batch(struct module *m, struct pkt_batch *batch)
 	if (time - priv->start_time > 
 			priv->warmup * (HISTO_TIMEUNIT_MULT / HISTO_TIME)) 
 	{
-		priv->out_pkt_cnt += batch->cnt;
+		shard->out_pkt_cnt += batch->cnt;
 		account_for_packet = 1;
 
 		for (i = 0; i < batch->cnt; i++)
-			priv->out_bytes_cnt += batch->pkts[i]->mbuf.pkt_len;
+			shard->out_bytes_cnt += batch->pkts[i]->mbuf.pkt_len;
 	}
 
 	for (i = 0; i < batch->cnt; i++)
@@ -82,6 +103,7 @@ static const struct mclass timestamp = {
 	.name 		= "Timestamp",
 	.priv_size	= sizeof(struct timestamp_priv),
 	.init 		= timestamp_init,
+	.deinit 	= timestamp_deinit,
 	.process_batch 	= timestamp_process_batch,
 	.query		= timestamp_query,
 };
@@ -16,6 +16,7 @@ typedef enum {
 	NS_TYPE_MODULE,
 	NS_TYPE_DRIVER,
 	NS_TYPE_PORT,
+	NS_TYPE_TC,
 	NS_TYPE_ALL,
 	NS_TYPE_MAX
 } ns_type_t;
@@ -198,6 +198,11 @@ struct port *create_port(const char *name,
 		goto fail;
 	}
 
+	if (arg && snobj_type(arg) != TYPE_NIL) {
+		snobj_acquire(arg);
+		p->arg = arg;
+	}
+
 	return p;
 
 fail:
@@ -225,6 +230,7 @@ int destroy_port(struct port *p)
 	if (p->driver->deinit_port)
 		p->driver->deinit_port(p);
 
+	snobj_free(p->arg);
 	rte_free(p->name);
 	rte_free(p);
 
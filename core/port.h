@@ -27,6 +27,9 @@ struct port {
 
 	const struct driver *driver;
 
+	/* as given to create_port(), or NULL. For list_ports */
+	struct snobj *arg;
+
 	/* how many modules are using this port?
 	 * TODO: more robust gate keeping */
 	int users;
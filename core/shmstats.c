@@ -0,0 +1,270 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+#include <fcntl.h>
+#include <errno.h>
+
+#include <sys/mman.h>
+#include <sys/stat.h>
+
+#include "shmstats.h"
+#include "module.h"
+#include "port.h"
+#include "time.h"
+
+static struct {
+	int fd;
+	struct shm_stats_header *hdr;	/* NULL if not in use */
+	size_t size;
+
+	int interval_ms;
+	int64_t next_update_ms;
+} shm = {.fd = -1};
+
+/* The region is never shrunk, as readers may have mapped it entirely */
+static int grow_region(size_t size)
+{
+	size_t page_size = sysconf(_SC_PAGESIZE);
+	void *p;
+
+	if (size < shm.size * 2)
+		size = shm.size * 2;
+
+	size = (size + page_size - 1) / page_size * page_size;
+
+	if (ftruncate(shm.fd, size) < 0) {
+		perror("ftruncate(shm_stats)");
+		return -errno;
+	}
+
+	p = mremap(shm.hdr, shm.size, size, MREMAP_MAYMOVE);
+	if (p == MAP_FAILED) {
+		perror("mremap(shm_stats)");
+		return -errno;
+	}
+
+	shm.hdr = p;
+	shm.size = size;
+
+	return 0;
+}
+
+static void copy_name(char *dst, const char *src)
+{
+	strncpy(dst, src, SN_NAME_LEN - 1);
+	dst[SN_NAME_LEN - 1] = '\0';
+}
+
+static uint32_t count_ports()
+{
+	const struct port *ports[16];
+
+	uint32_t num_ports = 0;
+	int cnt;
+
+	while ((cnt = list_ports(ports, 16, num_ports)) > 0)
+		num_ports += cnt;
+
+	return num_ports;
+}
+
+static uint32_t count_gates()
+{
+	const struct module *modules[16];
+
+	uint32_t num_modules = 0;
+	uint32_t num_gates = 0;
+	int cnt;
+
+	while ((cnt = list_modules(modules, 16, num_modules)) > 0) {
+		for (int i = 0; i < cnt; i++) {
+			const struct module *m = modules[i];
+
+			for (int j = 0; j < m->allocated_gates; j++)
+				if (m->gates[j].m)
+					num_gates++;
+		}
+
+		num_modules += cnt;
+	}
+
+	return num_gates;
+}
+
+static void fill_ports(struct shm_stats_port *entries)
+{
+	const struct port *ports[16];
+
+	uint32_t offset = 0;
+	int cnt;
+
+	while ((cnt = list_ports(ports, 16, offset)) > 0) {
+		for (int i = 0; i < cnt; i++) {
+			struct shm_stats_port *e = &entries[offset + i];
+			port_stats_t stats;
+
+			get_port_stats((struct port *)ports[i], &stats);
+
+			copy_name(e->name, ports[i]->name);
+			e->inc_packets = stats[PACKET_DIR_INC].packets;
+			e->inc_dropped = stats[PACKET_DIR_INC].dropped;
+			e->inc_bytes = stats[PACKET_DIR_INC].bytes;
+			e->out_packets = stats[PACKET_DIR_OUT].packets;
+			e->out_dropped = stats[PACKET_DIR_OUT].dropped;
+			e->out_bytes = stats[PACKET_DIR_OUT].bytes;
+		}
+
+		offset += cnt;
+	}
+}
+
+static void fill_gates(struct shm_stats_gate *entries)
+{
+	const struct module *modules[16];
+
+	uint32_t offset = 0;
+	uint32_t num_gates = 0;
+	int cnt;
+
+	while ((cnt = list_modules(modules, 16, offset)) > 0) {
+		for (int i = 0; i < cnt; i++) {
+			const struct module *m = modules[i];
+
+			for (int j = 0; j < m->allocated_gates; j++) {
+				const struct output_gate *gate = &m->gates[j];
+				struct shm_stats_gate *e;
+
+				if (!gate->m)
+					continue;
+
+				e = &entries[num_gates++];
+				copy_name(e->module, m->name);
+				copy_name(e->next, gate->m->name);
+				e->gate = j;
+#if TRACK_GATES
+				e->cnt = gate->cnt;
+				e->pkts = gate->pkts;
+#else
+				e->cnt = 0;
+				e->pkts = 0;
+#endif
+			}
+		}
+
+		offset += cnt;
+	}
+}
+
+static void update_region()
+{
+	struct shm_stats_header *hdr;
+
+	uint32_t num_ports = count_ports();
+	uint32_t num_gates = count_gates();
+
+	size_t gates_offset = sizeof(*hdr) +
+			num_ports * sizeof(struct shm_stats_port);
+	size_t size = gates_offset + num_gates * sizeof(struct shm_stats_gate);
+
+	if (size > shm.size && grow_region(size) < 0)
+		return;
+
+	hdr = shm.hdr;
+
+	hdr->seq++;
+	__sync_synchronize();
+
+	hdr->size = shm.size;
+	hdr->timestamp = get_epoch_time();
+	hdr->num_ports = num_ports;
+	hdr->num_gates = num_gates;
+	hdr->gates_offset = gates_offset;
+
+	fill_ports((struct shm_stats_port *)((char *)hdr + sizeof(*hdr)));
+	fill_gates((struct shm_stats_gate *)((char *)hdr + gates_offset));
+
+	__sync_synchronize();
+	hdr->seq++;
+}
+
+int setup_shm_stats(int interval_ms)
+{
+	struct shm_stats_header *hdr;
+	size_t size = sysconf(_SC_PAGESIZE);
+	int ret;
+
+	/* A new file, not truncating the old one (of the previous daemon),
+	 * which may be still mapped by readers */
+	unlink(SHM_STATS_PATH);
+
+	shm.fd = open(SHM_STATS_PATH, O_RDWR | O_CREAT | O_EXCL, 0644);
+	if (shm.fd < 0) {
+		perror("open(" SHM_STATS_PATH ")");
+		return -errno;
+	}
+
+	if (ftruncate(shm.fd, size) < 0) {
+		perror("ftruncate(shm_stats)");
+		goto fail;
+	}
+
+	hdr = mmap(NULL, size, PROT_READ | PROT_WRITE, MAP_SHARED, shm.fd, 0);
+	if (hdr == MAP_FAILED) {
+		perror("mmap(shm_stats)");
+		goto fail;
+	}
+
+	memcpy(hdr->magic, SHM_STATS_MAGIC, sizeof(hdr->magic));
+	hdr->version = SHM_STATS_VERSION;
+	hdr->header_size = sizeof(*hdr);
+	hdr->port_entry_size = sizeof(struct shm_stats_port);
+	hdr->gate_entry_size = sizeof(struct shm_stats_gate);
+
+	shm.hdr = hdr;
+	shm.size = size;
+	shm.interval_ms = interval_ms;
+
+	update_region();
+	shm.next_update_ms = get_monotonic_ms() + interval_ms;
+
+	return 0;
+
+fail:
+	ret = -errno;
+	close(shm.fd);
+	shm.fd = -1;
+	unlink(SHM_STATS_PATH);
+	return ret;
+}
+
+int shm_stats_timeout()
+{
+	int64_t remaining;
+
+	if (!shm.hdr)
+		return -1;
+
+	remaining = shm.next_update_ms - get_monotonic_ms();
+
+	return remaining > 0 ? remaining : 0;
+}
+
+void poll_shm_stats()
+{
+	int64_t now;
+
+	if (!shm.hdr)
+		return;
+
+	now = get_monotonic_ms();
+	if (now < shm.next_update_ms)
+		return;
+
+	update_region();
+
+	/* skip the updates that are already overdue */
+	shm.next_update_ms += shm.interval_ms;
+	if (shm.next_update_ms <= now)
+		shm.next_update_ms = now + shm.interval_ms;
+}
@@ -0,0 +1,74 @@
+#ifndef _SHMSTATS_H_
+#define _SHMSTATS_H_
+
+#include <stdint.h>
+
+#include "namespace.h"
+
+/* Port and gate counters are periodically exported to a shared memory
+ * region (a file in /dev/shm), so that monitoring tools can read them
+ * without sending requests to the daemon. See libbess-python/shmstats.py.
+ *
+ * Layout (little endian):
+ *   struct shm_stats_header
+ *   struct shm_stats_port[num_ports]	(at header_size)
+ *   struct shm_stats_gate[num_gates]	(at gates_offset)
+ *
+ * The region is protected by a seqlock: seq is odd while it is being
+ * updated. A reader should read seq (retry if odd), copy what it needs,
+ * and retry if seq has changed in the meantime. The region only grows;
+ * readers should remap it if size is larger than their mapping. */
+
+#define SHM_STATS_PATH		"/dev/shm/bess_stats"
+#define SHM_STATS_MAGIC		"BESSSTAT"
+#define SHM_STATS_VERSION	1
+
+struct shm_stats_header {
+	char magic[8];
+	uint32_t version;
+	uint32_t header_size;
+
+	volatile uint64_t seq;
+
+	uint64_t size;			/* of the whole region, in bytes */
+	double timestamp;		/* of the last update, as time.time() */
+
+	uint32_t num_ports;
+	uint32_t port_entry_size;	/* entries may grow in later versions */
+	uint32_t num_gates;
+	uint32_t gate_entry_size;
+	uint64_t gates_offset;
+};
+
+struct shm_stats_port {
+	char name[SN_NAME_LEN];
+	uint64_t inc_packets;
+	uint64_t inc_dropped;
+	uint64_t inc_bytes;
+	uint64_t out_packets;
+	uint64_t out_dropped;
+	uint64_t out_bytes;
+};
+
+/* one for each connected output gate */
+struct shm_stats_gate {
+	char module[SN_NAME_LEN];
+	char next[SN_NAME_LEN];		/* the module the gate is connected to */
+	uint32_t gate;
+	uint32_t reserved;
+	uint64_t cnt;			/* 0 without TRACK_GATES */
+	uint64_t pkts;
+};
+
+/* Creates the region, to be updated every interval_ms milliseconds.
+ * Returns 0 on success, or -errno. */
+int setup_shm_stats(int interval_ms);
+
+/* epoll_wait() timeout (in milliseconds) until the next update is due,
+ * or -1 if the region is not in use */
+int shm_stats_timeout();
+
+/* updates the region if the time has come */
+void poll_shm_stats();
+
+#endif
@@ -12,21 +12,31 @@
 #include <sys/time.h>
 #include <sys/types.h>
 
+#include <rte_malloc.h>
+
 #include "worker.h"
 #include "master.h"
 #include "snobj.h"
 #include "module.h"
 #include "port.h"
 #include "time.h"
+#include "subscribe.h"
+#include "graph.h"
 
 struct handler_map {
 	const char *cmd;
 	int pause_needed;	/* should all workers have been paused? */
 	struct snobj *(*func)(struct snobj *);
+
+	/* If set, only the workers it returns (as a bitmask) need to be
+	 * paused, rather than all of them */
+	uint64_t (*affected)(struct snobj *);
 };
 
 static struct snobj *handle_reset_modules(struct snobj *);
 static struct snobj *handle_reset_ports(struct snobj *);
+static struct snobj *handle_reset_tcs(struct snobj *);
+static struct snobj *handle_batch(struct snobj *);
 
 static struct snobj *handle_reset_all(struct snobj *q)
 {
@@ -40,6 +50,9 @@ static struct snobj *handle_reset_all(struct snobj *q)
 	r = handle_reset_ports(NULL);
 	assert(r == NULL);
 
+	r = handle_reset_tcs(NULL);
+	assert(r == NULL);
+
 	return NULL;
 }
 
@@ -57,6 +70,292 @@ static struct snobj *handle_resume_all(struct snobj *q)
 	return NULL;
 }
 
+/* returns -1 if the "wid" field is not a valid active worker */
+static int get_active_wid(struct snobj *q, struct snobj **perr)
+{
+	struct snobj *t;
+	unsigned int wid;
+
+	t = snobj_eval(q, "wid");
+	if (!t) {
+		*perr = snobj_err(EINVAL, "Missing 'wid' field");
+		return -1;
+	}
+
+	wid = snobj_uint_get(t);
+	if (wid >= MAX_WORKERS) {
+		*perr = snobj_err(EINVAL, "'wid' must be between 0 and %d",
+				MAX_WORKERS - 1);
+		return -1;
+	}
+
+	if (!is_worker_active(wid)) {
+		*perr = snobj_err(EINVAL, "Worker %d does not exist", wid);
+		return -1;
+	}
+
+	return wid;
+}
+
+static struct snobj *handle_pause_worker(struct snobj *q)
+{
+	struct snobj *err;
+	int wid;
+
+	if ((wid = get_active_wid(q, &err)) < 0)
+		return err;
+
+	pause_worker(wid);
+	printf("*** Worker %d has been paused ***\n", wid);
+	return NULL;
+}
+
+static struct snobj *handle_resume_worker(struct snobj *q)
+{
+	struct snobj *err;
+	int wid;
+
+	if ((wid = get_active_wid(q, &err)) < 0)
+		return err;
+
+	resume_workers(1ull << wid);
+	printf("*** Worker %d has been resumed ***\n", wid);
+	return NULL;
+}
+
+static uint64_t workers_of_module(const char *name)
+{
+	struct module *m;
+
+	if (!name || !(m = find_module(name)))
+		return 0;
+
+	return get_affected_workers(&m, 1);
+}
+
+/* for requests with a module name as the argument */
+static uint64_t affected_by_arg(struct snobj *q)
+{
+	return q ? workers_of_module(snobj_str_get(q)) : 0;
+}
+
+static uint64_t affected_by_name(struct snobj *q)
+{
+	return workers_of_module(snobj_eval_str(q, "name"));
+}
+
+/* m2 is not changed by a new connection to it */
+static uint64_t affected_by_m1(struct snobj *q)
+{
+	return workers_of_module(snobj_eval_str(q, "m1"));
+}
+
+static uint64_t affected_by_wid(struct snobj *q)
+{
+	uint64_t wid = snobj_eval_uint(q, "wid");
+
+	return wid < MAX_WORKERS ? (1ull << wid) : 0;
+}
+
+/* the task given by "name" and "taskid", or NULL with *perr set */
+static struct task *get_task(struct snobj *q, struct snobj **perr)
+{
+	const char *m_name;
+	task_id_t tid;
+
+	struct module *m;
+	struct task *t;
+
+	m_name = snobj_eval_str(q, "name");
+	if (!m_name) {
+		*perr = snobj_err(EINVAL, "Missing 'name' field");
+		return NULL;
+	}
+
+	if ((m = find_module(m_name)) == NULL) {
+		*perr = snobj_err(ENOENT, "No module '%s' found", m_name);
+		return NULL;
+	}
+
+	tid = snobj_eval_uint(q, "taskid");
+	if (tid >= MAX_TASKS_PER_MODULE) {
+		*perr = snobj_err(EINVAL, "'taskid' must be between 0 and %d",
+				MAX_TASKS_PER_MODULE - 1);
+		return NULL;
+	}
+
+	if ((t = m->tasks[tid]) == NULL) {
+		*perr = snobj_err(ENOENT, "Task %s:%hu does not exist",
+				m_name, tid);
+		return NULL;
+	}
+
+	return t;
+}
+
+static uint64_t workers_of_tc(const char *name)
+{
+	struct tc *c = name ? find_tc(name) : NULL;
+	int wid = c ? get_sched_wid(c->s) : -1;
+
+	return wid >= 0 ? (1ull << wid) : 0;
+}
+
+/* add_tc: the worker of "parent", or "wid" */
+static uint64_t affected_by_parent(struct snobj *q)
+{
+	return workers_of_tc(snobj_eval_str(q, "parent")) | affected_by_wid(q);
+}
+
+static uint64_t affected_by_tc_name(struct snobj *q)
+{
+	return workers_of_tc(snobj_eval_str(q, "name"));
+}
+
+static uint64_t affected_by_tc_arg(struct snobj *q)
+{
+	return q ? workers_of_tc(snobj_str_get(q)) : 0;
+}
+
+/* move_task: the worker running the task, and "wid" */
+static uint64_t affected_by_task(struct snobj *q)
+{
+	struct snobj *err = NULL;
+	struct task *t = get_task(q, &err);
+	uint64_t wids = affected_by_wid(q);
+
+	if (!t) {
+		snobj_free(err);
+		return wids;
+	}
+
+	if (task_is_attached(t) && get_sched_wid(t->c->s) >= 0)
+		wids |= 1ull << get_sched_wid(t->c->s);
+
+	return wids;
+}
+
+/* attach_task: the worker of "tc", or "wid", and the worker running the task
+ * (if in a default TC, it is moved) */
+static uint64_t affected_by_tc(struct snobj *q)
+{
+	return workers_of_tc(snobj_eval_str(q, "tc")) | affected_by_task(q);
+}
+
+/* {"modules": [names]} -> [wids] that must be paused to change the modules.
+ * If there are orphan tasks (e.g., of a new module), the worker that will
+ * take them when resumed is included as well. */
+static struct snobj *handle_get_affected_workers(struct snobj *q)
+{
+	struct snobj *names = q ? snobj_eval(q, "modules") : NULL;
+	struct module **modules;
+	struct snobj *r;
+
+	uint64_t wids;
+	int n;
+
+	if (!names || snobj_type(names) != TYPE_LIST)
+		return snobj_err(EINVAL, "'modules' must be a list of names");
+
+	n = snobj_size(names);
+	modules = rte_zmalloc("affected", sizeof(*modules) * (n ? : 1), 0);
+	if (!modules)
+		return snobj_err(ENOMEM, "Out of memory");
+
+	for (int i = 0; i < n; i++) {
+		const char *name = snobj_str_get(snobj_list_get(names, i));
+
+		if (!name) {
+			rte_free(modules);
+			return snobj_err(EINVAL,
+					"'modules' must be a list of names");
+		}
+
+		if (!(modules[i] = find_module(name))) {
+			rte_free(modules);
+			return snobj_err(ENOENT, "No module '%s' found", name);
+		}
+	}
+
+	wids = get_affected_workers(modules, n);
+	rte_free(modules);
+
+	if (get_orphan_tasks_worker() >= 0)
+		wids |= (1ull << get_orphan_tasks_worker());
+
+	r = snobj_list();
+	for (int wid = 0; wid < MAX_WORKERS; wid++) {
+		if (wids & (1ull << wid))
+			snobj_list_add(r, snobj_int(wid));
+	}
+
+	return r;
+}
+
+static int count_tasks_of_worker(int wid)
+{
+	struct task *t;
+	int cnt = 0;
+
+	cdlist_for_each_entry(t, &all_tasks, all_tasks) {
+		if (task_is_attached(t) && t->c->s == workers[wid]->s)
+			cnt++;
+	}
+
+	return cnt;
+}
+
+/* Counters are cumulative since the worker was launched; the time spent
+ * paused is not counted. A task run that processes no packet (e.g., polling
+ * an empty queue) is counted as idle, not busy:
+ *   cycles_busy/cycles_idle	TSC cycles
+ *   rounds			iterations of the scheduling loop
+ *   batches			task runs that processed packets
+ *   packets/bits		processed by the tasks */
+static struct snobj *handle_list_workers(struct snobj *q)
+{
+	struct snobj *r = snobj_list();
+
+	for (int wid = 0; wid < MAX_WORKERS; wid++) {
+		struct snobj *w;
+		struct sched_stats stats;
+
+		if (!is_worker_active(wid))
+			continue;
+
+		stats = workers[wid]->s->stats;
+
+		w = snobj_map();
+		snobj_map_set(w, "wid", snobj_int(wid));
+		snobj_map_set(w, "running", snobj_int(
+				workers[wid]->status == WORKER_RUNNING));
+		snobj_map_set(w, "core", snobj_int(workers[wid]->core));
+		snobj_map_set(w, "num_tasks",
+				snobj_int(count_tasks_of_worker(wid)));
+		snobj_map_set(w, "silent_drops",
+				snobj_uint(workers[wid]->silent_drops));
+
+		snobj_map_set(w, "timestamp", snobj_double(get_epoch_time()));
+		snobj_map_set(w, "cycles_busy", snobj_uint(
+				stats.usage[RESOURCE_CYCLE] -
+				stats.cycles_empty));
+		snobj_map_set(w, "cycles_idle", snobj_uint(
+				stats.cycles_idle + stats.cycles_empty));
+		snobj_map_set(w, "rounds", snobj_uint(
+				stats.usage[RESOURCE_CNT] + stats.cnt_idle));
+		snobj_map_set(w, "batches", snobj_uint(
+				stats.usage[RESOURCE_CNT] - stats.cnt_empty));
+		snobj_map_set(w, "packets",
+				snobj_uint(stats.usage[RESOURCE_PACKET]));
+		snobj_map_set(w, "bits",
+				snobj_uint(stats.usage[RESOURCE_BIT]));
+
+		snobj_list_add(r, w);
+	}
+
+	return r;
+}
+
 static struct snobj *handle_add_worker(struct snobj *q)
 {
 	unsigned int wid;
@@ -90,6 +389,32 @@ static struct snobj *handle_add_worker(struct snobj *q)
 	return NULL;
 }
 
+/* The tasks of the worker are taken by other workers when they are resumed */
+static struct snobj *handle_delete_worker(struct snobj *q)
+{
+	struct snobj *err;
+	struct tc *c;
+	int wid;
+
+	if ((wid = get_active_wid(q, &err)) < 0)
+		return err;
+
+	cdlist_for_each_entry(c, &workers[wid]->s->tcs_all, sched_all) {
+		if (c->name[0])
+			return snobj_err(EBUSY, "TC '%s' is on worker %d",
+					c->name, wid);
+	}
+
+	/* otherwise worker 0 would be launched again for the orphan tasks */
+	if (num_workers == 1 && count_tasks_of_worker(wid) > 0)
+		return snobj_err(EBUSY, "Worker %d is the only one to run "
+				"its tasks", wid);
+
+	destroy_worker(wid);
+
+	return NULL;
+}
+
 static struct snobj *handle_list_drivers(struct snobj *q)
 {
 	struct snobj *r;
@@ -150,6 +475,11 @@ static struct snobj *handle_list_ports(struct snobj *q)
 			snobj_map_set(port, "driver",
 					snobj_str(ports[i]->driver->name));
 
+			if (ports[i]->arg) {
+				snobj_acquire(ports[i]->arg);
+				snobj_map_set(port, "arg", ports[i]->arg);
+			}
+
 			snobj_list_add(r, port);
 		}
 	};
@@ -348,6 +678,12 @@ static struct snobj *handle_create_module(struct snobj *q)
 
 	printf("Module %s created at %p\n", module->name, module);
 
+	/* so that its tasks (if any) are run, even if all workers are running.
+	 * With no worker yet, they wait for one to be added (or launched when
+	 * resumed), as a worker on a chosen core may still be added. */
+	if (num_workers)
+		adopt_orphan_tasks();
+
 	r = snobj_map();
 	snobj_map_set(r, "name", snobj_str(module->name));
 
@@ -394,6 +730,11 @@ static struct snobj *handle_get_module_info(struct snobj *q)
 	snobj_map_set(r, "name", snobj_str(m->name));
 	snobj_map_set(r, "mclass", snobj_str(m->mclass->name));
 
+	if (m->arg) {
+		snobj_acquire(m->arg);
+		snobj_map_set(r, "arg", m->arg);
+	}
+
 	if (m->mclass->get_desc)
 		snobj_map_set(r, "desc", m->mclass->get_desc(m));
 
@@ -422,6 +763,138 @@ static struct snobj *handle_get_module_info(struct snobj *q)
 	return r;
 }
 
+static void add_port_columns(struct snobj *ports)
+{
+	static const char *dir_names[PACKET_DIRS] = {"inc", "out"};
+
+	struct snobj *names = snobj_list();
+	struct snobj *cols[PACKET_DIRS][3];
+
+	int cnt = 1;
+	int offset;
+
+	for (int dir = 0; dir < PACKET_DIRS; dir++)
+		for (int i = 0; i < 3; i++)
+			cols[dir][i] = snobj_list();
+
+	for (offset = 0; cnt != 0; offset += cnt) {
+		const int arr_size = 16;
+		const struct port *arr[arr_size];
+
+		int i;
+
+		cnt = list_ports(arr, arr_size, offset);
+
+		for (i = 0; i < cnt; i++) {
+			port_stats_t stats;
+
+			get_port_stats((struct port *)arr[i], &stats);
+
+			snobj_list_add(names, snobj_str(arr[i]->name));
+
+			for (int dir = 0; dir < PACKET_DIRS; dir++) {
+				snobj_list_add(cols[dir][0],
+						snobj_uint(stats[dir].packets));
+				snobj_list_add(cols[dir][1],
+						snobj_uint(stats[dir].dropped));
+				snobj_list_add(cols[dir][2],
+						snobj_uint(stats[dir].bytes));
+			}
+		}
+	};
+
+	snobj_map_set(ports, "name", names);
+
+	for (int dir = 0; dir < PACKET_DIRS; dir++) {
+		char key[32];
+
+		sprintf(key, "%s_packets", dir_names[dir]);
+		snobj_map_set(ports, key, cols[dir][0]);
+		sprintf(key, "%s_dropped", dir_names[dir]);
+		snobj_map_set(ports, key, cols[dir][1]);
+		sprintf(key, "%s_bytes", dir_names[dir]);
+		snobj_map_set(ports, key, cols[dir][2]);
+	}
+}
+
+static void add_gate_columns(struct snobj *gates)
+{
+	struct snobj *modules = snobj_list();
+	struct snobj *ogates = snobj_list();
+	struct snobj *next = snobj_list();
+#if TRACK_GATES
+	struct snobj *cnts = snobj_list();
+	struct snobj *pkts = snobj_list();
+#endif
+
+	int cnt = 1;
+	int offset;
+
+	for (offset = 0; cnt != 0; offset += cnt) {
+		const int arr_size = 16;
+		const struct module *arr[arr_size];
+
+		int i;
+
+		cnt = list_modules(arr, arr_size, offset);
+
+		for (i = 0; i < cnt; i++) {
+			const struct module *m = arr[i];
+
+			for (int j = 0; j < m->allocated_gates; j++) {
+				const struct output_gate *gate = &m->gates[j];
+
+				if (!gate->m)
+					continue;
+
+				snobj_list_add(modules, snobj_str(m->name));
+				snobj_list_add(ogates, snobj_uint(j));
+				snobj_list_add(next, snobj_str(gate->m->name));
+#if TRACK_GATES
+				snobj_list_add(cnts, snobj_uint(gate->cnt));
+				snobj_list_add(pkts, snobj_uint(gate->pkts));
+#endif
+			}
+		}
+	};
+
+	snobj_map_set(gates, "module", modules);
+	snobj_map_set(gates, "gate", ogates);
+	snobj_map_set(gates, "name", next);
+#if TRACK_GATES
+	snobj_map_set(gates, "cnt", cnts);
+	snobj_map_set(gates, "pkts", pkts);
+#endif
+}
+
+/* Counters of all ports and all (connected) module gates in one reply,
+ * with a single timestamp, so that rates can be computed consistently.
+ * The encoding is columnar: "ports" and "gates" are maps of parallel lists,
+ * with one element for each port or gate, e.g.,
+ *   {"timestamp": 1445412345.67,
+ *    "ports": {"name": ["p0", "p1"], "inc_packets": [10, 20], ...},
+ *    "gates": {"module": ["src", "src"], "gate": [0, 1],
+ *              "name": ["sink0", "sink1"], "cnt": [..], "pkts": [..]}} */
+static struct snobj *handle_get_all_stats(struct snobj *q)
+{
+	struct snobj *r;
+	struct snobj *ports;
+	struct snobj *gates;
+
+	r = snobj_map();
+	snobj_map_set(r, "timestamp", snobj_double(get_epoch_time()));
+
+	ports = snobj_map();
+	add_port_columns(ports);
+	snobj_map_set(r, "ports", ports);
+
+	gates = snobj_map();
+	add_gate_columns(gates);
+	snobj_map_set(r, "gates", gates);
+
+	return r;
+}
+
 static struct snobj *handle_connect_modules(struct snobj *q)
 {
 	const char *m1_name;
@@ -484,56 +957,582 @@ static struct snobj *handle_disconnect_modules(struct snobj *q)
 	return NULL;
 }
 
-static struct snobj *handle_attach_task(struct snobj *q)
+static struct snobj *handle_apply_graph(struct snobj *q)
 {
-	const char *m_name;
-	task_id_t tid;
-	int wid;		/* TODO: worker_id_t */
+	return apply_graph(q);
+}
 
-	struct module *m;
-	struct task *t;
+/* in the order of RESOURCE_* */
+static const char *resource_names[NUM_RESOURCES] = {
+	"count", "cycle", "packet", "bit",
+};
 
-	m_name = snobj_eval_str(q, "name");
+static int find_resource(const char *name)
+{
+	for (int i = 0; i < NUM_RESOURCES; i++) {
+		if (strcmp(name, resource_names[i]) == 0)
+			return i;
+	}
 
-	if (!m_name)
-		return snobj_err(EINVAL, "Missing 'name' field");
+	return -1;
+}
 
-	if ((m = find_module(m_name)) == NULL)
-		return snobj_err(ENOENT, "No module '%s' found", m_name);
+/* {"count": 1000, "bit": 1000000000, ...} -> arr */
+static struct snobj *parse_resource_map(struct snobj *map, const char *key,
+		uint64_t *arr)
+{
+	int found = 0;
 
-	tid = snobj_eval_uint(q, "taskid");
-	if (tid >= MAX_TASKS_PER_MODULE)
-		return snobj_err(EINVAL, "'taskid' must be between 0 and %d",
-				MAX_TASKS_PER_MODULE - 1);
+	if (snobj_type(map) != TYPE_MAP)
+		return snobj_err(EINVAL, "'%s' must be a map", key);
 
-	if ((t = m->tasks[tid]) == NULL)
-		return snobj_err(ENOENT, "Task %s:%hu does not exist", 
-				m_name, tid);
+	for (int i = 0; i < NUM_RESOURCES; i++) {
+		struct snobj *v = snobj_map_get(map, resource_names[i]);
 
-	if (task_is_attached(t))
-		return snobj_err(EBUSY, "Task %s:%hu is already attached to "
-				"a TC", m_name, tid);
+		arr[i] = 0;
 
-	wid = snobj_eval_uint(q, "wid");
-	if (wid >= MAX_WORKERS)
-		return snobj_err(EINVAL, "'wid' must be between 0 and %d",
-				MAX_WORKERS - 1);
+		if (!v)
+			continue;
 
-	if (!is_worker_active(wid))
-		return snobj_err(EINVAL, "Worker %d does not exist", wid);
+		if (snobj_type(v) != TYPE_INT || snobj_int_get(v) < 0 ||
+				snobj_uint_get(v) >= (1ull << MAX_LIMIT_POW))
+			return snobj_err(EINVAL, "'%s.%s' must be between 0 "
+					"and 2^%d - 1", key, resource_names[i],
+					MAX_LIMIT_POW);
 
-	assign_default_tc(workers[wid]->s, t);
+		arr[i] = snobj_uint_get(v);
+		found++;
+	}
+
+	if (found != snobj_size(map))
+		return snobj_err(EINVAL, "'%s': resources must be count, "
+				"cycle, packet, or bit", key);
 
 	return NULL;
 }
 
-static struct snobj *handle_enable_tcpdump(struct snobj *q)
+/* Overrides the fields of *p that are given in q */
+static struct snobj *parse_tc_params(struct snobj *q, struct tc_params *p)
 {
-	const char *m_name;
-	const char *fifo;
-	gate_t gate;
+	struct snobj *t;
+	struct snobj *err;
 
-	struct module *m;
+	if ((t = snobj_eval(q, "priority"))) {
+		if (snobj_type(t) != TYPE_INT)
+			return snobj_err(EINVAL, "'priority' must be an integer");
+		p->priority = snobj_int_get(t);
+	}
+
+	if ((t = snobj_eval(q, "share"))) {
+		if (snobj_type(t) != TYPE_INT || snobj_int_get(t) <= 0 ||
+				snobj_int_get(t) > MAX_SHARE)
+			return snobj_err(EINVAL, "'share' must be between 1 "
+					"and %d", MAX_SHARE);
+		p->share = snobj_int_get(t);
+	}
+
+	if ((t = snobj_eval(q, "share_resource"))) {
+		const char *name = snobj_str_get(t);
+		int resource = name ? find_resource(name) : -1;
+
+		if (resource < 0)
+			return snobj_err(EINVAL, "'share_resource' must be one "
+					"of count, cycle, packet, and bit");
+		p->share_resource = resource;
+	}
+
+	if ((t = snobj_eval(q, "limit")) &&
+	    (err = parse_resource_map(t, "limit", p->limit)))
+		return err;
+
+	if ((t = snobj_eval(q, "max_burst")) &&
+	    (err = parse_resource_map(t, "max_burst", p->max_burst)))
+		return err;
+
+	return NULL;
+}
+
+/* Siblings of the same priority are in the same pgroup,
+ * which shares a single resource among them */
+static struct snobj *check_pgroup(struct tc *parent, const struct tc *c,
+		const struct tc_params *p)
+{
+	struct pgroup *g;
+
+	cdlist_for_each_entry(g, &parent->pgroups, tc) {
+		if (g->priority != p->priority || g->resource == p->share_resource)
+			continue;
+
+		/* c is going to leave the pgroup anyway? */
+		if (c && c->ss.my_pgroup == g && g->num_children == 1)
+			continue;
+
+		return snobj_err(EINVAL, "Other TCs of priority %d share "
+				"'%s', not '%s'", p->priority,
+				resource_names[g->resource],
+				resource_names[p->share_resource]);
+	}
+
+	return NULL;
+}
+
+static int count_named_children(const struct tc *c)
+{
+	struct tc *child;
+	int cnt = 0;
+
+	cdlist_for_each_entry(child, &c->s->tcs_all, sched_all) {
+		if (child->parent == c && child->name[0])
+			cnt++;
+	}
+
+	return cnt;
+}
+
+/* {"name": "tc1", "wid": 0, "parent": "tc0", "priority": 0, "share": 1,
+ *  "share_resource": "count", "limit": {"packet": 1000000},
+ *  "max_burst": {"packet": 1000}}
+ * Only "name" is required. With a parent, the TC goes to its worker.
+ * Limits are per second, max_burst in the same unit. */
+static struct snobj *handle_add_tc(struct snobj *q)
+{
+	const char *name;
+	const char *parent_name;
+	struct tc *parent = NULL;
+	struct tc *c;
+	struct snobj *err;
+
+	struct tc_params params = {
+		.parent = NULL,
+		.auto_free = 0,
+		.priority = DEFAULT_PRIORITY,
+		.share = 1,
+		.share_resource = RESOURCE_CNT,
+	};
+
+	int wid;
+	int ret;
+
+	name = snobj_eval_str(q, "name");
+	if (!name)
+		return snobj_err(EINVAL, "Missing 'name' field");
+
+	if (ns_name_exists(name))
+		return snobj_err(EEXIST, "Name '%s' already exists", name);
+
+	parent_name = snobj_eval_str(q, "parent");
+	if (parent_name) {
+		if (!(parent = find_tc(parent_name)))
+			return snobj_err(ENOENT, "No TC '%s' found",
+					parent_name);
+
+		if (!cdlist_is_empty(&parent->tasks))
+			return snobj_err(EBUSY, "TC '%s' has tasks, so it "
+					"cannot have child classes",
+					parent_name);
+
+		wid = get_sched_wid(parent->s);
+		if (snobj_eval_exists(q, "wid") &&
+				snobj_eval_uint(q, "wid") != wid)
+			return snobj_err(EINVAL, "TC '%s' is on worker %d",
+					parent_name, wid);
+	} else {
+		wid = snobj_eval_uint(q, "wid");
+		if (wid < 0 || wid >= MAX_WORKERS)
+			return snobj_err(EINVAL, "'wid' must be between 0 "
+					"and %d", MAX_WORKERS - 1);
+
+		if (!is_worker_active(wid))
+			return snobj_err(EINVAL, "Worker %d does not exist",
+					wid);
+	}
+
+	if ((err = parse_tc_params(q, &params)))
+		return err;
+
+	params.parent = parent;
+
+	err = check_pgroup(parent ? : &workers[wid]->s->root, NULL, &params);
+	if (err)
+		return err;
+
+	c = tc_init(workers[wid]->s, &params);
+
+	ret = tc_set_name(c, name);
+	if (ret < 0) {
+		tc_dec_refcnt(c);
+		return snobj_err(-ret, "Invalid name '%s'", name);
+	}
+
+	return NULL;
+}
+
+/* The same fields as add_tc, except "wid" and "parent".
+ * Those not given are left unchanged. */
+static struct snobj *handle_update_tc(struct snobj *q)
+{
+	const char *name;
+	struct tc *c;
+	struct tc_params params;
+	struct snobj *err;
+
+	name = snobj_eval_str(q, "name");
+	if (!name)
+		return snobj_err(EINVAL, "Missing 'name' field");
+
+	if (!(c = find_tc(name)))
+		return snobj_err(ENOENT, "No TC '%s' found", name);
+
+	if (snobj_eval_exists(q, "wid") || snobj_eval_exists(q, "parent"))
+		return snobj_err(EINVAL, "'wid' and 'parent' cannot be "
+				"changed");
+
+	params = c->params;
+
+	if ((err = parse_tc_params(q, &params)))
+		return err;
+
+	if ((err = check_pgroup(c->parent, c, &params)))
+		return err;
+
+	tc_update(c, &params);
+
+	return NULL;
+}
+
+static struct snobj *handle_delete_tc(struct snobj *q)
+{
+	const char *name;
+	struct tc *c;
+
+	name = snobj_str_get(q);
+	if (!name)
+		return snobj_err(EINVAL, "Argument must be a name in str");
+
+	if (!(c = find_tc(name)))
+		return snobj_err(ENOENT, "No TC '%s' found", name);
+
+	if (!cdlist_is_empty(&c->tasks))
+		return snobj_err(EBUSY, "TC '%s' still has tasks", name);
+
+	if (count_named_children(c) > 0)
+		return snobj_err(EBUSY, "TC '%s' still has child classes",
+				name);
+
+	tc_unset_name(c);
+	tc_leave(c);
+
+	/* freed once the scheduler releases it as well */
+	tc_dec_refcnt(c);
+
+	return NULL;
+}
+
+static struct snobj *handle_reset_tcs(struct snobj *q)
+{
+	int found;
+
+	/* children first */
+	do {
+		struct ns_iter iter;
+		struct tc *c;
+
+		found = 0;
+
+		ns_init_iterator(&iter, NS_TYPE_TC);
+		while ((c = ns_next(&iter)) != NULL) {
+			if (count_named_children(c) == 0)
+				break;
+		}
+		ns_release_iterator(&iter);
+
+		if (c) {
+			struct task *t;
+			struct task *next;
+
+			cdlist_for_each_entry_safe(t, next, &c->tasks, tc)
+				task_detach(t);
+
+			tc_unset_name(c);
+			tc_leave(c);
+			tc_dec_refcnt(c);
+			found = 1;
+		}
+	} while (found);
+
+	printf("*** All TCs have been destroyed ***\n");
+	return NULL;
+}
+
+static struct snobj *resource_map(const uint64_t *arr)
+{
+	struct snobj *r = snobj_map();
+
+	for (int i = 0; i < NUM_RESOURCES; i++) {
+		if (arr[i])
+			snobj_map_set(r, resource_names[i], snobj_uint(arr[i]));
+	}
+
+	return r;
+}
+
+static struct snobj *list_tasks_of_tc(const struct tc *c)
+{
+	struct snobj *r = snobj_list();
+	struct task *t;
+
+	cdlist_for_each_entry(t, &c->tasks, tc) {
+		struct snobj *task = snobj_map();
+
+		for (int i = 0; i < MAX_TASKS_PER_MODULE; i++) {
+			if (t->m->tasks[i] == t) {
+				snobj_map_set(task, "taskid", snobj_int(i));
+				break;
+			}
+		}
+
+		snobj_map_set(task, "name", snobj_str(t->m->name));
+		snobj_list_add(r, task);
+	}
+
+	return r;
+}
+
+/* All TCs of all workers, including the default ones (without "name")
+ * that are created for tasks attached to a worker */
+static struct snobj *handle_list_tcs(struct snobj *q)
+{
+	struct snobj *r = snobj_list();
+
+	for (int wid = 0; wid < MAX_WORKERS; wid++) {
+		struct tc *c;
+
+		if (!is_worker_active(wid))
+			continue;
+
+		cdlist_for_each_entry(c, &workers[wid]->s->tcs_all, sched_all) {
+			struct snobj *tc = snobj_map();
+
+			if (c->name[0])
+				snobj_map_set(tc, "name", snobj_str(c->name));
+			else if (c->auto_free)
+				snobj_map_set(tc, "default", snobj_int(1));
+			else
+				continue;	/* deleted, but still queued */
+
+			snobj_map_set(tc, "id", snobj_uint(c->id));
+			snobj_map_set(tc, "wid", snobj_int(wid));
+
+			if (c->parent->name[0])
+				snobj_map_set(tc, "parent",
+						snobj_str(c->parent->name));
+
+			snobj_map_set(tc, "priority",
+					snobj_int(c->params.priority));
+			snobj_map_set(tc, "share", snobj_int(c->params.share));
+			snobj_map_set(tc, "share_resource", snobj_str(
+				resource_names[c->params.share_resource]));
+			snobj_map_set(tc, "limit",
+					resource_map(c->params.limit));
+			snobj_map_set(tc, "max_burst",
+					resource_map(c->params.max_burst));
+			snobj_map_set(tc, "tasks", list_tasks_of_tc(c));
+
+			snobj_list_add(r, tc);
+		}
+	}
+
+	return r;
+}
+
+/* Cumulative usage of the TC (and its descendants), in the same units as
+ * the limits. "cycles_throttled" is how long it has been kept from running
+ * by its limits (not counting the current period, if throttled now). */
+static struct snobj *handle_get_tc_stats(struct snobj *q)
+{
+	const char *name;
+	struct tc *c;
+	struct tc_stats stats;
+	struct snobj *r;
+
+	name = snobj_str_get(q);
+	if (!name)
+		return snobj_err(EINVAL, "Argument must be a name in str");
+
+	if (!(c = find_tc(name)))
+		return snobj_err(ENOENT, "No TC '%s' found", name);
+
+	stats = c->stats;
+
+	r = snobj_map();
+	snobj_map_set(r, "timestamp", snobj_double(get_epoch_time()));
+	snobj_map_set(r, "tsc_hz", snobj_uint(tsc_hz));
+
+	for (int i = 0; i < NUM_RESOURCES; i++)
+		snobj_map_set(r, resource_names[i], snobj_uint(stats.usage[i]));
+
+	snobj_map_set(r, "cnt_throttled", snobj_uint(stats.cnt_throttled));
+	snobj_map_set(r, "cycles_throttled",
+			snobj_uint(stats.cycles_throttled));
+
+	return r;
+}
+
+/* All tasks of all modules, with the usage of their TCs. The usage of a
+ * default TC (of the task alone) starts over when the task is moved.
+ * "cycles_empty" is the part of "cycle" spent in runs with no packet. */
+static struct snobj *handle_list_tasks(struct snobj *q)
+{
+	struct snobj *r = snobj_list();
+
+	const struct module *modules[16];
+	int offset = 0;
+	int cnt;
+
+	while ((cnt = list_modules(modules, 16, offset)) > 0) {
+		for (int i = 0; i < cnt; i++) {
+			const struct module *m = modules[i];
+
+			for (int tid = 0; tid < MAX_TASKS_PER_MODULE; tid++) {
+				struct task *t = m->tasks[tid];
+				struct snobj *task;
+
+				if (!t)
+					continue;
+
+				task = snobj_map();
+				snobj_map_set(task, "name", snobj_str(m->name));
+				snobj_map_set(task, "taskid", snobj_int(tid));
+
+				if (task_is_attached(t)) {
+					const struct tc *c = t->c;
+
+					snobj_map_set(task, "wid", snobj_int(
+							get_sched_wid(c->s)));
+
+					if (c->name[0])
+						snobj_map_set(task, "tc",
+							snobj_str(c->name));
+
+					for (int j = 0; j < NUM_RESOURCES; j++)
+						snobj_map_set(task,
+							resource_names[j],
+							snobj_uint(c->stats.usage[j]));
+
+					snobj_map_set(task, "cycles_empty",
+						snobj_uint(c->stats.cycles_empty));
+				} else
+					snobj_map_set(task, "wid", snobj_int(-1));
+
+				snobj_list_add(r, task);
+			}
+		}
+
+		offset += cnt;
+	}
+
+	return r;
+}
+
+/* Moves a task to a new default TC of worker "wid", e.g., to balance the
+ * load. Only the two workers are paused. Tasks of TCs created by the user
+ * stay where they are, as the TC would lose them. */
+static struct snobj *handle_move_task(struct snobj *q)
+{
+	struct snobj *err;
+	struct task *t;
+	int wid;
+
+	if (!(t = get_task(q, &err)))
+		return err;
+
+	if ((wid = get_active_wid(q, &err)) < 0)
+		return err;
+
+	if (task_is_attached(t)) {
+		if (!t->c->auto_free)
+			return snobj_err(EBUSY, "Task %s:%hu is in TC '%s'",
+					t->m->name,
+					(task_id_t)snobj_eval_uint(q, "taskid"),
+					t->c->name);
+
+		if (t->c->s == workers[wid]->s)
+			return NULL;
+
+		task_detach(t);
+	}
+
+	assign_default_tc(workers[wid]->s, t);
+
+	return NULL;
+}
+
+static struct snobj *handle_attach_task(struct snobj *q)
+{
+	const char *tc_name;
+	task_id_t tid;
+	int wid;		/* TODO: worker_id_t */
+
+	struct snobj *err;
+	struct task *t;
+
+	if (!(t = get_task(q, &err)))
+		return err;
+
+	/* a task only in a default TC (e.g., taken when its module was
+	 * created) is moved, as with move_task */
+	tid = snobj_eval_uint(q, "taskid");
+	if (task_is_attached(t) && !t->c->auto_free)
+		return snobj_err(EBUSY, "Task %s:%hu is already attached to "
+				"a TC", t->m->name, tid);
+
+	tc_name = snobj_eval_str(q, "tc");
+	if (tc_name) {
+		struct tc *c;
+
+		if (snobj_eval_exists(q, "wid"))
+			return snobj_err(EINVAL, "Either 'tc' or 'wid' must be "
+					"given, but not both");
+
+		if (!(c = find_tc(tc_name)))
+			return snobj_err(ENOENT, "No TC '%s' found", tc_name);
+
+		if (!cdlist_is_empty(&c->pgroups))
+			return snobj_err(EBUSY, "TC '%s' has child classes, "
+					"so it cannot have tasks", tc_name);
+
+		task_detach(t);
+		assign_tc(t, c);
+		return NULL;
+	}
+
+	wid = snobj_eval_uint(q, "wid");
+	if (wid >= MAX_WORKERS)
+		return snobj_err(EINVAL, "'wid' must be between 0 and %d",
+				MAX_WORKERS - 1);
+
+	if (!is_worker_active(wid))
+		return snobj_err(EINVAL, "Worker %d does not exist", wid);
+
+	if (task_is_attached(t)) {
+		if (t->c->s == workers[wid]->s)
+			return NULL;
+
+		task_detach(t);
+	}
+
+	assign_default_tc(workers[wid]->s, t);
+
+	return NULL;
+}
+
+static struct snobj *handle_enable_tcpdump(struct snobj *q)
+{
+	const char *m_name;
+	const char *fifo;
+	gate_t gate;
+
+	struct module *m;
 
 	int ret;
 
@@ -612,9 +1611,14 @@ static struct handler_map sn_handlers[] = {
 	{ "pause_all", 		0, handle_pause_all },
 	{ "resume_all", 	0, handle_resume_all },
 
-	{ "list_workers",	0, handle_not_implemented },
+	/* pause and resume one worker, e.g., one of get_affected_workers */
+	{ "pause_worker", 	0, handle_pause_worker },
+	{ "resume_worker", 	0, handle_resume_worker },
+	{ "get_affected_workers", 0, handle_get_affected_workers },
+
+	{ "list_workers",	0, handle_list_workers },
 	{ "add_worker",		1, handle_add_worker },
-	{ "delete_worker",	1, handle_not_implemented },
+	{ "delete_worker",	1, handle_delete_worker },
 
 	{ "list_drivers",	0, handle_list_drivers },
 	{ "import_driver",	0, handle_not_implemented },	/* TODO */
@@ -630,24 +1634,64 @@ static struct handler_map sn_handlers[] = {
 
 	{ "reset_modules",	1, handle_reset_modules },
 	{ "list_modules",	0, handle_list_modules },
-	{ "create_module", 	1, handle_create_module },
-	{ "destroy_module", 	1, handle_destroy_module },
+	/* a new module is not run by any worker yet. Its tasks are handed to
+	 * a worker afterwards, pausing the worker briefly if needed */
+	{ "create_module", 	0, handle_create_module },
+	{ "destroy_module", 	1, handle_destroy_module, affected_by_arg },
 	{ "get_module_info",	0, handle_get_module_info },
-	{ "connect_modules", 	1, handle_connect_modules },
-	{ "disconnect_modules",	1, handle_disconnect_modules },
+	{ "get_all_stats",	0, handle_get_all_stats },
+	{ "connect_modules", 	1, handle_connect_modules, affected_by_m1 },
+	{ "disconnect_modules",	1, handle_disconnect_modules,
+						affected_by_name },
+
+	/* workers are paused only while the graph is applied */
+	{ "apply_graph",	0, handle_apply_graph },
 
-	{ "attach_task",	1, handle_attach_task },
+	{ "reset_tcs",		1, handle_reset_tcs },
+	{ "list_tcs",		0, handle_list_tcs },
+	{ "add_tc",		1, handle_add_tc, affected_by_parent },
+	{ "update_tc",		1, handle_update_tc, affected_by_tc_name },
+	{ "delete_tc",		1, handle_delete_tc, affected_by_tc_arg },
+	{ "get_tc_stats",	0, handle_get_tc_stats },
 
-	{ "enable_tcpdump",	1, handle_enable_tcpdump },
-	{ "disable_tcpdump",	1, handle_disable_tcpdump },
+	{ "list_tasks",		0, handle_list_tasks },
+	{ "attach_task",	1, handle_attach_task, affected_by_tc },
+	{ "move_task",		1, handle_move_task, affected_by_task },
+
+	{ "enable_tcpdump",	1, handle_enable_tcpdump, affected_by_name },
+	{ "disable_tcpdump",	1, handle_disable_tcpdump, affected_by_name },
 
 	{ "kill_bess",		1, handle_kill_bess },
 
+	/* workers are paused only if needed, see handle_batch() */
+	{ "batch",		0, handle_batch },
+
 	{ NULL, 		0, NULL }
 };
 
+static const struct handler_map *find_handler(const char *cmd)
+{
+	for (int i = 0; sn_handlers[i].cmd != NULL; i++) {
+		if (strcmp(cmd, sn_handlers[i].cmd) == 0)
+			return &sn_handlers[i];
+	}
+
+	return NULL;
+}
+
+/* as a bitmask, for a request that needs paused workers */
+static uint64_t workers_to_pause(const struct handler_map *h,
+		struct snobj *arg)
+{
+	if (h->affected)
+		return h->affected(arg);
+
+	return ~0ull;
+}
+
 static struct snobj *handle_snobj_softnic(struct snobj *q)
 {
+	const struct handler_map *h;
 	struct snobj *arg;
 	const char *s;
 
@@ -657,17 +1701,14 @@ static struct snobj *handle_snobj_softnic(struct snobj *q)
 
 	arg = snobj_map_get(q, "arg");
 
-	for (int i = 0; sn_handlers[i].cmd != NULL; i++) {
-		if (strcmp(s, sn_handlers[i].cmd) != 0)
-			continue;
+	h = find_handler(s);
+	if (!h)
+		return snobj_err(ENOTSUP, "Unknown command in 'cmd': '%s'", s);
 
-		if (sn_handlers[i].pause_needed && is_any_worker_running())
-			return snobj_err(EBUSY, "There is a running worker");
+	if (h->pause_needed && (workers_to_pause(h, arg) & get_running_workers()))
+		return snobj_err(EBUSY, "There is a running worker");
 
-		return sn_handlers[i].func(arg);
-	}
-
-	return snobj_err(ENOTSUP, "Unknown command in 'cmd': '%s'", s);
+	return h->func(arg);
 }
 
 static struct snobj *handle_snobj_module(struct snobj *q)
@@ -686,6 +1727,8 @@ static struct snobj *handle_snobj_module(struct snobj *q)
 		return snobj_err(ENOENT, "No module '%s' found", m_name);
 
 	cmd = snobj_eval_str(q, "cmd");
+	if (!cmd)
+		return snobj_err(EINVAL, "Missing 'cmd' field");
 
 	if (strcmp(cmd, "query") == 0) {
 		struct snobj *arg;
@@ -710,6 +1753,177 @@ static struct snobj *handle_snobj_module(struct snobj *q)
 		return snobj_err(ENOTSUP, "Not supported command '%s'", cmd);
 }
 
+/* These would interfere with the pause/resume done by handle_batch() */
+static const char *batch_excluded[] = {
+	"batch",
+	"pause_all",
+	"resume_all",
+	"pause_worker",
+	"resume_worker",
+	NULL
+};
+
+/* Checks an entry of a batch, and returns NULL if it is OK.
+ * The workers it needs to be paused are added to *wids. */
+static struct snobj *check_batch_entry(struct snobj *entry, uint64_t *wids)
+{
+	const struct handler_map *h;
+	const char *to;
+	const char *cmd;
+
+	if (snobj_type(entry) != TYPE_MAP)
+		return snobj_err(EINVAL, "The entry must be a map");
+
+	to = snobj_eval_str(entry, "to");
+	if (to && strcmp(to, "softnic") != 0)
+		return NULL;	/* checked by handle_snobj_module() */
+
+	cmd = snobj_eval_str(entry, "cmd");
+	if (!cmd)
+		return snobj_err(EINVAL, "Missing 'cmd' field");
+
+	for (int i = 0; batch_excluded[i]; i++) {
+		if (strcmp(cmd, batch_excluded[i]) == 0)
+			return snobj_err(EINVAL,
+					"'%s' cannot be used in a batch", cmd);
+	}
+
+	h = find_handler(cmd);
+	if (h && h->pause_needed)
+		*wids |= workers_to_pause(h, snobj_map_get(entry, "arg"));
+
+	return NULL;
+}
+
+/* Runs a list of requests in order, and returns the list of their results.
+ * Entries have the same format as requests, except that "to" defaults to
+ * "softnic" (e.g., {"cmd": "create_module", "arg": {...}}).
+ *
+ * Running workers that any entry needs to be paused (see handler_map) are
+ * paused before the first entry and resumed after the last one. An entry
+ * can only make more modules reachable from a worker by changing a module
+ * that the worker already reaches, so the workers are found beforehand.
+ * A failed entry does not stop the batch; its result is the error. */
+static struct snobj *handle_batch(struct snobj *q)
+{
+	struct snobj *errs;
+	struct snobj *r;
+
+	uint64_t wids = 0;
+	uint64_t paused;
+
+	if (!q || snobj_type(q) != TYPE_LIST)
+		return snobj_err(EINVAL, "Argument must be a list of requests");
+
+	/* refuse the whole batch before running anything */
+	errs = snobj_list();
+	for (int i = 0; i < snobj_size(q); i++) {
+		struct snobj *entry = snobj_list_get(q, i);
+		struct snobj *err;
+
+		err = check_batch_entry(entry, &wids);
+		if (err) {
+			snobj_map_set(err, "index", snobj_int(i));
+			snobj_list_add(errs, err);
+		}
+	}
+
+	if (snobj_size(errs) > 0)
+		return snobj_err_details(EINVAL, errs,
+				"%d invalid entries in the batch",
+				(int)snobj_size(errs));
+
+	snobj_free(errs);
+
+	paused = pause_workers(wids);
+
+	r = snobj_list();
+
+	for (int i = 0; i < snobj_size(q); i++) {
+		struct snobj *entry = snobj_list_get(q, i);
+		struct snobj *ret;
+		const char *to;
+
+		to = snobj_eval_str(entry, "to");
+		if (to && strcmp(to, "module") == 0)
+			ret = handle_snobj_module(entry);
+		else if (to && strcmp(to, "softnic") != 0)
+			ret = snobj_err(EINVAL,
+					"Unknown destination in 'to': %s", to);
+		else
+			ret = handle_snobj_softnic(entry);
+
+		/* No response was made? (normally means "success") */
+		if (!ret)
+			ret = snobj_nil();
+
+		snobj_list_add(r, ret);
+	}
+
+	resume_workers(paused);
+
+	return r;
+}
+
+static struct snobj *handle_subscribe(struct client *c, struct snobj *arg)
+{
+	struct subscription *sub = NULL;
+	struct snobj *r;
+
+	r = create_subscription(arg, &sub);
+
+	/* replaces the current one, if any */
+	if (sub) {
+		if (c->sub)
+			free_subscription(c->sub);
+		c->sub = sub;
+	}
+
+	return r;
+}
+
+static struct snobj *handle_unsubscribe(struct client *c, struct snobj *arg)
+{
+	struct snobj *r;
+
+	if (!c->sub)
+		return snobj_err(ENOENT, "Not subscribed");
+
+	r = snobj_map();
+	snobj_map_set(r, "pushes", snobj_uint(c->sub->seq));
+
+	free_subscription(c->sub);
+	c->sub = NULL;
+
+	return r;
+}
+
+/* commands about the connection of the client itself.
+ * They are not allowed in a batch. */
+static struct client_handler_map {
+	const char *cmd;
+	struct snobj *(*func)(struct client *, struct snobj *);
+} client_handlers[] = {
+	/* periodic stats pushed over the connection, see subscribe.h */
+	{ "subscribe",		handle_subscribe },
+	{ "unsubscribe",	handle_unsubscribe },
+
+	{ NULL,			NULL }
+};
+
+static struct snobj *handle_snobj_client(struct client *c, struct snobj *q)
+{
+	const char *s = snobj_eval_str(q, "cmd");
+
+	for (int i = 0; s && client_handlers[i].cmd != NULL; i++) {
+		if (strcmp(s, client_handlers[i].cmd) == 0)
+			return client_handlers[i].func(c,
+					snobj_map_get(q, "arg"));
+	}
+
+	return handle_snobj_softnic(q);
+}
+
 struct snobj *handle_request(struct client *c, struct snobj *q)
 {
 	struct snobj *r = NULL;
@@ -732,7 +1946,7 @@ struct snobj *handle_request(struct client *c, struct snobj *q)
 	}
 
 	if (strcmp(s, "softnic") == 0) {
-		r = handle_snobj_softnic(q);
+		r = handle_snobj_client(c, q);
 	} else if (strcmp(s, "module") == 0) {
 		r = handle_snobj_module(q);
 	} else
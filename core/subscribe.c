@@ -0,0 +1,476 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <errno.h>
+
+#include <rte_malloc.h>
+
+#include "subscribe.h"
+#include "port.h"
+#include "time.h"
+
+#define PORT_COUNTERS	6
+#define GATE_COUNTERS	2
+
+/* in the order of struct subscription's counters */
+static const char *port_counters[PORT_COUNTERS] = {
+	"inc_packets", "inc_dropped", "inc_bytes",
+	"out_packets", "out_dropped", "out_bytes",
+};
+
+static const char *gate_counters[GATE_COUNTERS] = {
+	"cnt", "pkts",
+};
+
+/* Ports and modules may be destroyed while subscribed.
+ * Their counters are 0 from then on. */
+static void collect_counters(const struct subscription *sub, uint64_t *vals)
+{
+	for (int i = 0; i < sub->num_ports; i++) {
+		uint64_t *v = &vals[i * PORT_COUNTERS];
+		struct port *p = find_port(sub->ports[i]);
+		port_stats_t stats;
+
+		if (!p) {
+			memset(v, 0, sizeof(uint64_t) * PORT_COUNTERS);
+			continue;
+		}
+
+		get_port_stats(p, &stats);
+
+		v[0] = stats[PACKET_DIR_INC].packets;
+		v[1] = stats[PACKET_DIR_INC].dropped;
+		v[2] = stats[PACKET_DIR_INC].bytes;
+		v[3] = stats[PACKET_DIR_OUT].packets;
+		v[4] = stats[PACKET_DIR_OUT].dropped;
+		v[5] = stats[PACKET_DIR_OUT].bytes;
+	}
+
+	vals += sub->num_ports * PORT_COUNTERS;
+
+	for (int i = 0; i < sub->num_gates; i++) {
+		uint64_t *v = &vals[i * GATE_COUNTERS];
+		struct module *m = find_module(sub->gates[i].module);
+		gate_t gate = sub->gates[i].gate;
+
+		v[0] = 0;
+		v[1] = 0;
+
+#if TRACK_GATES
+		if (m && gate < m->allocated_gates) {
+			v[0] = m->gates[gate].cnt;
+			v[1] = m->gates[gate].pkts;
+		}
+#endif
+	}
+}
+
+static int add_port(struct subscription *sub, const char *name)
+{
+	if (!find_port(name))
+		return -ENOENT;
+
+	strncpy(sub->ports[sub->num_ports++], name, SN_NAME_LEN - 1);
+	return 0;
+}
+
+static int count_gates(const struct module *m)
+{
+	int cnt = 0;
+
+	for (int i = 0; i < m->allocated_gates; i++)
+		if (m->gates[i].m)
+			cnt++;
+
+	return cnt;
+}
+
+static void add_gates(struct subscription *sub, const struct module *m)
+{
+	for (int i = 0; i < m->allocated_gates; i++) {
+		struct subscribed_gate *g;
+
+		if (!m->gates[i].m)
+			continue;
+
+		g = &sub->gates[sub->num_gates++];
+		strncpy(g->module, m->name, SN_NAME_LEN - 1);
+		g->gate = i;
+	}
+}
+
+/* ports/modules: lists of names, or NULL for all of them */
+static struct snobj *resolve_names(struct subscription *sub,
+		struct snobj *ports, struct snobj *modules)
+{
+	int max_ports;
+	int max_gates = 0;
+
+	if (ports) {
+		max_ports = ports->size;
+	} else {
+		const struct port *arr[16];
+		int cnt;
+
+		max_ports = 0;
+		while ((cnt = list_ports(arr, 16, max_ports)) > 0)
+			max_ports += cnt;
+	}
+
+	if (modules) {
+		for (int i = 0; i < modules->size; i++) {
+			const char *name = snobj_str_get(snobj_list_get(modules, i));
+			struct module *m;
+
+			if (!name)
+				return snobj_err(EINVAL,
+						"'modules' must be a list of names");
+
+			if (!(m = find_module(name)))
+				return snobj_err(ENOENT, "No module '%s' found",
+						name);
+
+			max_gates += count_gates(m);
+		}
+	} else {
+		const struct module *arr[16];
+		int offset = 0;
+		int cnt;
+
+		while ((cnt = list_modules(arr, 16, offset)) > 0) {
+			for (int i = 0; i < cnt; i++)
+				max_gates += count_gates(arr[i]);
+			offset += cnt;
+		}
+	}
+
+	sub->ports = rte_zmalloc("sub_ports",
+			SN_NAME_LEN * (max_ports ? : 1), 0);
+	sub->gates = rte_zmalloc("sub_gates",
+			sizeof(struct subscribed_gate) * (max_gates ? : 1), 0);
+	if (!sub->ports || !sub->gates)
+		return snobj_err(ENOMEM, "Out of memory");
+
+	if (ports) {
+		for (int i = 0; i < ports->size; i++) {
+			const char *name = snobj_str_get(snobj_list_get(ports, i));
+
+			if (!name)
+				return snobj_err(EINVAL,
+						"'ports' must be a list of names");
+
+			if (add_port(sub, name))
+				return snobj_err(ENOENT, "No port `%s' found",
+						name);
+		}
+	} else {
+		const struct port *arr[16];
+		int offset = 0;
+		int cnt;
+
+		while ((cnt = list_ports(arr, 16, offset)) > 0) {
+			for (int i = 0; i < cnt; i++)
+				add_port(sub, arr[i]->name);
+			offset += cnt;
+		}
+	}
+
+	if (modules) {
+		for (int i = 0; i < modules->size; i++) {
+			const char *name = snobj_str_get(snobj_list_get(modules, i));
+			add_gates(sub, find_module(name));
+		}
+	} else {
+		const struct module *arr[16];
+		int offset = 0;
+		int cnt;
+
+		while ((cnt = list_modules(arr, 16, offset)) > 0) {
+			for (int i = 0; i < cnt; i++)
+				add_gates(sub, arr[i]);
+			offset += cnt;
+		}
+	}
+
+	return NULL;
+}
+
+static struct snobj *make_snapshot(const struct subscription *sub)
+{
+	struct snobj *r = snobj_map();
+	struct snobj *ports = snobj_map();
+	struct snobj *gates = snobj_map();
+	struct snobj *names = snobj_list();
+	struct snobj *modules = snobj_list();
+	struct snobj *ogates = snobj_list();
+
+	const uint64_t *gate_vals = sub->last + sub->num_ports * PORT_COUNTERS;
+
+	for (int i = 0; i < sub->num_ports; i++)
+		snobj_list_add(names, snobj_str(sub->ports[i]));
+
+	snobj_map_set(ports, "name", names);
+
+	for (int j = 0; j < PORT_COUNTERS; j++) {
+		struct snobj *col = snobj_list();
+
+		for (int i = 0; i < sub->num_ports; i++)
+			snobj_list_add(col,
+				snobj_uint(sub->last[i * PORT_COUNTERS + j]));
+
+		snobj_map_set(ports, port_counters[j], col);
+	}
+
+	for (int i = 0; i < sub->num_gates; i++) {
+		snobj_list_add(modules, snobj_str(sub->gates[i].module));
+		snobj_list_add(ogates, snobj_uint(sub->gates[i].gate));
+	}
+
+	snobj_map_set(gates, "module", modules);
+	snobj_map_set(gates, "gate", ogates);
+
+	for (int j = 0; j < GATE_COUNTERS; j++) {
+		struct snobj *col = snobj_list();
+
+		for (int i = 0; i < sub->num_gates; i++)
+			snobj_list_add(col,
+				snobj_uint(gate_vals[i * GATE_COUNTERS + j]));
+
+		snobj_map_set(gates, gate_counters[j], col);
+	}
+
+	snobj_map_set(r, "timestamp", snobj_double(get_epoch_time()));
+	snobj_map_set(r, "interval", snobj_double(sub->interval_ms / 1000.0));
+	snobj_map_set(r, "ports", ports);
+	snobj_map_set(r, "gates", gates);
+
+	return r;
+}
+
+struct snobj *create_subscription(struct snobj *arg,
+		struct subscription **psub)
+{
+	struct subscription *sub;
+	struct snobj *ports = NULL;
+	struct snobj *modules = NULL;
+	struct snobj *r;
+
+	double interval = 1.0;
+
+	if (arg) {
+		struct snobj *t;
+
+		if (snobj_type(arg) != TYPE_MAP)
+			return snobj_err(EINVAL, "Argument must be a map");
+
+		ports = snobj_map_get(arg, "ports");
+		if (ports && snobj_type(ports) != TYPE_LIST)
+			return snobj_err(EINVAL, "'ports' must be a list");
+
+		modules = snobj_map_get(arg, "modules");
+		if (modules && snobj_type(modules) != TYPE_LIST)
+			return snobj_err(EINVAL, "'modules' must be a list");
+
+		/* subscribing to ports only, or modules only */
+		if (ports || modules) {
+			if (ports)
+				snobj_acquire(ports);
+			else
+				ports = snobj_list();
+
+			if (modules)
+				snobj_acquire(modules);
+			else
+				modules = snobj_list();
+		}
+
+		if ((t = snobj_map_get(arg, "interval"))) {
+			if (snobj_type(t) == TYPE_DOUBLE)
+				interval = snobj_double_get(t);
+			else if (snobj_type(t) == TYPE_INT)
+				interval = snobj_int_get(t);
+			else
+				interval = -1;
+		}
+	}
+
+	if (interval < 0.001) {
+		r = snobj_err(EINVAL, "'interval' must be at least 0.001 (sec)");
+		goto out;
+	}
+
+	sub = rte_zmalloc("subscription", sizeof(*sub), 0);
+	if (!sub) {
+		r = snobj_err(ENOMEM, "Out of memory");
+		goto out;
+	}
+
+	sub->interval_ms = (int)(interval * 1000);
+
+	r = resolve_names(sub, ports, modules);
+	if (r) {
+		free_subscription(sub);
+		goto out;
+	}
+
+	sub->num_counters = sub->num_ports * PORT_COUNTERS +
+			sub->num_gates * GATE_COUNTERS;
+	sub->last = rte_zmalloc("sub_counters",
+			sizeof(uint64_t) * (sub->num_counters ? : 1), 0);
+	sub->cur = rte_zmalloc("sub_counters",
+			sizeof(uint64_t) * (sub->num_counters ? : 1), 0);
+	sub->reset = rte_zmalloc("sub_reset",
+			sub->num_ports + sub->num_gates + 1, 0);
+	if (!sub->last || !sub->cur || !sub->reset) {
+		free_subscription(sub);
+		r = snobj_err(ENOMEM, "Out of memory");
+		goto out;
+	}
+
+	collect_counters(sub, sub->last);
+	sub->next_push_ms = get_monotonic_ms() + sub->interval_ms;
+
+	*psub = sub;
+	r = make_snapshot(sub);
+
+out:
+	snobj_free(ports);
+	snobj_free(modules);
+	return r;
+}
+
+void free_subscription(struct subscription *sub)
+{
+	rte_free(sub->ports);
+	rte_free(sub->gates);
+	rte_free(sub->last);
+	rte_free(sub->cur);
+	rte_free(sub->reset);
+	rte_free(sub);
+}
+
+/* 1 for each row whose counters have gone backwards (e.g., its port or module
+ * has been destroyed, or recreated with the same name) */
+static void find_resets(const uint64_t *old, const uint64_t *new,
+		int num_rows, int width, uint8_t *reset)
+{
+	for (int i = 0; i < num_rows; i++) {
+		reset[i] = 0;
+
+		for (int j = 0; j < width; j++) {
+			if (new[i * width + j] < old[i * width + j]) {
+				reset[i] = 1;
+				break;
+			}
+		}
+	}
+}
+
+/* A list of the changes in column j (of width n) of the counters,
+ * or NULL if none of them has changed. Rows that have been reset have
+ * their new absolute values instead. */
+static struct snobj *delta_column(const uint64_t *old, const uint64_t *new,
+		const uint8_t *reset, int num_rows, int width, int j)
+{
+	struct snobj *col;
+	int changed = 0;
+
+	for (int i = 0; i < num_rows; i++) {
+		if (new[i * width + j] != old[i * width + j]) {
+			changed = 1;
+			break;
+		}
+	}
+
+	if (!changed)
+		return NULL;
+
+	col = snobj_list();
+	for (int i = 0; i < num_rows; i++) {
+		uint64_t v = new[i * width + j];
+
+		if (!reset[i])
+			v -= old[i * width + j];
+
+		snobj_list_add(col, snobj_uint(v));
+	}
+
+	return col;
+}
+
+/* the indices of the reset rows, or NULL if there is none */
+static struct snobj *reset_list(const uint8_t *reset, int num_rows)
+{
+	struct snobj *list = NULL;
+
+	for (int i = 0; i < num_rows; i++) {
+		if (reset[i]) {
+			if (!list)
+				list = snobj_list();
+			snobj_list_add(list, snobj_uint(i));
+		}
+	}
+
+	return list;
+}
+
+struct snobj *make_push(struct subscription *sub)
+{
+	struct snobj *r;
+	struct snobj *ports;
+	struct snobj *gates;
+	struct snobj *resets;
+
+	uint64_t *vals = sub->cur;
+	int gate_off = sub->num_ports * PORT_COUNTERS;
+
+	uint8_t *port_reset = sub->reset;
+	uint8_t *gate_reset = sub->reset + sub->num_ports;
+
+	int64_t now = get_monotonic_ms();
+
+	collect_counters(sub, vals);
+
+	find_resets(sub->last, vals, sub->num_ports, PORT_COUNTERS,
+			port_reset);
+	find_resets(sub->last + gate_off, vals + gate_off, sub->num_gates,
+			GATE_COUNTERS, gate_reset);
+
+	r = snobj_map();
+	snobj_map_set(r, "push", snobj_str("stats"));
+	snobj_map_set(r, "seq", snobj_uint(++sub->seq));
+	snobj_map_set(r, "timestamp", snobj_double(get_epoch_time()));
+
+	ports = snobj_map();
+	for (int j = 0; j < PORT_COUNTERS; j++) {
+		struct snobj *col = delta_column(sub->last, vals, port_reset,
+				sub->num_ports, PORT_COUNTERS, j);
+		if (col)
+			snobj_map_set(ports, port_counters[j], col);
+	}
+	if ((resets = reset_list(port_reset, sub->num_ports)))
+		snobj_map_set(ports, "reset", resets);
+	snobj_map_set(r, "ports", ports);
+
+	gates = snobj_map();
+	for (int j = 0; j < GATE_COUNTERS; j++) {
+		struct snobj *col = delta_column(sub->last + gate_off,
+				vals + gate_off, gate_reset, sub->num_gates,
+				GATE_COUNTERS, j);
+		if (col)
+			snobj_map_set(gates, gate_counters[j], col);
+	}
+	if ((resets = reset_list(gate_reset, sub->num_gates)))
+		snobj_map_set(gates, "reset", resets);
+	snobj_map_set(r, "gates", gates);
+
+	sub->cur = sub->last;
+	sub->last = vals;
+
+	/* on schedule, unless the pushes have fallen behind */
+	sub->next_push_ms += sub->interval_ms;
+	if (sub->next_push_ms <= now)
+		sub->next_push_ms = now + sub->interval_ms;
+
+	return r;
+}
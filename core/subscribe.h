@@ -0,0 +1,60 @@
+#ifndef _SUBSCRIBE_H_
+#define _SUBSCRIBE_H_
+
+#include <stdint.h>
+
+#include "namespace.h"
+#include "module.h"
+#include "snobj.h"
+
+/* Counters of some ports and module gates, pushed to a client periodically
+ * (see "subscribe" in snctl.c). Only the changes since the previous push
+ * are sent, so a push that is skipped (e.g., the client is too slow to
+ * receive the previous one) is merged into the next one. */
+
+struct subscribed_gate {
+	char module[SN_NAME_LEN];
+	gate_t gate;
+};
+
+struct subscription {
+	int interval_ms;
+	int64_t next_push_ms;		/* when the next push is due */
+	uint64_t seq;			/* of the last push */
+
+	int num_ports;
+	char (*ports)[SN_NAME_LEN];
+
+	int num_gates;
+	struct subscribed_gate *gates;
+
+	/* 6 for each port, then 2 for each gate, as of the last push */
+	int num_counters;
+	uint64_t *last;
+	uint64_t *cur;			/* scratch space for make_push() */
+	uint8_t *reset;			/* for each port, then each gate */
+};
+
+/* arg: {"ports": [names], "modules": [names], "interval": seconds}.
+ * Without "ports" and "modules", all ports and modules are subscribed.
+ * All connected gates of the modules are subscribed.
+ * On success, sets *psub and returns the current (absolute) counters
+ * in the format of get_all_stats, except that gates have no "name" (of the
+ * next module) column. Returns an error otherwise. */
+struct snobj *create_subscription(struct snobj *arg,
+		struct subscription **psub);
+
+void free_subscription(struct subscription *sub);
+
+/* The next push message, with the changes since the previous one:
+ *   {"push": "stats", "seq": 1, "timestamp": 1445412345.67,
+ *    "ports": {"inc_packets": [...], ...}, "gates": {"pkts": [...], ...}}
+ * The lists are in the order of the create_subscription() reply. Lists of
+ * counters that have not changed at all are omitted.
+ * If any counter of a port or gate has gone backwards (e.g., the port has
+ * been destroyed, or recreated with the same name), its index is in the
+ * "reset" list of "ports" or "gates", and its values are the new absolute
+ * ones instead of changes. */
+struct snobj *make_push(struct subscription *sub);
+
+#endif
@@ -1,4 +1,5 @@
 #include <assert.h>
+#include <errno.h>
 
 #include <rte_malloc.h>
 
@@ -59,10 +60,12 @@ void task_detach(struct task *t)
 	cdlist_del(&t->tc);
 	tc_dec_refcnt(c);
 
-	/* c is up for autofree, and the task t was the last one standing? */
-	if (cdlist_is_empty(&c->tasks) && c->auto_free) {
+	if (cdlist_is_empty(&c->tasks)) {
 		tc_leave(c);		/* stop scheduling this TC */
-		tc_dec_refcnt(c);	/* release my reference */
+
+		/* c is up for autofree, and t was the last one standing? */
+		if (c->auto_free)
+			tc_dec_refcnt(c);	/* release my reference */
 	}
 }
 
@@ -85,34 +88,73 @@ void assign_default_tc(struct sched *s, struct task *t)
 	tc_join(c_def);
 }
 
-static int get_next_wid(int *wid)
+void assign_tc(struct task *t, struct tc *c)
+{
+	assert(cdlist_is_empty(&c->pgroups));
+
+	task_attach(t, c);
+
+	if (!c->state.runnable)
+		tc_join(c);
+}
+
+static int rr_next = 0;
+
+/* The scheduler of a running worker must not be changed */
+static int is_worker_stopped(int wid)
 {
-	static int rr_next = 0;
+	return is_worker_active(wid) && workers[wid]->status != WORKER_RUNNING;
+}
 
+/* -ENOENT if there is no active worker, -EBUSY if all are running */
+static int get_next_wid(int *wid)
+{
 	if (num_workers == 0)
-		return -1;
+		return -ENOENT;
+
+	for (int i = 0; i < MAX_WORKERS; i++) {
+		int w = (rr_next + i) % MAX_WORKERS;
 
-	while (!is_worker_active(rr_next))
-		rr_next = (rr_next + 1) % MAX_WORKERS;
+		if (is_worker_stopped(w)) {
+			*wid = w;
+			rr_next = (w + 1) % MAX_WORKERS;
+			return 0;
+		}
+	}
 
-	*wid = rr_next;
-	rr_next = (rr_next + 1) % MAX_WORKERS;
+	return -EBUSY;
+}
+
+static int has_orphan_tasks()
+{
+	struct task *t;
+
+	cdlist_for_each_entry(t, &all_tasks, all_tasks) {
+		if (!task_is_attached(t))
+			return 1;
+	}
 
 	return 0;
 }
 
-/* Spread all orphan tasks across workers with round robin */
+/* Spread all orphan tasks across paused workers with round robin.
+ * Tasks are left orphan if all workers are running. */
 void process_orphan_tasks()
 {
 	struct task *t;
 
 	cdlist_for_each_entry(t, &all_tasks, all_tasks) {
 		int wid;
+		int ret;
 
 		if (task_is_attached(t))
 			continue;
 
-		if (get_next_wid(&wid) < 0) {
+		ret = get_next_wid(&wid);
+		if (ret == -EBUSY)
+			return;
+
+		if (ret < 0) {
 			wid = 0;
 			/* There is no active worker. Create one. */
 			launch_worker(wid, 0);
@@ -121,3 +163,35 @@ void process_orphan_tasks()
 		assign_default_tc(workers[wid]->s, t);
 	}
 }
+
+int get_orphan_tasks_worker()
+{
+	int running = -1;
+
+	if (!has_orphan_tasks())
+		return -1;
+
+	for (int i = 0; i < MAX_WORKERS; i++) {
+		int w = (rr_next + i) % MAX_WORKERS;
+
+		if (is_worker_stopped(w))
+			return w;
+
+		if (running < 0 && is_worker_active(w))
+			running = w;
+	}
+
+	return running;
+}
+
+void adopt_orphan_tasks()
+{
+	int wid = get_orphan_tasks_worker();
+
+	if (wid >= 0 && workers[wid]->status == WORKER_RUNNING) {
+		pause_worker(wid);
+		process_orphan_tasks();
+		resume_worker(wid);
+	} else
+		process_orphan_tasks();
+}
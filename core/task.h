@@ -50,6 +50,16 @@ static inline struct task_result task_scheduled(struct task *t)
 }
 
 void assign_default_tc(struct sched *s, struct task *t);
+
+/* to a TC created by the user, which has no child classes */
+void assign_tc(struct task *t, struct tc *c);
 void process_orphan_tasks();
 
+/* The worker to pause so that orphan tasks (e.g., of a new module) can be
+ * handed to it, or -1 if there is none (or no worker at all) */
+int get_orphan_tasks_worker();
+
+/* Hands orphan tasks to a worker, pausing it briefly if all are running */
+void adopt_orphan_tasks();
+
 #endif
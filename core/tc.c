@@ -1,4 +1,5 @@
 #include <assert.h>
+#include <errno.h>
 #include <stdio.h>
 
 #include <sys/time.h>
@@ -18,7 +19,6 @@
 
 /* this library is not thread safe */
 
-#define MAX_LIMIT_POW		36
 #define USAGE_AMPLIFIER_POW	32
 
 static void tc_add_to_parent_pgroup(struct tc *c, int share_resource)
@@ -60,12 +60,50 @@ pgroup_add:
 	c->ss.my_pgroup = g;
 }
 
+static void tc_remove_from_parent_pgroup(struct tc *c)
+{
+	struct pgroup *g = c->ss.my_pgroup;
+
+	/* the reference of the queue is kept by the caller */
+	if (c->state.queued)
+		heap_remove(&g->pq, c);
+
+	g->num_children--;
+	if (g->num_children == 0) {
+		cdlist_del(&g->tc);
+		heap_close(&g->pq);
+		rte_free(g);
+	}
+
+	c->ss.my_pgroup = NULL;
+}
+
+static void tc_set_limits(struct tc *c, const struct tc_params *params)
+{
+	c->has_limit = 0;
+
+	for (int i = 0; i < NUM_RESOURCES; i++) {
+		assert(params->limit[i] < (1UL << MAX_LIMIT_POW));
+		
+		c->tb[i].limit = (params->limit[i] << (USAGE_AMPLIFIER_POW - 4)) 
+				/ (tsc_hz >> 4);
+
+		if (c->tb[i].limit) {
+			assert(params->max_burst[i] < (1UL << MAX_LIMIT_POW));
+			c->tb[i].max_burst = (params->max_burst[i] << 
+					(USAGE_AMPLIFIER_POW - 4)) / (tsc_hz >> 4);
+			c->has_limit = 1;
+		} else
+			c->tb[i].max_burst = 0;
+
+		c->tb[i].tokens = 0;
+	}
+}
+
 struct tc *tc_init(struct sched *s, const struct tc_params *params)
 {
 	struct tc *c;
 
-	int i;
-
 	assert(!s->current);
 
 	assert(0 <= params->share_resource);
@@ -89,24 +127,11 @@ struct tc *tc_init(struct sched *s, const struct tc_params *params)
 	tc_inc_refcnt(c->parent);
 
 	c->auto_free = params->auto_free;
+	c->params = *params;
 
 	c->last_tsc = rdtsc();
 
-	for (i = 0; i < NUM_RESOURCES; i++) {
-		assert(params->limit[i] < (1UL << MAX_LIMIT_POW));
-		
-		c->tb[i].limit = (params->limit[i] << (USAGE_AMPLIFIER_POW - 4)) 
-				/ (tsc_hz >> 4);
-
-		if (c->tb[i].limit) {
-			assert(params->max_burst[i] < (1UL << MAX_LIMIT_POW));
-			c->tb[i].max_burst = (params->max_burst[i] << 
-					(USAGE_AMPLIFIER_POW - 4)) / (tsc_hz >> 4);
-			c->has_limit = 1;
-		}
-
-		c->tb[i].tokens = 0;
-	}
+	tc_set_limits(c, params);
 	
 	c->ss.stride = STRIDE1 / params->share;
 	c->ss.pass = 0;			/* will be set when joined */
@@ -124,7 +149,6 @@ struct tc *tc_init(struct sched *s, const struct tc_params *params)
 
 void _tc_do_free(struct tc *c)
 {
-	struct pgroup *g = c->ss.my_pgroup;
 	struct tc *parent = c->parent;
 	
 	assert(c->refcnt == 0);
@@ -135,13 +159,8 @@ void _tc_do_free(struct tc *c)
 	assert(cdlist_is_empty(&c->pgroups));
 	assert(cdlist_is_empty(&c->tasks));
 
-	if (g) {
-		g->num_children--;
-		if (g->num_children == 0) {
-			cdlist_del(&g->tc);
-			heap_close(&g->pq);
-			rte_free(g);
-		}
+	if (c->ss.my_pgroup) {
+		tc_remove_from_parent_pgroup(c);
 
 		cdlist_del(&c->sched_all);
 		c->s->num_classes--;
@@ -159,23 +178,55 @@ static inline int tc_is_root(struct tc *c)
 	return c->parent == NULL;
 }
 
-void tc_join(struct tc *c)
+static void tc_enqueue(struct tc *c)
 {
-	struct pgroup *g = c->ss.my_pgroup;
-	struct heap *pq = &g->pq;
+	struct heap *pq = &c->ss.my_pgroup->pq;
 	struct tc *next = heap_peek(pq);
 
-	assert(!c->state.queued);
+	c->state.queued = 1;
+	c->ss.pass = (next ? next->ss.pass : 0) + c->ss.remain;
+	heap_push(pq, c->ss.pass, c);
+	tc_inc_refcnt(c);
+}
+
+/* pick() reaches c only if all of its ancestors are queued as well */
+static void tc_enqueue_ancestors(struct tc *c)
+{
+	for (c = c->parent; !tc_is_root(c); c = c->parent) {
+		c->state.runnable = 1;
+
+		/* will be queued when resumed */
+		if (c->state.throttled)
+			return;
+
+		if (!c->state.queued)
+			tc_enqueue(c);
+	}
+}
+
+static int tc_has_queued_children(struct tc *c)
+{
+	struct pgroup *g;
+
+	cdlist_for_each_entry(g, &c->pgroups, tc) {
+		if (g->pq.num_nodes > 0)
+			return 1;
+	}
+
+	return 0;
+}
+
+void tc_join(struct tc *c)
+{
 	assert(!c->state.runnable);
 
 	c->state.runnable = 1;
 
-	if (!c->state.throttled) {
-		c->state.queued = 1;
-		c->ss.pass = (next ? next->ss.pass : 0) + c->ss.remain;
-		heap_push(pq, c->ss.pass, c);
-		tc_inc_refcnt(c);
-	}
+	/* if it has left but is still in the queue, it stays there */
+	if (!c->state.throttled && !c->state.queued)
+		tc_enqueue(c);
+
+	tc_enqueue_ancestors(c);
 }
 
 void tc_leave(struct tc *c)
@@ -189,7 +240,70 @@ void tc_leave(struct tc *c)
 		return;
 
 	c->state.runnable = 0;
-	c->ss.remain = c->ss.pass - next->ss.pass;
+	c->ss.remain = c->ss.pass - (next ? next->ss.pass : 0);
+}
+
+void tc_update(struct tc *c, const struct tc_params *params)
+{
+	struct pgroup *g = c->ss.my_pgroup;
+
+	assert(!c->s->current);
+
+	assert(0 <= params->share_resource);
+	assert(params->share_resource < NUM_RESOURCES);
+
+	assert(params->share > 0);
+	assert(params->share <= MAX_SHARE);
+
+	if (c->priority != params->priority ||
+			g->resource != params->share_resource) {
+		int queued = c->state.queued;
+
+		tc_remove_from_parent_pgroup(c);
+
+		c->priority = params->priority;
+		tc_add_to_parent_pgroup(c, params->share_resource);
+
+		/* the reference of the old queue moves to the new one */
+		if (queued) {
+			c->ss.remain = 0;
+			tc_enqueue(c);
+			tc_dec_refcnt(c);
+		}
+	}
+
+	c->ss.stride = STRIDE1 / params->share;
+	tc_set_limits(c, params);
+
+	c->params = *params;
+}
+
+int tc_set_name(struct tc *c, const char *name)
+{
+	int ret;
+
+	if (strlen(name) >= SN_NAME_LEN)
+		return -EINVAL;
+
+	ret = ns_insert(NS_TYPE_TC, name, (void *)c);
+	if (ret < 0)
+		return ret;
+
+	strcpy(c->name, name);
+	return 0;
+}
+
+void tc_unset_name(struct tc *c)
+{
+	if (c->name[0]) {
+		ns_remove(c->name);
+		c->name[0] = '\0';
+	}
+}
+
+struct tc *find_tc(const char *name)
+{
+	return (struct tc *)ns_lookup(NS_TYPE_TC, name);
 }
 
 struct sched *sched_init()
@@ -218,16 +332,28 @@ struct sched *sched_init()
 void sched_free(struct sched *s)
 {
 	struct tc *c;
-	struct tc *next;
-
-	cdlist_for_each_entry_safe(c, next, &s->tcs_all, sched_all) {
-		if (c->state.queued)
-			tc_dec_refcnt(c);
+	int freed;
 
-		if (c->state.throttled)
-			tc_dec_refcnt(c);
+	/* the queues are going away, along with their references */
+	cdlist_for_each_entry(c, &s->tcs_all, sched_all) {
+		c->refcnt -= c->state.queued + c->state.throttled;
+		c->state.queued = 0;
+		c->state.throttled = 0;
 	}
 
+	/* freeing a TC may leave its parent unreferenced, so start over */
+	do {
+		freed = 0;
+
+		cdlist_for_each_entry(c, &s->tcs_all, sched_all) {
+			if (c->refcnt == 0) {
+				_tc_do_free(c);
+				freed = 1;
+				break;
+			}
+		}
+	} while (freed);
+
 	heap_close(&s->pq);
 	tc_dec_refcnt(&s->root);
 
@@ -249,6 +375,7 @@ static void resume_throttled(struct sched *s, uint64_t tsc)
 		heap_pop(&s->pq);
 
 		c->state.throttled = 0;
+		c->stats.cycles_throttled += tsc - c->last_tsc;
 		
 		if (c->state.runnable) {
 			/* No refcnt is adjusted, since we transfer 
@@ -256,6 +383,7 @@ static void resume_throttled(struct sched *s, uint64_t tsc)
 			c->state.queued = 1;
 			c->last_tsc = event_tsc;
 			heap_push(&c->ss.my_pgroup->pq, 0, c);
+			tc_enqueue_ancestors(c);
 		} else
 			tc_dec_refcnt(c);
 	}
@@ -281,8 +409,13 @@ again:
 
 		assert(child->state.queued);
 
+		/* to be dequeued by sched_next() */
 		if (!child->state.runnable)
 			return child;
+
+		if (!cdlist_is_empty(&child->pgroups) &&
+				!tc_has_queued_children(child))
+			return child;
 	
 		c = child;
 		goto again;
@@ -307,7 +440,7 @@ again:
 		c = NULL;
 
 	if (c) {
-		if (!c->state.runnable) {
+		if (!c->state.runnable || !cdlist_is_empty(&c->pgroups)) {
 			c->state.queued = 0;
 			heap_pop(&c->ss.my_pgroup->pq);
 			tc_dec_refcnt(c);
@@ -446,7 +579,8 @@ static void sched_done(struct sched *s, struct tc *c,
 			next = heap_peek(pq);
 			c->ss.remain = c->ss.pass - (next ? next->ss.pass : 0);
 
-			reschedule = (pq->num_nodes > 0);
+			/* the parent may have other pgroups */
+			reschedule = tc_has_queued_children(c->parent);
 		}
 
 		c = c->parent;
@@ -637,7 +771,8 @@ void sched_loop(struct sched *s)
 		 * to mitigate expensive operations */
 		if ((round & 0xff) == 0) {
 			if (is_pause_requested()) {
-				block_worker();
+				if (block_worker())
+					return;
 				last_print_tsc = checkpoint = now = rdtsc();
 			} else if (global_opts.print_tc_stats &&
 					now - last_print_tsc >= tsc_hz) {
@@ -663,6 +798,12 @@ void sched_loop(struct sched *s)
 			usage[RESOURCE_PACKET] = ret.packets;
 			usage[RESOURCE_BIT] = ret.bits;
 
+			if (!ret.packets) {
+				s->stats.cnt_empty++;
+				s->stats.cycles_empty += usage[RESOURCE_CYCLE];
+				c->stats.cycles_empty += usage[RESOURCE_CYCLE];
+			}
+
 			sched_done(s, c, usage, 1, now);
 		} else {
 			now = rdtsc();
@@ -4,6 +4,7 @@
 #include <string.h>
 
 #include "common.h"
+#include "namespace.h"
 #include "utils/minheap.h"
 #include "utils/cdlist.h"
 #include "utils/simd.h"
@@ -22,6 +23,9 @@ enum {
 
 /* share is defined relatively, so 1024 should be large enough */
 #define MAX_SHARE	(1 << 10)
+
+/* limit and max_burst must be less than 2^MAX_LIMIT_POW */
+#define MAX_LIMIT_POW	36
 #define STRIDE1		(1 << 20)
 
 /* this doesn't mean anything, other than avoiding int64 overflow */
@@ -60,6 +64,10 @@ struct tc_params {
 struct tc_stats {
 	resource_arr_t usage;
 	uint64_t cnt_throttled;
+	uint64_t cycles_throttled;
+
+	/* of task runs that processed no packet (leaf classes only) */
+	uint64_t cycles_empty;
 };
 
 /***************************************************************************
@@ -132,6 +140,9 @@ struct tc {
 	int32_t priority;		/* the higher, the more important */
 	int auto_free;			/* is this TC ephemeral? */
 
+	char name[SN_NAME_LEN];		/* empty, unless created by the user */
+	struct tc_params params;	/* as of tc_init() or tc_update() */
+
 	/* linked list of all classes belonging to the same scheduler */
 	struct cdlist_item sched_all;
 
@@ -142,6 +153,10 @@ struct sched_stats {
 	resource_arr_t usage;
 	uint64_t cnt_idle;
 	uint64_t cycles_idle;
+
+	/* task runs that processed no packet (included in usage) */
+	uint64_t cnt_empty;
+	uint64_t cycles_empty;
 };
 
 struct sched {
@@ -166,6 +181,16 @@ void _tc_do_free(struct tc *c);
 void tc_join(struct tc *c);
 void tc_leave(struct tc *c);
 
+/* Changes the share (and its resource), priority, and limits of c.
+ * The parent cannot be changed. The worker of c must not be running. */
+void tc_update(struct tc *c, const struct tc_params *params);
+
+/* Named TCs are created by the user (see "add_tc" in snctl.c), and can be
+ * found by their name until tc_unset_name() */
+int tc_set_name(struct tc *c, const char *name);
+void tc_unset_name(struct tc *c);
+struct tc *find_tc(const char *name);
+
 static inline void tc_inc_refcnt(struct tc *c)
 {
 	c->refcnt++;
@@ -184,6 +209,7 @@ void sched_free(struct sched *s);
 //struct tc *sched_next(struct sched *s);
 //void sched_done(struct sched *s, const uint32_t *usage, int reschedule);
 
+/* returns when the worker is destroyed */
 void sched_loop(struct sched *s);
 
 void sched_test_alloc();
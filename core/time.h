@@ -3,6 +3,7 @@
 
 #include <stdint.h>
 #include <stdlib.h>
+#include <time.h>
 
 #include <sys/time.h>
 
@@ -29,4 +30,12 @@ static inline double get_epoch_time()
 	return tv.tv_sec + tv.tv_usec / 1000000.0;
 }
 
+/* Return monotonic time in milliseconds, e.g., for epoll_wait() timeouts */
+static inline int64_t get_monotonic_ms()
+{
+	struct timespec ts;
+	clock_gettime(CLOCK_MONOTONIC, &ts);
+	return ts.tv_sec * 1000 + ts.tv_nsec / 1000000;
+}
+
 #endif
@@ -149,4 +149,26 @@ static void heap_pop(struct heap *h)
 	heap_replace(h, val, data);
 }
 
+/* Rebuilds the heap without data. Not for the datapath. */
+static void heap_remove(struct heap *h, void *data)
+{
+	struct heap tmp;
+
+	heap_init(&tmp);
+
+	while (h->num_nodes > 0) {
+		int64_t val;
+		void *d;
+
+		heap_peek_valdata(h, &val, &d);
+		heap_pop(h);
+
+		if (d != data)
+			heap_push(&tmp, val, d);
+	}
+
+	heap_close(h);
+	*h = tmp;
+}
+
 #endif
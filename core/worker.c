@@ -122,6 +122,45 @@ void resume_all_workers()
 	}
 }
 
+ct_assert(MAX_WORKERS <= 64);
+
+uint64_t get_running_workers()
+{
+	uint64_t wids = 0;
+
+	for (int wid = 0; wid < MAX_WORKERS; wid++) {
+		if (workers[wid] && workers[wid]->status == WORKER_RUNNING)
+			wids |= (1ull << wid);
+	}
+
+	return wids;
+}
+
+uint64_t pause_workers(uint64_t wids)
+{
+	wids &= get_running_workers();
+
+	for (int wid = 0; wid < MAX_WORKERS; wid++) {
+		if (wids & (1ull << wid))
+			pause_worker(wid);
+	}
+
+	return wids;
+}
+
+void resume_workers(uint64_t wids)
+{
+	if (!wids)
+		return;
+
+	process_orphan_tasks();
+
+	for (int wid = 0; wid < MAX_WORKERS; wid++) {
+		if ((wids & (1ull << wid)) && is_worker_active(wid))
+			resume_worker(wid);
+	}
+}
+
 int is_any_worker_running()
 {
 	int wid;
@@ -134,15 +173,31 @@ int is_any_worker_running()
 	return 0;
 }
 
-void block_worker()
+int get_sched_wid(const struct sched *s)
+{
+	for (int wid = 0; wid < MAX_WORKERS; wid++) {
+		if (is_worker_active(wid) && workers[wid]->s == s)
+			return wid;
+	}
+
+	return -1;
+}
+
+int block_worker()
 {
 	uint64_t t;
 	int ret;
 
 	ctx.status = WORKER_PAUSED;
 	ret = read(ctx.fd_event, &t, sizeof(t));
-	ctx.status = WORKER_RUNNING;
 	assert(ret == sizeof(t));
+
+	/* stays paused until the thread exits */
+	if (ctx.quit)
+		return 1;
+
+	ctx.status = WORKER_RUNNING;
+	return 0;
 }
 
 /* arg is the core ID it should run on */
@@ -166,6 +221,7 @@ static int run_worker(void *arg)
 	assert(ctx.socket >= 0);	/* shouldn't be SOCKET_ID_ANY (-1) */
 	ctx.fd_event = eventfd(0, 0);
 	assert(ctx.fd_event >= 0);
+	ctx.quit = 0;
 
 	ctx.s = sched_init();
 
@@ -192,6 +248,9 @@ static int run_worker(void *arg)
 
 	sched_loop(ctx.s);
 
+	sched_free(ctx.s);
+	close(ctx.fd_event);
+
 	ctx.status = WORKER_INACTIVE;
 	workers[ctx.wid] = NULL;
 	STORE_BARRIER();
@@ -210,3 +269,28 @@ void launch_worker(int wid, int core)
 
 	num_workers++;
 }
+
+void destroy_worker(int wid)
+{
+	struct worker_context *w = workers[wid];
+	struct task *t;
+	uint64_t v = 1;
+	int ret;
+
+	pause_worker(wid);
+
+	cdlist_for_each_entry(t, &all_tasks, all_tasks) {
+		if (task_is_attached(t) && t->c->s == w->s)
+			task_detach(t);
+	}
+
+	w->quit = 1;
+
+	ret = write(w->fd_event, &v, sizeof(v));
+	assert(ret == sizeof(v));
+
+	/* so that the lcore can be launched again */
+	rte_eal_wait_lcore(wid);
+
+	num_workers--;
+}
@@ -33,6 +33,8 @@ struct worker_context {
 	int socket;
 	int fd_event;
 
+	volatile int quit;	/* set by destroy_worker() while paused */
+
 	struct sched *s;
 
 	uint64_t silent_drops;	/* packets that have been sent to a deadend */
@@ -62,9 +64,25 @@ void resume_all_workers();
 
 int is_any_worker_running();
 
+/* returns the worker that runs the scheduler, or -1 */
+int get_sched_wid(const struct sched *s);
+
+/* Bitmasks of workers (bit wid) */
+uint64_t get_running_workers();
+
+/* returns the ones that were running (and have been paused) */
+uint64_t pause_workers(uint64_t wids);
+
+/* orphan tasks are handed to the workers before they are resumed */
+void resume_workers(uint64_t wids);
+
 /* arg (int) is the core id the worker should run on */
 void launch_worker(int wid, int core);	
 
+/* Stops the worker and frees its scheduler. Its tasks become orphans,
+ * to be taken by other workers when they are resumed. */
+void destroy_worker(int wid);
+
 static inline int is_worker_active(int wid)
 {
 	return (workers[wid] && workers[wid]->status != WORKER_INACTIVE);
@@ -77,6 +95,6 @@ static inline int is_pause_requested() {
 	return (ctx.status == WORKER_PAUSING);
 }
 
-void block_worker(void);	/* block myself */
+int block_worker(void);		/* block myself. returns 1 if destroyed */
 
 #endif
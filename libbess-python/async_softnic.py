@@ -0,0 +1,283 @@
+import socket
+import select
+import struct
+import errno
+import sys
+import time
+import collections
+
+import message
+
+from softnic import SoftNIC, Future
+
+# epoll event flags, also used with select() on platforms without epoll
+_IN = getattr(select, 'EPOLLIN', 0x001)
+_OUT = getattr(select, 'EPOLLOUT', 0x004)
+_ERR = getattr(select, 'EPOLLERR', 0x008)
+_HUP = getattr(select, 'EPOLLHUP', 0x010)
+
+# Dispatches socket events for any number of AsyncSoftNIC connections.
+# Uses epoll(7) where available, or select(2) otherwise.
+class EventLoop(object):
+    def __init__(self):
+        self.conns = {}     # fd -> AsyncSoftNIC
+
+        if hasattr(select, 'epoll'):
+            self.epoll = select.epoll()
+        else:
+            self.epoll = None
+
+    def _events(self, conn):
+        if conn.outbuf:
+            return _IN | _OUT
+        else:
+            return _IN
+
+    def register(self, conn):
+        fd = conn.s.fileno()
+        self.conns[fd] = conn
+        conn.events = self._events(conn)
+        if self.epoll:
+            self.epoll.register(fd, conn.events)
+
+    def unregister(self, conn):
+        fd = conn.s.fileno()
+        del self.conns[fd]
+        if self.epoll:
+            self.epoll.unregister(fd)
+
+    # called whenever conn.outbuf may have become (non-)empty
+    def update(self, conn):
+        events = self._events(conn)
+        if events != conn.events:
+            conn.events = events
+            if self.epoll:
+                self.epoll.modify(conn.s.fileno(), events)
+
+    def _poll(self, timeout):
+        if self.epoll:
+            return self.epoll.poll(-1 if timeout is None else timeout)
+
+        rlist = []
+        wlist = []
+        for fd, conn in self.conns.iteritems():
+            rlist.append(fd)
+            if conn.events & _OUT:
+                wlist.append(fd)
+
+        if not rlist:
+            if timeout:
+                time.sleep(timeout)
+            return []
+
+        r, w, _ = select.select(rlist, wlist, [], timeout)
+        ready = collections.defaultdict(int)
+        for fd in r:
+            ready[fd] |= _IN
+        for fd in w:
+            ready[fd] |= _OUT
+        return ready.items()
+
+    # Waits for events at most timeout seconds (forever if None) and
+    # handles them. Returns the number of connections that had events.
+    def run_once(self, timeout=None):
+        try:
+            events = self._poll(timeout)
+        except (IOError, select.error) as e:
+            if e.args[0] == errno.EINTR:
+                return 0
+            raise
+
+        for fd, ev in events:
+            conn = self.conns.get(fd)
+            if conn is None:
+                continue    # closed by an earlier callback
+
+            if ev & _OUT:
+                conn._handle_write()
+
+            if ev & (_IN | _ERR | _HUP) \
+                    and conn.is_connected():
+                conn._handle_read()
+
+        return len(events)
+
+    # Runs the loop until all futures are done, or until timeout seconds
+    # have passed. Returns True if all of them are done.
+    def run_until_complete(self, futures, timeout=None):
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        pending = [f for f in futures if not f.done()]
+
+        while pending:
+            if timeout is None:
+                self.run_once()
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.run_once(remaining)
+
+            pending = [f for f in pending if not f.done()]
+
+        return True
+
+# Non-blocking version of SoftNIC, for talking to many BESS daemons from one
+# thread. It has the same methods as SoftNIC, but they return a Future
+# right away instead of waiting for the reply. Replies are processed while
+# the event loop runs, e.g.,
+#
+#   loop = EventLoop()
+#   nics = []
+#   for host in hosts:
+#       nic = AsyncSoftNIC(loop)
+#       nic.connect(host)
+#       nics.append(nic)
+#
+#   futures = [nic.get_port_stats('port0') for nic in nics]
+#   loop.run_until_complete(futures, timeout=1.0)
+#
+# Requests on a connection may be issued at any time, even while earlier
+# ones are in flight. The daemon handles them one by one, and replies come
+# back in the same order. Future.add_done_callback() can be used to chain
+# requests without blocking.
+class AsyncSoftNIC(SoftNIC):
+    def __init__(self, loop):
+        super(AsyncSoftNIC, self).__init__()
+        self.loop = loop
+        self.events = 0
+
+        self.outbuf = collections.deque()   # buffers to be sent, in order
+        self.inbuf = bytearray()            # partially received replies
+        self.waiting = collections.deque()  # Futures for sent requests
+
+    # Connecting is blocking. It is done only once per daemon.
+    def connect(self, host='localhost', port=SoftNIC.DEF_PORT, fallback=False):
+        super(AsyncSoftNIC, self).connect(host, port, fallback)
+        self.s.setblocking(0)
+        self.loop.register(self)
+
+    def disconnect(self):
+        self._close(SoftNIC.APIError('Disconnected'))
+
+    # Not meaningful here: all requests are already pipelined.
+    # (Use the "batch" command with _request_softnic() for atomicity)
+    def pipeline(self, window=None):
+        raise self.APIError('Not supported by AsyncSoftNIC')
+
+    def batch(self, max_size=None):
+        raise self.APIError('Not supported by AsyncSoftNIC')
+
+    def subscribe(self, ports=None, modules=None, interval=1.0, deltas=True):
+        raise self.APIError('Not supported by AsyncSoftNIC')
+
+    # takes the request just encoded in sendbuf, returns a Future for it.
+    # The request is not timed for client stats (timing is ignored).
+    def _transact(self, size, iov, timing=None):
+        if self.recorder is not None:
+            self.recorder.request(self.sendbuf, size, iov)
+
+        if iov:
+            pieces = message.segments(self.sendbuf, 4 + size, iov)
+            # even-numbered pieces are views of sendbuf, which will be reused
+            pieces[0::2] = [piece.tobytes() for piece in pieces[0::2]]
+            self.outbuf.extend(memoryview(piece) for piece in pieces)
+        else:
+            self.outbuf.append(memoryview(str(self.sendbuf[:4 + size])))
+
+        f = Future()
+        self.waiting.append(f)
+
+        # try right away, as the socket buffer is most likely available
+        self._handle_write()
+        return f
+
+    def _handle_write(self):
+        try:
+            while self.outbuf:
+                buf = self.outbuf[0]
+                sent = self.s.send(buf)
+                if sent < len(buf):
+                    self.outbuf[0] = buf[sent:]
+                    break
+                self.outbuf.popleft()
+        except socket.error as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self._close(e)
+                return
+
+        self.loop.update(self)
+
+    def _handle_read(self):
+        try:
+            data = self.s.recv(65536)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            self._close(e)
+            return
+
+        if not data:
+            self._close(socket.error(errno.ECONNRESET,
+                    'Connection closed by BESS daemon'))
+            return
+
+        self.inbuf += data
+
+        # there can be more than one reply in inbuf
+        offset = 0
+        while len(self.inbuf) - offset >= 4:
+            total, = struct.unpack_from('<L', self.inbuf, offset)
+            if len(self.inbuf) - offset - 4 < total:
+                break
+
+            buf = str(self.inbuf[offset + 4:offset + 4 + total])
+            offset += 4 + total
+            self._reply(buf)
+
+            if not self.is_connected():
+                return
+
+        del self.inbuf[:offset]
+
+    def _reply(self, buf):
+        if not self.waiting:
+            self._close(self.APIError('Unexpected reply from BESS daemon'))
+            return
+
+        f = self.waiting.popleft()
+
+        if self.recorder is not None:
+            self.recorder.reply(buf, len(buf))
+
+        try:
+            obj = message.decode(buf, self.numeric_arrays, self.blob_views)
+        except Exception as e:
+            print >> sys.stderr, 'Decoding error, binary: %s' % buf.encode('hex')
+            f._set(None, e)
+            return
+
+        if self.debug:
+            print >> sys.stderr, '\t<--- %s' % repr(obj)
+
+        try:
+            f._set(self._check_reply(obj), None)
+        except SoftNIC.Error as e:
+            f._set(None, e)
+
+    # fails all outstanding requests with error
+    def _close(self, error):
+        if not self.is_connected():
+            return
+
+        self.loop.unregister(self)
+        self.s.close()
+        self.s = None
+
+        self.outbuf.clear()
+        self.inbuf = bytearray()
+
+        waiting, self.waiting = self.waiting, collections.deque()
+        for f in waiting:
+            f._set(None, error)
@@ -0,0 +1,172 @@
+import time
+
+# The load of each worker (as a fraction of a core) before and after the
+# moves of a Balancer, e.g., {0: 0.92, 1: 0.15}.
+class Plan(object):
+    def __init__(self, before, after, moves):
+        self.before = before
+        self.after = after
+        self.moves = moves          # [(module, taskid, old wid, new wid)]
+        self.applied = False
+
+    # between the busiest and the least busy worker
+    @property
+    def imbalance(self):
+        if not self.before:
+            return 0.0
+
+        return max(self.before.itervalues()) - min(self.before.itervalues())
+
+    # how much the busiest worker would be relieved
+    @property
+    def gain(self):
+        if not self.before:
+            return 0.0
+
+        return max(self.before.itervalues()) - max(self.after.itervalues())
+
+# Spreads tasks over workers by the load they put on them, e.g.,
+#
+#   balancer = Balancer(softnic)
+#   plan = balancer.balance()           # once
+#   for plan in balancer.watch():       # continuously, until stopped
+#       ...
+#
+# The load of a task is the fraction of its worker's cycles spent in its
+# runs that processed packets. Runs that found nothing to do (e.g., polls of
+# an idle port) are not counted, as they only take cycles that would be
+# idle otherwise.
+#
+# The new assignment is computed with the LPT (longest processing time
+# first) heuristic: from the heaviest task, each goes to the worker with the
+# least load so far. A task stays on its current worker unless that is
+# busier than the best one by more than slack, so that a balanced pipeline
+# is left as it is. Tasks of TCs created with add_tc() are not moved, but
+# their load counts for their workers. Paused workers are left out.
+#
+# Tasks are moved (with "move_task", see core/snctl.c) only if the busiest
+# worker gets lighter by at least min_gain. Each batch of moves pauses only
+# the workers involved, once.
+class Balancer(object):
+    def __init__(self, softnic, slack=0.05, min_gain=0.05):
+        self.softnic = softnic
+        self.slack = slack
+        self.min_gain = min_gain
+
+    def _snapshot(self):
+        with self.softnic.pipeline() as p:
+            workers = p.list_workers()
+            tasks = p.list_tasks()
+
+        return workers.result(), tasks.result()
+
+    # Returns (loads, fixed, wids):
+    #   loads: (module, taskid) -> (wid, load) of the tasks that can move
+    #   fixed: wid -> load of the tasks that cannot
+    #   wids: the running workers
+    # Tasks moved while sampled are left out.
+    def sample(self, interval=1.0):
+        old_workers, old_tasks = self._snapshot()
+        time.sleep(interval)
+        workers, tasks = self._snapshot()
+
+        def total(w):
+            return w['cycles_busy'] + w['cycles_idle']
+
+        def busy(t):
+            return t['cycle'] - t['cycles_empty']
+
+        old = dict((w['wid'], w) for w in old_workers)
+        elapsed = dict((w['wid'], total(w) - total(old[w['wid']])) \
+                for w in workers if w['running'] and w['wid'] in old)
+
+        loads = {}
+        fixed = dict((wid, 0.0) for wid in elapsed)
+        tcs = set()         # of the TCs counted in fixed
+
+        old = dict(((t['name'], t['taskid']), t) for t in old_tasks)
+        for t in tasks:
+            key = (t['name'], t['taskid'])
+            wid = t['wid']
+            o = old.get(key)
+
+            if not elapsed.get(wid) or o is None or o['wid'] != wid or \
+                    o.get('tc') != t.get('tc') or busy(t) < busy(o):
+                continue
+
+            load = float(busy(t) - busy(o)) / elapsed[wid]
+
+            if 'tc' not in t:
+                loads[key] = (wid, load)
+            elif t['tc'] not in tcs:
+                tcs.add(t['tc'])
+                fixed[wid] += load
+
+        return loads, fixed, sorted(elapsed)
+
+    # Returns a Plan (not applied yet) for the result of sample()
+    def plan(self, loads, fixed, wids):
+        before = dict(fixed)
+        for wid, load in loads.itervalues():
+            before[wid] += load
+
+        after = dict(fixed)
+        moves = []
+
+        for key, (wid, load) in sorted(loads.iteritems(),
+                key=lambda (key, (wid, load)): (-load, key)):
+            best = min(wids, key=lambda w: (after[w], w))
+            if after[wid] - after[best] <= self.slack:
+                best = wid
+
+            after[best] += load
+            if best != wid:
+                moves.append((key[0], key[1], wid, best))
+
+        return Plan(before, after, moves)
+
+    def apply(self, plan):
+        futures = []
+        with self.softnic.batch() as b:
+            for m, tid, _, wid in plan.moves:
+                futures.append(b.move_task(m, tid, wid))
+
+        for f in futures:
+            f.result()      # raises the first error, if any
+
+        plan.applied = True
+
+    def _worthwhile(self, plan):
+        return plan.moves and plan.gain >= self.min_gain
+
+    # Samples the load for interval seconds, then moves tasks if worthwhile.
+    # Returns the Plan.
+    def balance(self, interval=1.0, dry_run=False):
+        plan = self.plan(*self.sample(interval))
+
+        if not dry_run and self._worthwhile(plan):
+            self.apply(plan)
+
+        return plan
+
+    # Yields a Plan every interval seconds. Tasks are moved only after the
+    # workers have been imbalanced by more than threshold for patience
+    # periods in a row, so that a short burst does not move them back and
+    # forth. Each period is sampled afresh, so the load of a moved task is
+    # measured on its new worker before it can move again.
+    def watch(self, interval=1.0, threshold=0.2, patience=3):
+        streak = 0
+
+        while True:
+            plan = self.plan(*self.sample(interval))
+
+            if plan.imbalance > threshold:
+                streak += 1
+            else:
+                streak = 0
+
+            if streak >= patience and self._worthwhile(plan):
+                self.apply(plan)
+                streak = 0
+
+            yield plan
@@ -0,0 +1,387 @@
+#!/usr/bin/env python2.7
+
+# Microbenchmarks for the client library. No BESS daemon is needed:
+# benchmarks that need a peer run a stand-in daemon in a child process.
+# Usage: bench.py [BENCHMARK...]   (runs all benchmarks if none is given)
+
+import sys
+import os
+import socket
+import struct
+import tempfile
+import timeit
+
+import message
+import softnic
+
+def _module_info(i, num_gates):
+    gates = []
+    for gate in range(num_gates):
+        gates.append({
+                'gate': gate,
+                'cnt': 123456789 + gate,
+                'pkts': 987654321 + gate,
+                'timestamp': 1445412345.678901,
+                'name': 'sink%d' % gate,
+            })
+
+    return {
+            'name': 'bpf%d' % i,
+            'mclass': 'BPF',
+            'desc': '%d filters' % num_gates,
+            'gates': gates,
+        }
+
+def _run(label, func, number):
+    best = min(timeit.repeat(func, number=number, repeat=3))
+    usec = best / number * 1e6
+    print '  %-40s %10.2f us/op' % (label, usec)
+    return usec
+
+# Percentiles of a sorted list
+def _percentile(samples, p):
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100.0))]
+
+def _run_latency(label, func, number):
+    samples = []
+    timer = timeit.default_timer
+    for i in xrange(number):
+        start = timer()
+        func()
+        samples.append(timer() - start)
+
+    samples.sort()
+    print '  %-40s p50 %8.2f us   p99 %8.2f us' % (label,
+            _percentile(samples, 50) * 1e6, _percentile(samples, 99) * 1e6)
+    return samples
+
+# Runs a stand-in for bessd in a child process, which reads requests and
+# answers every one of them with reply, without decoding anything.
+# Serves a single connection. Returns (pid, port), or (pid, 'unix:<path>')
+# if unix is True.
+def _start_standin(reply, unix=False):
+    encoded = message.encode(reply)
+    frame = struct.pack('<L', len(encoded)) + encoded
+
+    if unix:
+        path = os.path.join(tempfile.mkdtemp(), 'bessd.sock')
+        listen_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listen_sock.bind(path)
+        port = 'unix:' + path
+    else:
+        listen_sock = socket.socket()
+        listen_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listen_sock.bind(('127.0.0.1', 0))
+        port = listen_sock.getsockname()[1]
+
+    listen_sock.listen(1)
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            conn, _ = listen_sock.accept()
+            if unix:
+                os.unlink(path)
+                os.rmdir(os.path.dirname(path))
+            else:
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            while True:
+                hdr = conn.recv(4, socket.MSG_WAITALL)
+                if len(hdr) < 4:
+                    break
+                size, = struct.unpack('<L', hdr)
+                conn.recv(size, socket.MSG_WAITALL)
+                conn.sendall(frame)
+        finally:
+            os._exit(0)
+
+    listen_sock.close()
+    return pid, port
+
+# The framing SoftNIC used to have: separate sends for the length and the
+# message, and a list of recv() fragments joined at the end
+def _request_legacy(sock, obj):
+    buf = message.encode(obj)
+    sock.sendall(struct.pack('<L', len(buf)))
+    sock.sendall(buf)
+
+    total, = struct.unpack('<L', sock.recv(4))
+    frags = []
+    received = 0
+    while received < total:
+        frag = sock.recv(total - received)
+        frags.append(frag)
+        received += len(frag)
+
+    return message.decode(''.join(frags))
+
+# The decoder message.py used to have, which slices buf at every step.
+# Returns (obj, new offset).
+def _decode_slicing(buf, offset):
+    t, l = struct.unpack_from('<LL', buf, offset)
+    offset += 8
+
+    if t == message.TYPE_NIL:
+        v = None
+    elif t == message.TYPE_INT:
+        v, = struct.unpack_from('<Q', buf, offset)
+        offset += 8
+    elif t == message.TYPE_DOUBLE:
+        v, = struct.unpack_from('<d', buf, offset)
+        offset += 8
+    elif t == message.TYPE_STR:
+        v = str(buf[offset:offset + l - 1])
+        offset += l
+    elif t == message.TYPE_BLOB:
+        v = bytearray(buf[offset:offset + l])
+        offset += l
+    elif t == message.TYPE_LIST:
+        v  = list()
+        for i in xrange(l):
+            obj, offset = _decode_slicing(buf, offset)
+            v.append(obj)
+    elif t == message.TYPE_MAP:
+        v = dict()
+        for i in xrange(l):
+            z_pos = buf.find('\0', offset)
+            if z_pos == -1:
+                raise Exception('non-null terminating key')
+            key = buf[offset:z_pos]
+
+            offset = z_pos + 1
+            while offset % 8:
+                offset += 1
+
+            obj, offset = _decode_slicing(buf, offset)
+            v[key] = obj
+
+    else:
+        raise Exception('Unsupported type id %d' % t)
+
+    while offset % 8:
+        offset += 1
+
+    return v, offset
+
+# The encoder message.py used to have, which joins the strings of the
+# encoded children at every level
+def _encode_joining(obj):
+    def zero_pad8(buf, num_bytes):
+        while num_bytes % 8:
+            num_bytes += 1
+
+        return struct.pack(str(num_bytes) + 's', buf)
+
+    def encode_cstr(cstr):
+        return zero_pad8(cstr, len(cstr) + 1)
+
+    if obj == None:
+        t = message.TYPE_NIL
+        l = 0
+        v = ''
+    elif isinstance(obj, int):
+        t = message.TYPE_INT
+        l = 8
+        v = struct.pack('<Q', obj)
+    elif isinstance(obj, float):
+        t = message.TYPE_DOUBLE
+        l = 8
+        v = struct.pack('<d', obj)
+    elif isinstance(obj, str):
+        t = message.TYPE_STR
+        l = len(obj) + 1
+        v = encode_cstr(obj)
+    elif isinstance(obj, bytearray):
+        t = message.TYPE_BLOB
+        l = len(obj)
+        v = zero_pad8(str(obj), len(obj))
+    elif isinstance(obj, (list, set)):
+        t = message.TYPE_LIST
+        l = len(obj)
+        v = ''.join(map(_encode_joining, obj))
+    elif isinstance(obj, dict):
+        t = message.TYPE_MAP
+        keys = sorted(map(str, obj.keys())) # all keys must be a string
+        l = len(keys)
+        v = ''.join(map(lambda k: encode_cstr(k) + _encode_joining(obj[k]),
+                keys))
+    else:
+        raise Exception('Unsupported type %s' % type(obj))
+
+    return struct.pack('<LL', t, l) + v
+
+def _decode_reference(buf):
+    obj, consumed = _decode_slicing(buf, 0)
+    assert consumed == len(buf)
+    return obj
+
+def bench_codec():
+    samples = [
+        ('get_module_info (2 gates)', _module_info(0, 2)),
+        ('get_module_info (64 gates)', _module_info(0, 64)),
+        ('list_modules (256 modules)',
+            [{'name': 'm%d' % i, 'mclass': 'Sink'} for i in range(256)]),
+    ]
+
+    for label, obj in samples:
+        buf = message.encode(obj)
+        assert message.decode(buf) == _decode_reference(buf)
+        assert buf == _encode_joining(obj)
+
+        print '%s, %d bytes' % (label, len(buf))
+        number = max(10, 200000 / len(buf))
+        t_old = _run('decode (slicing)',
+                lambda: _decode_reference(buf), number)
+        t_new = _run('decode (memoryview)',
+                lambda: message.decode(buf), number)
+        print '  %-40s %10.2fx' % ('speedup', t_old / t_new)
+
+        reused = bytearray(len(buf))
+        t_old = _run('encode (joining)', lambda: _encode_joining(obj), number)
+        t_new = _run('encode', lambda: message.encode(obj), number)
+        print '  %-40s %10.2fx' % ('speedup', t_old / t_new)
+        t_new = _run('encode_into (reused buffer)',
+                lambda: message.encode_into(reused, 0, obj), number)
+        print '  %-40s %10.2fx' % ('speedup', t_old / t_new)
+
+def bench_numeric():
+    num = 4096
+    obj = {'buckets': range(num), 'timestamps': [i * 0.5 for i in range(num)]}
+    buf = message.encode(obj)
+
+    print 'histogram with %d int and %d double elements, %d bytes' % \
+            (num, num, len(buf))
+    print '  NumPy available: %s' % (message.numpy is not None)
+
+    number = 50
+    t_old = _run('decode (lists)', lambda: message.decode(buf), number)
+    t_new = _run('decode (numeric arrays)',
+            lambda: message.decode(buf, numeric_arrays=True), number)
+    print '  %-40s %10.2fx' % ('speedup', t_old / t_new)
+
+    arrays = message.decode(buf, numeric_arrays=True)
+    _run('encode (lists)', lambda: message.encode(obj), number)
+    _run('encode (numeric arrays)', lambda: message.encode(arrays), number)
+
+def bench_template():
+    s = softnic.SoftNIC()
+    samples = [
+        ('list_modules', 'list_modules', None),
+        ('get_port_stats', 'get_port_stats', 'port0'),
+        ('connect_modules', 'connect_modules',
+            {'m1': 'source0', 'm2': 'sink0', 'gate': 0}),
+    ]
+
+    for label, cmd, arg in samples:
+        envelope = {'to': 'softnic', 'cmd': cmd}
+        full = envelope if arg is None else dict(envelope, arg=arg)
+
+        def old():
+            obj = dict(envelope)
+            if arg is not None:
+                obj['arg'] = arg
+            s._encode_request(obj, [])
+
+        print '%s (%d bytes)' % (label, message.encoded_size(full))
+        t_base = _run('encode (joining)', lambda: _encode_joining(full), 100000)
+        t_old = _run('encode whole request', old, 100000)
+        t_new = _run('encode with template',
+                lambda: s._encode_template(cmd, envelope, arg, []), 100000)
+        print '  %-40s %10.2fx' % ('speedup', t_old / t_new)
+        print '  %-40s %10.2fx' % ('speedup over joining', t_base / t_new)
+
+def bench_latency():
+    port_stats = {
+        'inc': {'packets': 123456789, 'dropped': 0, 'bytes': 9876543210},
+        'out': {'packets': 123456789, 'dropped': 0, 'bytes': 9876543210},
+        'timestamp': 1445412345.678901,
+    }
+    samples = [
+        ('connect_modules', 'connect_modules',
+            {'m1': 'source0', 'm2': 'sink0', 'gate': 0}, None),
+        ('get_port_stats', 'get_port_stats', 'port0', port_stats),
+        ('get_module_info (64 gates)', 'get_module_info', 'bpf0',
+            _module_info(0, 64)),
+        ('query_module (256KB blob)', 'query_module', 'capture0',
+            bytearray(256 * 1024)),
+    ]
+
+    number = 5000
+    for label, cmd, arg, reply in samples:
+        request = {'to': 'softnic', 'cmd': cmd, 'arg': arg}
+        print '%s, %d-byte reply, round trips to a stand-in daemon' % \
+                (label, len(message.encode(reply)))
+
+        pid, port = _start_standin(reply)
+        sock = socket.create_connection(('127.0.0.1', port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        old = _run_latency('legacy framing',
+                lambda: _request_legacy(sock, request), number)
+        sock.close()
+        os.waitpid(pid, 0)
+
+        pid, port = _start_standin(reply)
+        s = softnic.SoftNIC()
+        s.connect('127.0.0.1', port)
+        new = _run_latency('SoftNIC._request_softnic()',
+                lambda: s._request_softnic(cmd, arg), number)
+        s.disconnect()
+        os.waitpid(pid, 0)
+
+        print '  %-40s p50 %8.2fx      p99 %8.2fx' % ('speedup',
+                _percentile(old, 50) / _percentile(new, 50),
+                _percentile(old, 99) / _percentile(new, 99))
+
+def bench_transport():
+    samples = [
+        ('connect_modules', 'connect_modules',
+            {'m1': 'source0', 'm2': 'sink0', 'gate': 0}, None),
+        ('get_module_info (2 gates)', 'get_module_info', 'bpf0',
+            _module_info(0, 2)),
+        ('query_module (256KB blob)', 'query_module', 'capture0',
+            bytearray(256 * 1024)),
+    ]
+
+    number = 5000
+    for label, cmd, arg, reply in samples:
+        print '%s, %d-byte reply, round trips to a stand-in daemon' % \
+                (label, len(message.encode(reply)))
+
+        results = []
+        for name, unix in [('TCP loopback', False), ('Unix domain socket', True)]:
+            pid, addr = _start_standin(reply, unix)
+            s = softnic.SoftNIC()
+            if unix:
+                s.connect(addr)
+            else:
+                s.connect('127.0.0.1', addr)
+            results.append(_run_latency(name,
+                    lambda: s._request_softnic(cmd, arg), number))
+            s.disconnect()
+            os.waitpid(pid, 0)
+
+        tcp, unix = results
+        print '  %-40s p50 %8.2fx      p99 %8.2fx' % ('speedup',
+                _percentile(tcp, 50) / _percentile(unix, 50),
+                _percentile(tcp, 99) / _percentile(unix, 99))
+
+benchmarks = {
+    'codec': bench_codec,
+    'latency': bench_latency,
+    'numeric': bench_numeric,
+    'template': bench_template,
+    'transport': bench_transport,
+}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or sorted(benchmarks.keys())
+
+    for name in names:
+        if name not in benchmarks:
+            print >> sys.stderr, 'Unknown benchmark "%s". Available: %s' % \
+                    (name, ', '.join(sorted(benchmarks.keys())))
+            sys.exit(2)
+
+    for name in names:
+        print '=== %s ===' % name
+        benchmarks[name]()
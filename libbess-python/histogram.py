@@ -0,0 +1,79 @@
+import math
+
+# Log-scale histogram of durations, with fixed buckets.
+# Each power of two (in microseconds) is split into SUB_BUCKETS buckets, so
+# any recorded value is within 12.5% of the bucket bound reported for it.
+# Values from 1 us to about 2^33 us (2.4 hours) are covered; smaller values
+# fall into the first bucket, and larger ones into the last.
+class Histogram(object):
+    SUB_BUCKETS = 4
+    MAX_EXP = 34
+    NUM_BUCKETS = MAX_EXP * SUB_BUCKETS
+
+    def __init__(self):
+        self.buckets = [0] * self.NUM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    # bucket index -> the upper bound of the bucket, in seconds
+    @classmethod
+    def bound(cls, idx):
+        e, sub = divmod(idx, cls.SUB_BUCKETS)
+        if e == 0:
+            return 1e-6
+
+        m = 0.5 + (sub + 1) / (2.0 * cls.SUB_BUCKETS)
+        return math.ldexp(m, e) / 1e6
+
+    # seconds -> bucket index
+    @classmethod
+    def index(cls, seconds):
+        # us = m * 2^e, where 0.5 <= m < 1
+        m, e = math.frexp(seconds * 1e6)
+        if e <= 0:
+            return 0
+
+        idx = e * cls.SUB_BUCKETS + int((m - 0.5) * 2 * cls.SUB_BUCKETS)
+        return min(idx, cls.NUM_BUCKETS - 1)
+
+    # Same as self.buckets[self.index(seconds)] += 1 and so on, but this is
+    # called several times for every request, so the math is inlined here.
+    def add(self, seconds, frexp=math.frexp):
+        m, e = frexp(seconds * 1e6)
+        if e <= 0:
+            idx = 0
+        elif e < self.MAX_EXP:
+            idx = (e << 2) + int(m * 8.0) - 4   # SUB_BUCKETS == 4
+        else:
+            idx = self.NUM_BUCKETS - 1
+
+        self.buckets[idx] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        for i, cnt in enumerate(other.buckets):
+            self.buckets[i] += cnt
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    # Returns (an upper bound of) the p-th percentile, in seconds
+    def percentile(self, p):
+        if not self.count:
+            return 0.0
+
+        target = self.count * p / 100.0
+        acc = 0
+        for i, cnt in enumerate(self.buckets):
+            acc += cnt
+            if acc >= target and cnt:
+                return min(self.bound(i), self.max)
+
+        return self.max
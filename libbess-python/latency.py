@@ -0,0 +1,85 @@
+import collections
+
+import numpy
+
+# Latency percentiles of a Measure module over a sliding window, e.g.,
+#
+#   window = LatencyWindow(10)
+#   while True:
+#       window.add(softnic.query_module('measure0', {'type': 'histogram'}))
+#       print window.percentiles((50, 99, 99.9))
+#       time.sleep(1)
+#
+# The module keeps a histogram of all packets since it was created. The
+# distribution within the window is the difference between the oldest and
+# the newest snapshot, so the window covers the last `size` calls to add().
+#
+# Latencies are reported as the upper bound of their buckets (in ns), and as
+# inf if beyond the last bucket (see "above_threshold" in measure.c).
+class LatencyWindow(object):
+    def __init__(self, size=10):
+        self.snapshots = collections.deque(maxlen=size + 1)
+
+    # snapshot: the reply of a "histogram" query
+    def add(self, snapshot):
+        self.snapshots.append((
+            snapshot['timestamp'],
+            numpy.asarray(snapshot['buckets'], dtype=numpy.int64),
+            numpy.asarray(snapshot['counts'], dtype=numpy.int64),
+            snapshot['above_threshold'],
+            snapshot['bucket_ns']))
+
+    # Returns (buckets, counts, above_threshold) of the packets recorded
+    # between the snapshots. A bucket never becomes empty again, so the
+    # buckets of old are a subset of those of new, unless the module has
+    # been recreated in between (new is then taken as it is).
+    @staticmethod
+    def _delta(old, new):
+        _, old_buckets, old_counts, old_above, _ = old
+        _, buckets, counts, above, _ = new
+
+        pos = numpy.searchsorted(buckets, old_buckets)
+        if pos.size and (pos[-1] >= buckets.size or \
+                (buckets[pos] != old_buckets).any()):
+            return buckets, counts, above
+
+        counts = counts.copy()
+        counts[pos] -= old_counts
+        if (counts < 0).any() or above < old_above:
+            return new[1:4]
+
+        nonzero = counts > 0
+        return buckets[nonzero], counts[nonzero], above - old_above
+
+    # Over the last span snapshots (all of the window, if None), returns
+    # (packets, [latency for each of ps], max latency), or None if there is
+    # not enough snapshots yet. Latencies are None if there is no packet.
+    def percentiles(self, ps, span=None):
+        n = len(self.snapshots)
+        if n < 2:
+            return None
+
+        if span is None or span >= n:
+            span = n - 1
+
+        new = self.snapshots[-1]
+        buckets, counts, above = self._delta(self.snapshots[-1 - span], new)
+
+        cum = numpy.cumsum(counts)
+        total = (int(cum[-1]) if cum.size else 0) + above
+        if total == 0:
+            return 0, [None] * len(ps), None
+
+        # the last one is for the packets beyond the last bucket
+        bounds = numpy.append((buckets + 1) * float(new[4]), numpy.inf)
+
+        # the first bucket where the cumulative count reaches p%
+        targets = numpy.ceil(numpy.asarray(ps, dtype=float) * total / 100.0)
+        pos = numpy.searchsorted(cum, numpy.maximum(targets, 1))
+
+        if above:
+            max_latency = numpy.inf
+        else:
+            max_latency = bounds[-2]
+
+        return total, bounds[pos].tolist(), max_latency
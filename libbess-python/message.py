@@ -1,4 +1,10 @@
 import struct
+import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 TYPE_NIL    = 0
 TYPE_INT    = 1
@@ -8,110 +14,391 @@ TYPE_BLOB   = 4
 TYPE_LIST   = 5
 TYPE_MAP    = 6
 
+_HEADER = struct.Struct('<LL')
+_UINT64 = struct.Struct('<Q')
+_DOUBLE = struct.Struct('<d')
+
+# A list of TYPE_INT or TYPE_DOUBLE is a sequence of fixed 16-byte elements:
+# a header word (type | size << 32) followed by the 8-byte value.
+# Such lists are converted from/to arrays with one strided copy.
+_NUMERIC_HEADERS = {
+    TYPE_INT:       TYPE_INT | (8 << 32),
+    TYPE_DOUBLE:    TYPE_DOUBLE | (8 << 32),
+}
+
+if numpy is not None:
+    _NUMPY_ELEMS = {
+        TYPE_INT:       numpy.dtype([('hdr', '<u8'), ('v', '<u8')]),
+        TYPE_DOUBLE:    numpy.dtype([('hdr', '<u8'), ('v', '<f8')]),
+    }
+
 def hexdump(buf):
     print 'Len=%-5d' % len(buf),
     for c in buf:
         print '%02x' % ord(c), 
     print
 
-def encode(obj):
-    def zero_pad8(buf, num_bytes):
-        while num_bytes % 8:
-            num_bytes += 1
-
-        return struct.pack(str(num_bytes) + 's', buf)
-        
-    def encode_cstr(cstr):
-        return zero_pad8(cstr, len(cstr) + 1)
-
-    if obj == None:
-        t = TYPE_NIL
-        l = 0
-        v = ''
-    elif isinstance(obj, int):
-        t = TYPE_INT
-        l = 8
-        v = struct.pack('<Q', obj)
-    elif isinstance(obj, float):
-        t = TYPE_DOUBLE
-        l = 8
-        v = struct.pack('<d', obj)
+_ZEROS = ['\0' * i for i in range(9)]
+
+# encode_into() leaves blobs of this size or larger out of the buffer,
+# if asked to, so that they can be sent directly from the caller's memory.
+# Below this size an extra send() costs more than copying the blob.
+IOV_MIN_BLOB = 65536
+
+# Returns a byte buffer of obj if it should be encoded as TYPE_BLOB, or None.
+# Any buffer object with 1-byte items is a blob (bytearray, memoryview,
+# buffer, array.array('B'), numpy uint8 arrays, ...). Note that str is always
+# encoded as TYPE_STR, and arrays with wider items as numeric lists.
+def _blob_data(obj):
+    if isinstance(obj, (bytearray, buffer)):
+        return obj
+    elif isinstance(obj, memoryview):
+        if obj.itemsize == 1 and obj.ndim == 1:
+            return obj
+        return obj.tobytes()
+    elif isinstance(obj, array.array):
+        if obj.itemsize == 1:
+            return buffer(obj)
+    elif numpy is not None and isinstance(obj, numpy.ndarray):
+        if obj.dtype.itemsize == 1:
+            return buffer(numpy.ascontiguousarray(obj))
+
+    return None
+
+# Returns TYPE_INT or TYPE_DOUBLE if obj is a 1-D numeric array, or None.
+# Both numpy.ndarray and array.array are accepted.
+def _numeric_type(obj):
+    if numpy is not None and isinstance(obj, numpy.ndarray):
+        if obj.ndim == 1 and obj.dtype.itemsize > 1:
+            if obj.dtype.kind in 'iu':
+                return TYPE_INT
+            elif obj.dtype.kind == 'f':
+                return TYPE_DOUBLE
+    elif isinstance(obj, array.array):
+        if obj.typecode in 'hHiIlL':
+            return TYPE_INT
+        elif obj.typecode in 'fd':
+            return TYPE_DOUBLE
+
+    return None
+
+# Makes the bytearray buf at least size bytes long, in place. It is at least
+# doubled, so that a buffer reused for many messages is rarely grown.
+def reserve(buf, size):
+    if size > len(buf):
+        buf.extend(bytearray(max(size, len(buf) * 2) - len(buf)))
+
+def _encode_blob_into(buf, offset, data, iov):
+    l = len(data)
+    end = offset + 8 + ((l + 7) & ~7)
+    if end > len(buf):
+        reserve(buf, end)
+    _HEADER.pack_into(buf, offset, TYPE_BLOB, l)
+    offset += 8
+    if iov is not None and l >= IOV_MIN_BLOB:
+        iov.append((offset, data))
+    else:
+        buf[offset:offset + l] = data
+    buf[offset + l:end] = _ZEROS[end - offset - l]
+    return end
+
+def _encode_numeric_into(buf, offset, t, obj):
+    n = len(obj)
+    end = offset + 8 + n * 16
+    if end > len(buf):
+        reserve(buf, end)
+    _HEADER.pack_into(buf, offset, TYPE_LIST, n)
+    offset += 8
+
+    if n == 0:
+        return offset
+
+    if numpy is not None:
+        # writes directly into buf
+        elems = numpy.frombuffer(buf, _NUMPY_ELEMS[t], n, offset)
+        elems['hdr'] = _NUMERIC_HEADERS[t]
+        elems['v'] = obj
+        del elems       # so that buf can be grown later
+    else:
+        words = array.array('L', [_NUMERIC_HEADERS[t]]) * (n * 2)
+        if t == TYPE_INT and obj.typecode in 'hil':
+            # negative values as 64-bit two's complement, as with NumPy
+            words[1::2] = array.array('L', array.array('l', obj).tostring())
+        elif t == TYPE_INT:
+            words[1::2] = array.array('L', obj)
+        else:
+            words[1::2] = array.array('L', array.array('d', obj).tostring())
+        buf[offset:end] = words.tostring()
+
+    return end
+
+# Returns a numeric array if all l elements at offset are of type t.
+# Otherwise returns None, and the list should be decoded element by element.
+def _decode_numeric(buf, offset, t, l):
+    if offset + l * 16 > len(buf):
+        return None
+
+    if numpy is not None:
+        elems = numpy.frombuffer(buf, _NUMPY_ELEMS[t], l, offset)
+        if (elems['hdr'] != _NUMERIC_HEADERS[t]).any():
+            return None
+        return elems['v'].copy()
+
+    words = array.array('L')
+    words.fromstring(buffer(buf, offset, l * 16))
+    if words[0::2].count(_NUMERIC_HEADERS[t]) != l:
+        return None
+
+    if t == TYPE_INT:
+        return words[1::2]
+    else:
+        return array.array('d', words[1::2].tostring())
+
+# Returns the number of bytes encode_into() will write for obj
+def encoded_size(obj):
+    if obj is None:
+        return 8
+    elif isinstance(obj, (int, long, float)):
+        return 16
     elif isinstance(obj, str):
-        t = TYPE_STR
-        l = len(obj) + 1
-        v = encode_cstr(obj)
+        return 8 + ((len(obj) + 8) & ~7)
     elif isinstance(obj, bytearray):
-        t = TYPE_BLOB
-        l = len(obj)
-        v = zero_pad8(str(obj), len(obj))
+        return 8 + ((len(obj) + 7) & ~7)
     elif isinstance(obj, (list, set)):
-        t = TYPE_LIST
+        return 8 + sum(map(encoded_size, obj))
+    elif isinstance(obj, dict):
+        size = 8
+        for k, v in obj.iteritems():
+            size += ((len(str(k)) + 8) & ~7) + encoded_size(v)
+        return size
+    elif _numeric_type(obj) is not None:
+        return 8 + len(obj) * 16
+    else:
+        data = _blob_data(obj)
+        if data is None:
+            raise Exception('Unsupported type %s' % type(obj))
+        return 8 + ((len(data) + 7) & ~7)
+
+# Serializes obj into the bytearray buf, starting at offset, in one pass.
+# buf is grown in place as needed (so no memoryview of it may be alive),
+# and is never shrunk. Padding bytes are always written, so buf can be
+# reused across messages. Returns the offset right after the encoded object.
+#
+# If iov is a list, blobs of IOV_MIN_BLOB bytes or more are not copied.
+# Their space in buf is skipped and (offset, data) is appended to iov instead.
+# Use segments() to get the buffers to be sent.
+def encode_into(buf, offset, obj, iov=None,
+        pack_header=_HEADER.pack_into,
+        pack_uint64=_UINT64.pack_into,
+        pack_double=_DOUBLE.pack_into,
+        len=len):
+
+    if obj is None:
+        if offset + 8 > len(buf):
+            reserve(buf, offset + 8)
+        pack_header(buf, offset, TYPE_NIL, 0)
+        return offset + 8
+
+    elif isinstance(obj, (int, long)):
+        if offset + 16 > len(buf):
+            reserve(buf, offset + 16)
+        pack_header(buf, offset, TYPE_INT, 8)
+        pack_uint64(buf, offset + 8, obj)
+        return offset + 16
+
+    elif isinstance(obj, float):
+        if offset + 16 > len(buf):
+            reserve(buf, offset + 16)
+        pack_header(buf, offset, TYPE_DOUBLE, 8)
+        pack_double(buf, offset + 8, obj)
+        return offset + 16
+
+    elif isinstance(obj, str):
         l = len(obj)
-        v = ''.join(map(encode, obj))
+        end = offset + 8 + ((l + 8) & ~7)
+        if end > len(buf):
+            reserve(buf, end)
+        pack_header(buf, offset, TYPE_STR, l + 1)
+        offset += 8
+        buf[offset:offset + l] = obj
+        buf[offset + l:end] = _ZEROS[end - offset - l]
+        return end
+
+    elif isinstance(obj, bytearray):
+        return _encode_blob_into(buf, offset, obj, iov)
+
+    elif isinstance(obj, (list, set)):
+        if offset + 8 > len(buf):
+            reserve(buf, offset + 8)
+        pack_header(buf, offset, TYPE_LIST, len(obj))
+        offset += 8
+        for v in obj:
+            offset = encode_into(buf, offset, v, iov)
+        return offset
+
     elif isinstance(obj, dict):
-        t = TYPE_MAP
         keys = sorted(map(str, obj.keys())) # all keys must be a string
-        l = len(keys)
-        v = ''.join(map(lambda k: encode_cstr(k) + encode(obj[k]), keys))
+        if offset + 8 > len(buf):
+            reserve(buf, offset + 8)
+        pack_header(buf, offset, TYPE_MAP, len(keys))
+        offset += 8
+        for k in keys:
+            l = len(k)
+            end = offset + ((l + 8) & ~7)
+            if end > len(buf):
+                reserve(buf, end)
+            buf[offset:offset + l] = k
+            buf[offset + l:end] = _ZEROS[end - offset - l]
+            offset = encode_into(buf, end, obj[k], iov)
+        return offset
+
     else:
-        raise Exception('Unsupported type %s' % type(obj))
+        t = _numeric_type(obj)
+        if t is not None:
+            return _encode_numeric_into(buf, offset, t, obj)
+
+        data = _blob_data(obj)
+        if data is None:
+            raise Exception('Unsupported type %s' % type(obj))
+        return _encode_blob_into(buf, offset, data, iov)
+
+# Returns a list of buffers that make up buf[:end], with the blobs that
+# encode_into() has left out (listed in iov) spliced back in. Nothing is copied.
+def segments(buf, end, iov):
+    view = memoryview(buf)
+    ret = []
+    pos = 0
+
+    for offset, data in iov:
+        ret.append(view[pos:offset])
+        ret.append(data)
+        pos = offset + len(data)
+
+    ret.append(view[pos:end])
+    return ret
 
-    return struct.pack('<LL', t, l) + v
+def encode(obj):
+    buf = bytearray(256)
+    end = encode_into(buf, 0, obj)
+    return str(buffer(buf, 0, end))
 
-# returns (obj, new offset) tuple
-def _decode_recur(buf, offset):
+# Returns (obj, new offset). Walks a memoryview of buf instead of slicing it:
+# only the final str/bytearray values are copied out of the buffer, and
+# padding is computed arithmetically. buf itself is only used for find().
+# Scalar children of lists and maps are decoded inline, without recursion.
+# If arrays is True, homogeneous int/double lists are returned as arrays
+# (numpy.ndarray, or array.array if NumPy is not available).
+# If blob_views is True, blobs are returned as read-only memoryviews of buf.
+def _decode_view_recur(buf, view, offset, arrays=False, blob_views=False,
+        unpack_header=_HEADER.unpack_from,
+        unpack_uint64=_UINT64.unpack_from,
+        unpack_double=_DOUBLE.unpack_from):
 
-    t, l = struct.unpack_from('<LL', buf, offset)
+    t, l = unpack_header(view, offset)
     offset += 8
 
-    if t == TYPE_NIL:
-        v = None
-    elif t == TYPE_INT:
-        v, = struct.unpack_from('<Q', buf, offset)
-        offset += 8
-    elif t == TYPE_DOUBLE:
-        v, = struct.unpack_from('<d', buf, offset)
-        offset += 8
-    elif t == TYPE_STR:
-        v = str(buf[offset:offset + l - 1])
-        offset += l
-    elif t == TYPE_BLOB:
-        v = bytearray(buf[offset:offset + l])
-    elif t == TYPE_LIST:
-        v  = list()
-        for i in xrange(l):
-            obj, offset = _decode_recur(buf, offset)
-            v.append(obj)
-    elif t == TYPE_MAP:
-        v = dict()
+    if t == TYPE_MAP:
+        v = {}
         for i in xrange(l):
             z_pos = buf.find('\0', offset)
             if z_pos == -1:
                 raise Exception('non-null terminating key')
-            key = buf[offset:z_pos]
+            key = view[offset:z_pos].tobytes()
 
-            offset = z_pos + 1
-            while offset % 8:
-                offset += 1
+            # skip the null character, then round up to 8 bytes
+            offset = (z_pos + 8) & ~7
 
-            obj, offset = _decode_recur(buf, offset)
-            v[key] = obj
+            t, l2 = unpack_header(view, offset)
+            if t == TYPE_STR:
+                offset += 8
+                v[key] = view[offset:offset + l2 - 1].tobytes()
+                offset = (offset + l2 + 7) & ~7
+            elif t == TYPE_INT:
+                v[key], = unpack_uint64(view, offset + 8)
+                offset += 16
+            elif t == TYPE_DOUBLE:
+                v[key], = unpack_double(view, offset + 8)
+                offset += 16
+            else:
+                v[key], offset = _decode_view_recur(buf, view, offset,
+                        arrays, blob_views)
+
+    elif t == TYPE_LIST:
+        if arrays and l:
+            t, l2 = unpack_header(view, offset)
+            if t == TYPE_INT or t == TYPE_DOUBLE:
+                v = _decode_numeric(buf, offset, t, l)
+                if v is not None:
+                    return v, offset + l * 16
+
+        v = [None] * l
+        for i in xrange(l):
+            t, l2 = unpack_header(view, offset)
+            if t == TYPE_INT:
+                v[i], = unpack_uint64(view, offset + 8)
+                offset += 16
+            elif t == TYPE_STR:
+                offset += 8
+                v[i] = view[offset:offset + l2 - 1].tobytes()
+                offset = (offset + l2 + 7) & ~7
+            else:
+                v[i], offset = _decode_view_recur(buf, view, offset,
+                        arrays, blob_views)
+
+    elif t == TYPE_STR:
+        v = view[offset:offset + l - 1].tobytes()
+        offset = (offset + l + 7) & ~7
+
+    elif t == TYPE_INT:
+        v, = unpack_uint64(view, offset)
+        offset += 8
+
+    elif t == TYPE_DOUBLE:
+        v, = unpack_double(view, offset)
+        offset += 8
+
+    elif t == TYPE_NIL:
+        v = None
+
+    elif t == TYPE_BLOB:
+        if blob_views:
+            # read-only, unlike a slice of view if buf is a bytearray
+            v = memoryview(buffer(buf, offset, l))
+        else:
+            v = bytearray(view[offset:offset + l])
+        offset = (offset + l + 7) & ~7
 
     else:
         raise Exception('Unsupported type id %d' % t)
 
-    while offset % 8:
-        offset += 1
-
     return v, offset
 
-def decode(buf):
+# If numeric_arrays is True, homogeneous lists of ints or doubles are
+# returned as arrays instead of Python lists (see _decode_view_recur()).
+# If blob_views is True, blobs are returned as read-only memoryviews of buf,
+# which are only valid as long as buf is not modified.
+# The message is buf[offset:offset + size], or the rest of buf by default,
+# so it can be decoded where it was received, without slicing buf first.
+# offset must be a multiple of 8, as padding is relative to the buffer.
+def decode(buf, numeric_arrays=False, blob_views=False, offset=0, size=None):
+    if offset & 7:
+        raise Exception('offset %d is not 8-byte aligned' % offset)
+
+    # find() is needed for map keys. Other buffer objects are flattened once.
+    if not isinstance(buf, (str, bytearray)):
+        buf = memoryview(buf).tobytes()
+
+    if size is None:
+        size = len(buf) - offset
+    end = offset + size
+
     try:
-        obj, consumed = _decode_recur(buf, 0)
-        if consumed != len(buf):
+        obj, consumed = _decode_view_recur(buf, memoryview(buf)[:end],
+                offset, numeric_arrays, blob_views)
+        if consumed != end:
             raise Exception('%dB buffer, but only %dB consumed' % 
-                    (len(buf), consumed))
+                    (size, consumed - offset))
         return obj
     except Exception as e:
-        hexdump(buf)
+        hexdump(str(buf[offset:end]))
         raise e
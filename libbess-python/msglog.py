@@ -0,0 +1,100 @@
+import os
+import mmap
+import struct
+
+import message
+
+# Binary log of control messages, exactly as exchanged with the BESS daemon.
+# See SoftNIC.start_recording() and replay.py.
+#
+# The file starts with MAGIC, followed by records of
+#   kind (u32) | size (u32) | message (size bytes, zero-padded to 8 bytes)
+# in little endian. "size | message" is the message as framed on the wire,
+# so it can be sent from the log as it is. Messages are 8-byte aligned in
+# the file, and can be decoded in place.
+
+MAGIC = 'BESSLOG1'
+
+REQUEST = 1
+REPLY = 2
+
+_PADDING = '\0' * 8
+
+# Appends messages to a log file, which is created if it does not exist
+class Recorder(object):
+    def __init__(self, path):
+        self.f = open(path, 'ab')
+
+        if os.fstat(self.f.fileno()).st_size == 0:
+            self.f.write(MAGIC)
+        else:
+            with open(path, 'rb') as f:
+                if f.read(len(MAGIC)) != MAGIC:
+                    self.f.close()
+                    raise ValueError('%s is not a message log' % path)
+
+    # takes a request encoded in buf (see SoftNIC._encode_request())
+    def request(self, buf, size, iov):
+        self.f.write(struct.pack('<L', REQUEST))
+        if iov:
+            for piece in message.segments(buf, 4 + size, iov):
+                self.f.write(piece)
+        else:
+            self.f.write(memoryview(buf)[:4 + size])
+        self.f.write(_PADDING[:-size & 7])
+
+    # takes a reply of size bytes in buf, without the length field
+    def reply(self, buf, size):
+        self.f.write(struct.pack('<LL', REPLY, size))
+        self.f.write(memoryview(buf)[:size])
+        self.f.write(_PADDING[:-size & 7])
+
+    def close(self):
+        self.f.close()
+
+# Reads a log through mmap(2). Pages of the file are read in (and dropped)
+# by the kernel as needed, so logs of any size can be read without loading
+# them into memory.
+class LogReader(object):
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < len(MAGIC):
+                raise ValueError('%s is not a message log' % path)
+
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.mm[:len(MAGIC)] != MAGIC:
+            self.mm.close()
+            raise ValueError('%s is not a message log' % path)
+
+    # Yields (kind, offset, size) for each record of the given kind (or all
+    # records if kind is None). The message is mm[offset:offset + size],
+    # and mm[offset - 4:offset + size] is the message with its length field.
+    # A truncated record at the end (e.g., of a killed client) is ignored.
+    def records(self, kind=None):
+        mm = self.mm
+        end = len(mm)
+        offset = len(MAGIC)
+        unpack_from = struct.unpack_from
+
+        while offset + 8 <= end:
+            k, size = unpack_from('<LL', mm, offset)
+            if offset + 8 + size > end:
+                break
+
+            if kind is None or k == kind:
+                yield k, offset + 8, size
+
+            offset += 8 + ((size + 7) & ~7)
+
+    # the message in the record at offset, as a buffer object (not copied)
+    def buffer(self, offset, size, framed=False):
+        if framed:
+            return buffer(self.mm, offset - 4, size + 4)
+        return buffer(self.mm, offset, size)
+
+    def decode(self, offset, size):
+        return message.decode(self.mm[offset:offset + size])
+
+    def close(self):
+        self.mm.close()
@@ -0,0 +1,116 @@
+import os
+import mmap
+import random
+import struct
+
+# As in core/modules/rewrite.c (MAX_PKT_BURST and MAX_TEMPLATE_SIZE)
+MAX_TEMPLATES = 32
+MAX_TEMPLATE_SIZE = 1536
+
+LINKTYPE_ETHERNET = 1
+
+_MAGIC_USEC = 0xa1b2c3d4
+_MAGIC_NSEC = 0xa1b23c4d
+
+class PcapError(Exception):
+    pass
+
+# Packets of a pcap file, read without copying or parsing them, e.g.,
+#
+#   with PcapFile('traffic.pcap') as f:
+#       for data in f:
+#           ...
+#
+# The file is mmap()ed, and each packet is a buffer object into the mapping,
+# so only the 16-byte record headers are read in Python. Buffers can be
+# passed to the daemon as they are (as blobs, see message.py), and remain
+# valid after the PcapFile is closed. Files with microsecond or nanosecond
+# timestamps, in either byte order, are accepted.
+class PcapFile(object):
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < 24:
+                raise PcapError('%s: not a pcap file' % filename)
+
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        for order in ('<', '>'):
+            magic, = struct.unpack_from(order + 'I', self.mm, 0)
+            if magic in (_MAGIC_USEC, _MAGIC_NSEC):
+                break
+        else:
+            raise PcapError('%s: not a pcap file' % filename)
+
+        _, _, _, _, self.snaplen, self.linktype = \
+                struct.unpack_from(order + 'HHiIII', self.mm, 4)
+
+        self.filename = filename
+        self.record = struct.Struct(order + 'IIII')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # buffers already returned keep the mapping alive
+    def close(self):
+        self.mm = None
+
+    def __iter__(self):
+        mm = self.mm
+        end = len(mm)
+        unpack_from = self.record.unpack_from
+        offset = 24
+
+        while offset + 16 <= end:
+            _, _, caplen, _ = unpack_from(mm, offset)
+            offset += 16
+
+            if offset + caplen > end:
+                raise PcapError('%s: truncated at byte %d' % \
+                        (self.filename, offset - 16))
+
+            yield buffer(mm, offset, caplen)
+            offset += caplen
+
+# Up to count packets from a pcap file of Ethernet frames, as buffers,
+# e.g., for the "templates" of Rewrite:
+#
+#   rewrite.query({'templates': pcapfile.select('traffic.pcap')})
+#
+# With sample=True, the packets are a uniform random sample of the whole
+# file (reservoir sampling, in a single pass) instead of the first ones.
+# Either way they are in the order of the file. Packets larger than
+# max_size (e.g., captured with TSO) are skipped.
+def select(filename, count=MAX_TEMPLATES, sample=False, seed=None,
+        max_size=MAX_TEMPLATE_SIZE):
+    with PcapFile(filename) as f:
+        if f.linktype != LINKTYPE_ETHERNET:
+            raise PcapError('%s: link type %d is not Ethernet' % \
+                    (filename, f.linktype))
+
+        packets = (p for p in f if len(p) <= max_size)
+
+        if not sample:
+            selected = []
+            for p in packets:
+                if len(selected) >= count:
+                    break
+                selected.append(p)
+
+            return selected
+
+        rand = random.Random(seed)
+        reservoir = []      # (index in the file, packet)
+
+        for i, p in enumerate(packets):
+            if i < count:
+                reservoir.append((i, p))
+            else:
+                j = rand.randint(0, i)
+                if j < count:
+                    reservoir[j] = (i, p)
+
+        return [p for _, p in sorted(reservoir)]
@@ -0,0 +1,163 @@
+#!/usr/bin/env python2.7
+
+# Replays the requests of a message log (see SoftNIC.start_recording() and
+# "record start" of bessctl) to a BESS daemon as fast as possible, and
+# reports the throughput and the latency of the requests. This is to measure
+# how fast the daemon applies a configuration, without running the
+# configuration script itself.
+#
+# Usage: replay.py [-w WINDOW] [-c] [-s] LOG [HOST] [PORT]
+#   -w WINDOW   up to WINDOW requests are outstanding (pipelined); default 1
+#   -c          decode the replies, and count the errors
+#   -s          replay to a local stand-in daemon, which answers every
+#               request with its recorded reply, instead of a BESS daemon
+# HOST can also be "unix:<socket path>". The default is localhost.
+
+import sys
+import os
+import socket
+import struct
+import getopt
+import collections
+import timeit
+
+import msglog
+import softnic
+from histogram import Histogram
+
+# Runs a stand-in for bessd in a child process, which answers the requests
+# with the recorded replies, in order, straight from the log.
+# Serves a single connection. Returns (pid, port).
+def _start_standin(log):
+    listen_sock = socket.socket()
+    listen_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listen_sock.bind(('127.0.0.1', 0))
+    listen_sock.listen(1)
+    port = listen_sock.getsockname()[1]
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            conn, _ = listen_sock.accept()
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            buf = bytearray(4096)
+            nil = struct.pack('<LLL', 8, 0, 0)
+
+            replies = log.records(msglog.REPLY)
+            while True:
+                hdr = conn.recv(4, socket.MSG_WAITALL)
+                if len(hdr) < 4:
+                    break
+                size, = struct.unpack('<L', hdr)
+                if size > len(buf):
+                    buf = bytearray(size)
+                if size:
+                    conn.recv_into(buf, size, socket.MSG_WAITALL)
+
+                reply = next(replies, None)
+                if reply is None:
+                    conn.sendall(nil)
+                else:
+                    _, offset, size = reply
+                    conn.sendall(log.buffer(offset, size, framed=True))
+        finally:
+            os._exit(0)
+
+    listen_sock.close()
+    return pid, port
+
+# Sends all requests in the log over s (a connected SoftNIC), keeping up to
+# window of them outstanding. Returns (elapsed seconds, Histogram of request
+# latencies, bytes sent, bytes received, number of error replies). Errors
+# are counted only if check is True, as decoding replies takes time.
+def replay(log, s, window=1, check=False):
+    hist = Histogram()
+    timer = timeit.default_timer
+    requests = log.records(msglog.REQUEST)
+    sent = collections.deque()      # send times of outstanding requests
+    bytes_sent = 0
+    bytes_received = 0
+    errors = 0
+
+    start = timer()
+
+    while True:
+        while len(sent) < window:
+            request = next(requests, None)
+            if request is None:
+                break
+
+            _, offset, size = request
+            s.s.sendall(log.buffer(offset, size, framed=True))
+            sent.append(timer())
+            bytes_sent += 4 + size
+
+        if not sent:
+            break
+
+        buf, total = s._recv_message()
+        hist.add(timer() - sent.popleft())
+        bytes_received += 4 + total
+
+        if check:
+            reply = s._decode_message(buf, total)
+            if isinstance(reply, dict) and 'err' in reply:
+                errors += 1
+
+    return timer() - start, hist, bytes_sent, bytes_received, errors
+
+def usage():
+    print >> sys.stderr, 'Usage: %s [-w WINDOW] [-c] [-s] LOG [HOST] [PORT]' \
+            % sys.argv[0]
+    sys.exit(2)
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'w:cs')
+        opts = dict(opts)
+        window = int(opts.get('-w', 1))
+    except (getopt.GetoptError, ValueError):
+        usage()
+
+    if not 1 <= len(args) <= 3 or window < 1:
+        usage()
+
+    log = msglog.LogReader(args[0])
+    host = args[1] if len(args) > 1 else 'localhost'
+    port = int(args[2]) if len(args) > 2 else softnic.SoftNIC.DEF_PORT
+
+    pid = None
+    if '-s' in opts:
+        pid, port = _start_standin(log)
+        host = '127.0.0.1'
+
+    s = softnic.SoftNIC()
+    s.connect(host, port)
+
+    try:
+        elapsed, hist, bytes_sent, bytes_received, errors = \
+                replay(log, s, window, '-c' in opts)
+    finally:
+        s.disconnect()
+        if pid is not None:
+            os.waitpid(pid, 0)
+
+    if not hist.count:
+        print 'No request to replay in %s' % args[0]
+        return
+
+    print '%d requests in %.3f seconds (window %d)' % \
+            (hist.count, elapsed, window)
+    print '  %-12s %12.1f' % ('requests/s', hist.count / elapsed)
+    print '  %-12s %12.1f' % ('sent MB/s', bytes_sent / elapsed / 1e6)
+    print '  %-12s %12.1f' % ('recv MB/s', bytes_received / elapsed / 1e6)
+    if '-c' in opts:
+        print '  %-12s %12d' % ('errors', errors)
+
+    print 'latency (us)'
+    for p in [50, 90, 99, 99.9]:
+        print '  %-12s %12.1f' % ('p%g' % p, hist.percentile(p) * 1e6)
+    print '  %-12s %12.1f' % ('max', hist.max * 1e6)
+
+if __name__ == '__main__':
+    main()
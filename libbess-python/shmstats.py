@@ -0,0 +1,148 @@
+import os
+import mmap
+import struct
+import time
+
+import numpy
+
+# Reader of the port and gate counters that bessd exports to shared memory
+# (see core/shmstats.h, and the -m option of bessd). Once the region is
+# mapped, reading the counters needs no system call and no work from the
+# daemon, so it can be done at a high rate (e.g., 100 times a second), e.g.,
+#
+#   r = StatsReader()
+#   timestamp, ports, gates = r.read()
+#   print ports['name'], ports['inc_packets']
+#   print gates['module'], gates['gate'], gates['pkts']
+#
+# ports and gates are NumPy structured arrays, with the fields below.
+# The counters are only as fresh as the export interval of the daemon.
+
+DEF_PATH = '/dev/shm/bess_stats'
+
+MAGIC = 'BESSSTAT'
+VERSION = 1
+
+_NAME_LEN = 32
+
+# struct shm_stats_header
+_HEADER = struct.Struct('<8sLLQQdLLLLQ')
+_SEQ_OFFSET = 16
+
+# struct shm_stats_port
+PORT_FIELDS = [
+    ('name',        'S%d' % _NAME_LEN),
+    ('inc_packets', '<u8'),
+    ('inc_dropped', '<u8'),
+    ('inc_bytes',   '<u8'),
+    ('out_packets', '<u8'),
+    ('out_dropped', '<u8'),
+    ('out_bytes',   '<u8'),
+]
+
+# struct shm_stats_gate
+GATE_FIELDS = [
+    ('module',      'S%d' % _NAME_LEN),
+    ('next',        'S%d' % _NAME_LEN),
+    ('gate',        '<u4'),
+    ('reserved',    '<u4'),
+    ('cnt',         '<u8'),
+    ('pkts',        '<u8'),
+]
+
+# Newer versions of the daemon may append fields to the entries,
+# so the size of an entry is taken from the header
+def _dtype(fields, itemsize):
+    dtype = numpy.dtype(fields)
+    if itemsize < dtype.itemsize:
+        raise ValueError('Unexpected entry size %d' % itemsize)
+
+    names = [name for name, _ in fields]
+    return numpy.dtype({
+            'names': names,
+            'formats': [dtype.fields[name][0] for name in names],
+            'offsets': [dtype.fields[name][1] for name in names],
+            'itemsize': itemsize,
+        })
+
+class StatsReader(object):
+    # raised if the region is not available or not in the expected format
+    class Error(Exception):
+        pass
+
+    def __init__(self, path=DEF_PATH):
+        self.path = path
+        self.mm = None
+        self._open()
+
+    def _open(self):
+        try:
+            with open(self.path, 'rb') as f:
+                self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.inode = os.fstat(f.fileno()).st_ino
+        except (IOError, OSError, ValueError) as e:
+            raise self.Error('Cannot map %s (bessd not running with -m?): ' \
+                    '%s' % (self.path, e))
+
+        if len(self.mm) < _HEADER.size:
+            self.close()
+            raise self.Error('%s is too small' % self.path)
+
+        magic, version, header_size, _, _, _, _, port_entry_size, _, \
+                gate_entry_size, _ = _HEADER.unpack_from(self.mm)
+
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise self.Error('%s is not in the expected format' % self.path)
+
+        self.header_size = header_size
+        self.port_dtype = _dtype(PORT_FIELDS, port_entry_size)
+        self.gate_dtype = _dtype(GATE_FIELDS, gate_entry_size)
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+    # True if the daemon has been restarted (or stopped) since the region
+    # was mapped. Unlike read(), this makes a system call.
+    def is_stale(self):
+        try:
+            return os.stat(self.path).st_ino != self.inode
+        except OSError:
+            return True
+
+    # maps the region of a new daemon
+    def reopen(self):
+        self.close()
+        self._open()
+
+    # Returns (timestamp, ports, gates): a consistent snapshot of the
+    # counters, all taken at the same update of the daemon.
+    def read(self):
+        mm = self.mm
+        unpack_from = _HEADER.unpack_from
+        seq_from = struct.Struct('<Q').unpack_from
+
+        while True:
+            _, _, _, seq, size, timestamp, num_ports, _, num_gates, _, \
+                    gates_offset = unpack_from(mm)
+
+            if seq & 1:
+                # being updated. It takes only a few microseconds.
+                time.sleep(0)
+                continue
+
+            if size > len(mm):
+                # the region has grown
+                self.reopen()
+                mm = self.mm
+                continue
+
+            ports = numpy.frombuffer(mm, self.port_dtype, num_ports,
+                    self.header_size).copy()
+            gates = numpy.frombuffer(mm, self.gate_dtype, num_gates,
+                    gates_offset).copy()
+
+            if seq_from(mm, _SEQ_OFFSET)[0] == seq:
+                return timestamp, ports, gates
@@ -3,8 +3,254 @@ import struct
 import errno
 import sys
 import os
+import time
+import itertools
 
 import message
+import msglog
+from histogram import Histogram
+
+# Not exported by the socket module of Python 2. Linux only.
+MSG_MORE = getattr(socket, 'MSG_MORE', 0x8000)
+
+# name of the command of a request message, for client stats
+def _command_name(obj):
+    if not isinstance(obj, dict):
+        return '(invalid)'
+
+    cmd = str(obj.get('cmd', '(none)'))
+    if obj.get('to') == 'module':
+        return 'module ' + cmd
+    return cmd
+
+def _with_arg(envelope, arg):
+    if arg is None:
+        return envelope
+    return dict(envelope, arg=arg)
+
+# Returns (prefix, suffix) such that prefix + encode(arg) + suffix is the
+# encoded form of dict(envelope, arg=arg). Map keys are encoded in sorted
+# order and 'arg' comes first among the envelope keys ('cmd', 'name', 'to'),
+# so the argument always sits between the same two byte strings, and the
+# size of the map (its number of keys) does not depend on the argument.
+#
+# Without an argument (no_arg is True), prefix is the whole message.
+def _compile_template(envelope, no_arg):
+    if no_arg:
+        return message.encode(envelope), ''
+
+    assert min(envelope) > 'arg'
+    buf = message.encode(dict(envelope, arg=None))
+    # map header (8) + 'arg' key (8) | nil (8) | the rest
+    return buf[:16], buf[24:]
+
+# result of a request made in a pipeline, a batch, or with AsyncSoftNIC
+class Future(object):
+    def __init__(self):
+        self._done = False
+        self._value = None
+        self._error = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done
+
+    # Returns the reply, or raises SoftNIC.Error if the request failed
+    def result(self):
+        if not self._done:
+            raise SoftNIC.APIError('The reply has not been received yet')
+
+        if self._error is not None:
+            raise self._error
+
+        return self._value
+
+    # Returns the exception of a failed request, or None
+    def exception(self):
+        if not self._done:
+            raise SoftNIC.APIError('The reply has not been received yet')
+
+        return self._error
+
+    # fn(future) is called when the reply arrives (right away if it has)
+    def add_done_callback(self, fn):
+        if self._done:
+            fn(self)
+        else:
+            self._callbacks.append(fn)
+
+    def _set(self, value, error):
+        self._done = True
+        self._value = value
+        self._error = error
+
+        callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            fn(self)
+
+# See SoftNIC.pipeline()
+class Pipeline(object):
+    def __init__(self, softnic, window):
+        self.softnic = softnic
+        self.window = window
+        self.unsent = []    # buffers of the queued requests
+        self.futures = []   # one for each queued request, in order
+
+    # p.get_module_info(name) is softnic.get_module_info(name), and so on
+    def __getattr__(self, name):
+        return getattr(self.softnic, name)
+
+    def __enter__(self):
+        if self.softnic.pipelined or self.softnic.batched:
+            raise SoftNIC.APIError('Already in a pipeline or batch')
+
+        self.softnic.pipelined = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.softnic.pipelined = None
+
+        if exc_type is None:
+            self.flush()
+        else:
+            for f in self.futures:
+                f._set(None, SoftNIC.APIError('Pipeline aborted: ' \
+                        'the request was not sent'))
+            self.unsent = []
+            self.futures = []
+
+        return False
+
+    # takes the request that has just been encoded in softnic.sendbuf
+    def _queue(self, size, iov):
+        sendbuf = self.softnic.sendbuf
+
+        if iov:
+            pieces = message.segments(sendbuf, 4 + size, iov)
+            # even-numbered pieces are views of sendbuf, which will be reused
+            pieces[0::2] = [piece.tobytes() for piece in pieces[0::2]]
+            self.unsent.extend(pieces)
+        else:
+            self.unsent.append(str(sendbuf[:4 + size]))
+
+        f = Future()
+        self.futures.append(f)
+
+        if len(self.futures) >= self.window:
+            self.flush()
+
+        return f
+
+    # sends all queued requests, and then reads their replies
+    def flush(self):
+        if not self.futures:
+            return
+
+        pieces, self.unsent = self.unsent, []
+        futures, self.futures = self.futures, []
+
+        # one send() for each run of small requests between large blobs
+        buffers = []
+        for small, run in itertools.groupby(pieces,
+                lambda piece: isinstance(piece, str)):
+            if small:
+                buffers.append(''.join(run))
+            else:
+                buffers.extend(run)
+
+        self.softnic._send(buffers)
+
+        for f in futures:
+            try:
+                f._set(self.softnic._recv_reply(), None)
+            except SoftNIC.Error as e:
+                f._set(None, e)
+
+# See SoftNIC.batch()
+class Batch(object):
+    def __init__(self, softnic, max_size):
+        self.softnic = softnic
+        self.max_size = max_size
+        self.entries = []
+        self.futures = []
+
+    # b.create_module(...) is softnic.create_module(...), and so on
+    def __getattr__(self, name):
+        return getattr(self.softnic, name)
+
+    def __enter__(self):
+        if self.softnic.pipelined or self.softnic.batched:
+            raise SoftNIC.APIError('Already in a pipeline or batch')
+
+        self.softnic.batched = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.softnic.batched = None
+
+        if exc_type is None:
+            self.flush()
+        else:
+            self._abort(SoftNIC.APIError('Batch aborted: ' \
+                    'the request was not sent'))
+
+        return False
+
+    def _abort(self, error):
+        for f in self.futures:
+            f._set(None, error)
+
+        self.entries = []
+        self.futures = []
+
+    # takes a request message, which will be an entry of a batch
+    def _add(self, obj):
+        f = Future()
+        self.entries.append(obj)
+        self.futures.append(f)
+        return f
+
+    # Sends the entries in as few "batch" requests as possible.
+    # If the daemon refuses a whole batch (e.g., an entry is malformed),
+    # raises the Error after setting it to all remaining Futures.
+    def flush(self):
+        batched = self.softnic.batched
+        self.softnic.batched = None     # to send requests for real
+        try:
+            self._flush()
+        finally:
+            self.softnic.batched = batched
+
+    def _flush(self):
+        while self.entries:
+            size = 0
+            for n, entry in enumerate(self.entries):
+                size += message.encoded_size(entry)
+                if size > self.max_size and n > 0:
+                    break
+            else:
+                n = len(self.entries)
+
+            try:
+                results = self.softnic._request_softnic('batch',
+                        self.entries[:n])
+            except SoftNIC.Error as e:
+                self._abort(e)
+                raise
+
+            if not isinstance(results, list) or len(results) != n:
+                e = SoftNIC.APIError('Invalid reply to a batch request')
+                self._abort(e)
+                raise e
+
+            for f, result in zip(self.futures[:n], results):
+                try:
+                    f._set(self.softnic._check_reply(result), None)
+                except SoftNIC.Error as e:
+                    f._set(None, e)
+
+            del self.entries[:n]
+            del self.futures[:n]
 
 class SoftNIC(object):
 
@@ -29,19 +275,107 @@ class SoftNIC(object):
         pass
 
     DEF_PORT = 10514
+    DEF_UNIX_PATH = '/var/run/bessd.sock'
+
+    # Cached results of list_*(cached=True) expire after this many seconds,
+    # to pick up changes made by other clients
+    DEF_CACHE_TTL = 5.0
+
+    # Client stats break down the time of each request into these phases:
+    #   encode: from the call to the message ready in sendbuf
+    #   send:   until the message is handed to the kernel
+    #   wait:   until the whole reply is received (network and daemon)
+    #   decode: until the reply is decoded
+    PHASES = ('encode', 'send', 'wait', 'decode')
+
+    # command -> the cached list_* results it makes stale
+    CACHE_INVALIDATED_BY = {
+        'reset_all':        ('list_ports', 'list_modules'),
+        'reset_ports':      ('list_ports',),
+        'create_port':      ('list_ports',),
+        'destroy_port':     ('list_ports',),
+        'reset_modules':    ('list_modules',),
+        'create_module':    ('list_modules',),
+        'destroy_module':   ('list_modules',),
+        'apply_graph':      ('list_modules',),
+        'kill_bess':        ('list_drivers', 'list_mclasses',
+                             'list_ports', 'list_modules'),
+    }
+
+    # the template cache is simply flushed when it grows beyond this
+    MAX_TEMPLATES = 4096
+
+    # The daemon does not read the next request until the reply to the
+    # current one is sent. With too many outstanding requests, both sides
+    # would block on send() once the socket buffers are full.
+    PIPELINE_WINDOW = 64
+
+    # Batches are split into requests of up to this many bytes,
+    # well below the maximum message size of the daemon (1MB).
+    MAX_BATCH_SIZE = 256 * 1024
 
     def __init__(self):
         self.debug = False
+        self.numeric_arrays = False
+        self.blob_views = False
         self.s = None
         self.peer = None
+        self.fallback_reason = None # see connect()
+        self.pipelined = None   # Pipeline object in use, if any
+        self.batched = None     # Batch object in use, if any
+        self.subscribed = False # in a subscribe() stream
+
+        # reused for every request: 4-byte length, followed by the message
+        self.sendbuf = bytearray(4096)
+
+        # reused for every reply, and decoded in place (unless blob_views)
+        self.recvbuf = bytearray(4096)
+
+        # (key, arg is None) -> encoded envelope. See _compile_template().
+        self.templates = {}
+
+        # list_* command -> (time of the request, result)
+        self.cache = {}
+        self.cache_ttl = self.DEF_CACHE_TTL
+
+        # command -> {phase: Histogram}
+        self.stats = {}
+        self.stats_enabled = True
+        self.profile_hook = None
+        self.profile_context = None
+
+        # msglog.Recorder, if messages are being recorded
+        self.recorder = None
 
     def is_connected(self):
         return self.s is not None
 
-    def connect(self, host='localhost', port=DEF_PORT):
+    # host can also be 'unix:<path>', for the Unix domain socket of bessd
+    # (see the -u option of bessd). If fallback is set and the Unix domain
+    # socket is not available, connects to localhost:port over TCP instead,
+    # and the reason is left in self.fallback_reason (None otherwise).
+    def connect(self, host='localhost', port=DEF_PORT, fallback=False):
         if self.is_connected():
             raise self.APIError('Already connected')
 
+        self.fallback_reason = None
+
+        if host.startswith('unix:'):
+            path = host[len('unix:'):]
+            try:
+                self.s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.s.connect(path)
+                self.peer = host
+                return
+            except socket.error as e:
+                self.s = None
+                self.peer = None
+                if not fallback:
+                    raise self.APIError('Cannot connect to %s ' \
+                            '(BESS daemon not running?)' % host)
+                self.fallback_reason = '%s: %s' % (path, e.strerror)
+                host = 'localhost'
+
         try:
             self.s = socket.socket()
             self.s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
@@ -58,44 +392,268 @@ class SoftNIC(object):
         if self.is_connected():
             self.s.close()
             self.s = None
+            self.cache.clear()
 
     def set_debug(self, flag):
         self.debug = flag
 
-    # (de)serialization only happens in this private method
-    def _request(self, obj):
-        if not self.is_connected():
-            raise self.APIError('Not connected to BESS daemon')
-
+    # Client stats (see PHASES) are collected for blocking requests made by
+    # this object. Pipelined, batched and AsyncSoftNIC requests are not
+    # timed, as their phases overlap with those of other requests.
+    def set_stats(self, flag):
+        self.stats_enabled = flag
+
+    # Returns {command: {phase: Histogram}}
+    def get_stats(self):
+        return self.stats
+
+    def reset_stats(self):
+        self.stats = {}
+
+    # hook(cmd, timings) is called after every timed request, where timings
+    # is a {phase: seconds} map. None removes the hook.
+    def set_profile_hook(self, hook):
+        self.profile_hook = hook
+
+    # Every request runs in the context manager returned by factory(cmd),
+    # e.g., for a tracing span or to enable a profiler. None removes it.
+    def set_profile_context(self, factory):
+        self.profile_context = factory
+
+    # Appends every request sent and reply received from now on to the
+    # message log at path (see msglog.py), e.g., to replay the requests
+    # of a configuration script later with replay.py.
+    def start_recording(self, path):
+        self.stop_recording()
+        self.recorder = msglog.Recorder(path)
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def set_cache_ttl(self, seconds):
+        self.cache_ttl = seconds
+        self.cache.clear()
+
+    # If set, homogeneous int/double lists in replies (e.g., counters) are
+    # returned as numpy arrays, or array.array if NumPy is not installed.
+    def set_numeric_arrays(self, flag):
+        self.numeric_arrays = flag
+
+    # If set, blobs in replies are returned as read-only memoryview objects
+    # referring to the received message, rather than copied into bytearrays.
+    # Each reply is then received into a buffer of its own, so the views stay
+    # valid after later requests (and keep the whole reply in memory).
+    def set_blob_views(self, flag):
+        self.blob_views = flag
+
+    # Returns the size of the message encoded into sendbuf, after the
+    # 4-byte length field. Large blobs left out of sendbuf are added to iov.
+    def _encode_request(self, obj, iov):
         if self.debug:
             print >> sys.stderr, '\t---> %s' % repr(obj)
 
         try:
-            q = message.encode(obj)
+            size = message.encode_into(self.sendbuf, 4, obj, iov) - 4
         except:
             print >> sys.stderr, 'Encoding error, object: %s' % repr(obj)
             raise
 
-        self.s.sendall(struct.pack('<L', len(q)))
-        self.s.sendall(q)
+        struct.pack_into('<L', self.sendbuf, 0, size)
+        return size
+
+    # Same as _encode_request(dict(envelope, arg=arg)), or just envelope if
+    # arg is None, but only arg is encoded. The rest comes from the template
+    # cache, keyed by key, which must identify the envelope.
+    def _encode_template(self, key, envelope, arg, iov):
+        if self.debug:
+            return self._encode_request(_with_arg(envelope, arg), iov)
+
+        template = self.templates.get((key, arg is None))
+        if template is None:
+            if len(self.templates) >= self.MAX_TEMPLATES:
+                self.templates.clear()
+            template = _compile_template(envelope, arg is None)
+            self.templates[(key, arg is None)] = template
+
+        prefix, suffix = template
+        p = len(prefix)
+
+        try:
+            message.reserve(self.sendbuf, 4 + p)
+            self.sendbuf[4:4 + p] = prefix
+            if arg is None:
+                size = p
+            else:
+                offset = message.encode_into(self.sendbuf, 4 + p, arg, iov)
+                size = offset + len(suffix) - 4
+                message.reserve(self.sendbuf, 4 + size)
+                self.sendbuf[offset:4 + size] = suffix
+        except:
+            print >> sys.stderr, 'Encoding error, object: %s' % \
+                    repr(_with_arg(envelope, arg))
+            raise
+
+        struct.pack_into('<L', self.sendbuf, 0, size)
+        return size
 
-        total, = struct.unpack('<L', self.s.recv(4))
-        buf = []
+    # (de)serialization only happens in these private methods
+    def _request(self, obj):
+        if not self.is_connected():
+            raise self.APIError('Not connected to BESS daemon')
+
+        if self.subscribed:
+            raise self.APIError('Subscribed to stats on this connection')
+
+        if self.batched is not None:
+            return self.batched._add(obj)
+
+        return self._perform(_command_name(obj), self._encode_request, obj)
+
+    def _request_template(self, key, envelope, arg):
+        if not self.is_connected():
+            raise self.APIError('Not connected to BESS daemon')
+
+        if self.subscribed:
+            raise self.APIError('Subscribed to stats on this connection')
+
+        if self.batched is not None:
+            return self.batched._add(_with_arg(envelope, arg))
+
+        return self._perform(_command_name(envelope), self._encode_template,
+                key, envelope, arg)
+
+    # encode(*args, iov) encodes the request into sendbuf, returning its size
+    def _perform(self, cmd, encode, *args):
+        if self.profile_context is not None:
+            with self.profile_context(cmd):
+                return self._perform_timed(cmd, encode, args)
+
+        if self.stats_enabled or self.profile_hook is not None:
+            return self._perform_timed(cmd, encode, args)
+
+        # large blobs (e.g., packet templates) are sent from where they are
+        iov = []
+        size = encode(*(args + (iov,)))
+        return self._transact(size, iov)
+
+    def _perform_timed(self, cmd, encode, args):
+        t_start = time.time()
+
+        iov = []
+        size = encode(*(args + (iov,)))
+
+        t_encoded = time.time()
+        timing = []
+
+        try:
+            return self._transact(size, iov, timing)
+        finally:
+            # only if the request has completed a round trip
+            if len(timing) == 3:
+                t_sent, t_received, t_decoded = timing
+                self._record(cmd, (t_encoded - t_start, t_sent - t_encoded,
+                        t_received - t_sent, t_decoded - t_received))
+
+    def _record(self, cmd, durations):
+        if self.stats_enabled:
+            stats = self.stats.get(cmd)
+            if stats is None:
+                stats = self.stats[cmd] = \
+                        dict((phase, Histogram()) for phase in self.PHASES)
+
+            for phase, duration in zip(self.PHASES, durations):
+                stats[phase].add(duration)
+
+        if self.profile_hook is not None:
+            self.profile_hook(cmd, dict(zip(self.PHASES, durations)))
+
+    # sends the message in sendbuf and returns the decoded reply.
+    # In a pipeline, the message is queued instead and a Future is returned.
+    # If timing is a list, the times when the request was sent, the reply
+    # was received and it was decoded are appended to it.
+    def _transact(self, size, iov, timing=None):
+        if self.recorder is not None:
+            self.recorder.request(self.sendbuf, size, iov)
+
+        if self.pipelined is not None:
+            return self.pipelined._queue(size, iov)
+
+        if iov:
+            # gather the pieces into as few TCP segments as possible
+            self._send(message.segments(self.sendbuf, 4 + size, iov))
+        else:
+            self.s.sendall(memoryview(self.sendbuf)[:4 + size])
+
+        if timing is None:
+            return self._recv_reply()
+
+        timing.append(time.time())
+        buf, total = self._recv_message()
+        timing.append(time.time())
+        obj = self._decode_message(buf, total)
+        timing.append(time.time())
+
+        return self._check_reply(obj)
+
+    def _send(self, pieces):
+        for piece in pieces[:-1]:
+            self.s.sendall(piece, MSG_MORE)
+        self.s.sendall(pieces[-1])
+
+    # fills view from the socket
+    def _recv_into(self, view):
+        total = len(view)
         received = 0
         while received < total:
-            frag = self.s.recv(total - received)
-            buf.append(frag)
-            received += len(frag)
+            n = self.s.recv_into(view[received:], total - received)
+            if n == 0:
+                raise socket.error(errno.ECONNRESET,
+                        'Connection closed by BESS daemon')
+            received += n
+
+    # reads and decodes one reply. Raises Error if the reply is an error.
+    def _recv_reply(self):
+        buf, total = self._recv_message()
+        return self._check_reply(self._decode_message(buf, total))
+
+    # returns (buffer, size). The reply is buffer[:size].
+    def _recv_message(self):
+        self._recv_into(memoryview(self.recvbuf)[:4])
+        total, = struct.unpack_from('<L', self.recvbuf)
+
+        if self.blob_views:
+            # the decoded blobs refer to buf, so it cannot be reused
+            buf = bytearray(total)
+        else:
+            if total > len(self.recvbuf):
+                self.recvbuf = bytearray(max(total, len(self.recvbuf) * 2))
+            buf = self.recvbuf
 
+        self._recv_into(memoryview(buf)[:total])
+
+        if self.recorder is not None:
+            self.recorder.reply(buf, total)
+
+        return buf, total
+
+    def _decode_message(self, buf, total):
         try:
-            obj = message.decode(''.join(buf))
+            obj = message.decode(buf, self.numeric_arrays, self.blob_views,
+                    0, total)
         except:
-            print >> sys.stderr, 'Decoding error, binary: %s' % obj.encode('hex')
+            print >> sys.stderr, 'Decoding error, binary: %s' % \
+                    str(buf[:total]).encode('hex')
             raise
 
         if self.debug:
             print >> sys.stderr, '\t<--- %s' % repr(obj)
 
+        return obj
+
+    # returns the reply as it is, or raises Error if it is an error
+    def _check_reply(self, obj):
         if isinstance(obj, dict) and 'err' in obj:
             err = obj['err']
             errmsg = obj.get('errmsg', '(error message is not given)')
@@ -104,18 +662,179 @@ class SoftNIC(object):
 
         return obj
 
+    # Requests made in this context (with the returned object or with this
+    # SoftNIC object itself) are written back to back without waiting for
+    # replies, and return a Future instead of the result. All replies have
+    # been read when the context exits. e.g.,
+    #
+    #   with softnic.pipeline() as p:
+    #       futures = [p.get_module_info(name) for name in names]
+    #   infos = [f.result() for f in futures]
+    #
+    # The daemon processes the requests of a client in order, one at a time.
+    # Requests are therefore not atomic as a whole: if one of them fails,
+    # the others still take effect, and f.result() raises its Error.
+    def pipeline(self, window=None):
+        return Pipeline(self, window or self.PIPELINE_WINDOW)
+
+    # Requests made in this context are not sent right away, but collected
+    # and run by the daemon with a single "batch" request (or a few, for
+    # large batches) when the context exits. Each returns a Future. e.g.,
+    #
+    #   with softnic.batch() as b:
+    #       for i in range(5000):
+    #           b.create_module('Sink', 'sink%d' % i)
+    #
+    # Running workers are paused during the batch only if some of the
+    # requests require that, so there is no need to call pause_all().
+    # A failed request does not stop the rest. Its Future has the Error.
+    def batch(self, max_size=None):
+        return Batch(self, max_size or self.MAX_BATCH_SIZE)
+
+    # Yields the counters of ports and module gates every interval seconds,
+    # as pushed by the daemon, until the generator is closed (e.g., when
+    # the loop is broken out of). e.g.,
+    #
+    #   for sample in softnic.subscribe(ports=['port0'], interval=0.1):
+    #       print sample['timestamp'], sample['ports']['inc_packets'][0]
+    #
+    # Without ports and modules, all ports and modules are subscribed.
+    # Only the gates connected at the time of subscription are included.
+    # Samples have the (columnar) format of get_all_stats(), except that
+    # gates have no 'name' column, with the timestamps taken by the daemon.
+    # The counters are the changes since the previous sample, or the
+    # absolute values if deltas is False. The counters of a port or gate
+    # that have started over (e.g., the port was recreated with the same
+    # name) are absolute in either case, and its index is in the 'reset'
+    # list of 'ports' or 'gates' (present only if not empty).
+    # If the client is too slow to keep up, samples are merged, not queued.
+    #
+    # No other request can be made on this connection while subscribed.
+    def subscribe(self, ports=None, modules=None, interval=1.0, deltas=True):
+        if self.pipelined or self.batched:
+            raise self.APIError('Cannot subscribe in a pipeline or batch')
+
+        arg = {'interval': float(interval)}
+        if ports is not None:
+            arg['ports'] = list(ports)
+        if modules is not None:
+            arg['modules'] = list(modules)
+
+        base = self._request_softnic('subscribe', arg)
+
+        self.subscribed = True
+        try:
+            for sample in self._stream(base, deltas):
+                yield sample
+        finally:
+            self.subscribed = False
+            if self.is_connected():
+                self._unsubscribe()
+
+    def _stream(self, base, deltas):
+        columns = {}    # 'ports' or 'gates' -> the names of counter lists
+        totals = {}     # ('ports' or 'gates', counter name) -> list
+        sizes = {}
+
+        for kind, names in [('ports', ('name',)),
+                            ('gates', ('module', 'gate'))]:
+            table = base[kind]
+            sizes[kind] = len(table[names[0]])
+            columns[kind] = [key for key in table if key not in names]
+            for key in columns[kind]:
+                totals[(kind, key)] = list(table[key])
+
+        while True:
+            push = self._recv_push()
+            sample = {'timestamp': push['timestamp'], 'seq': push['seq']}
+
+            for kind, names in [('ports', ('name',)),
+                                ('gates', ('module', 'gate'))]:
+                table = dict((name, base[kind][name]) for name in names)
+                changes = push[kind]
+                resets = changes.get('reset', [])
+
+                for key in columns[kind]:
+                    delta = changes.get(key)
+                    if delta is None:
+                        delta = [0] * sizes[kind]
+
+                    if deltas:
+                        table[key] = delta
+                    else:
+                        total = [a + b for a, b in \
+                                zip(totals[(kind, key)], delta)]
+                        # absolute values, for the reset ones
+                        for i in resets:
+                            total[i] = delta[i]
+                        totals[(kind, key)] = total
+                        table[key] = total
+
+                if resets:
+                    table['reset'] = resets
+
+                sample[kind] = table
+
+            yield sample
+
+    def _recv_push(self):
+        buf, total = self._recv_message()
+        obj = self._decode_message(buf, total)
+
+        if not isinstance(obj, dict) or obj.get('push') != 'stats':
+            raise self.APIError('Unexpected message from BESS daemon')
+
+        return obj
+
+    # Pushes sent before the daemon got the request are discarded
+    def _unsubscribe(self):
+        size = self._encode_template('unsubscribe',
+                {'to': 'softnic', 'cmd': 'unsubscribe'}, None, [])
+
+        if self.recorder is not None:
+            self.recorder.request(self.sendbuf, size, [])
+
+        self.s.sendall(memoryview(self.sendbuf)[:4 + size])
+
+        while True:
+            buf, total = self._recv_message()
+            obj = self._decode_message(buf, total)
+            if not isinstance(obj, dict) or obj.get('push') != 'stats':
+                return self._check_reply(obj)
+
     def _request_softnic(self, cmd, arg = None):
-        if arg is not None:
-            return self._request({'to': 'softnic', 'cmd': cmd, 'arg': arg})
-        else:
-            return self._request({'to': 'softnic', 'cmd': cmd})
+        # invalidated before the request is made (or queued), so that any
+        # later list_* request is answered after this one has taken effect
+        for stale in self.CACHE_INVALIDATED_BY.get(cmd, ()):
+            self.cache.pop(stale, None)
+
+        return self._request_template(cmd,
+                {'to': 'softnic', 'cmd': cmd}, arg)
+
+    # Used for list_* commands. With cached=True, returns the previous result
+    # if it is not older than cache_ttl seconds. The client's own changes
+    # (e.g., create_module) invalidate the affected results right away.
+    # The returned list is shared with the cache, so do not modify it.
+    def _request_cached(self, cmd, cached):
+        deferred = self.pipelined or self.batched
+
+        if cached and not deferred:
+            entry = self.cache.get(cmd)
+            if entry and time.time() - entry[0] < self.cache_ttl:
+                return entry[1]
+
+        now = time.time()
+        ret = self._request_softnic(cmd)
+
+        # not for Futures of pipelines, batches, or AsyncSoftNIC
+        if not deferred and not isinstance(ret, Future):
+            self.cache[cmd] = (now, ret)
+
+        return ret
 
     def _request_module(self, name, cmd, arg = None):
-        if arg is not None:
-            return self._request({'to': 'module', 'name': name, 'cmd': cmd, 
-                    'arg': arg}) 
-        else:
-            return self._request({'to': 'module', 'name': name, 'cmd': cmd})
+        return self._request_template((name, cmd),
+                {'to': 'module', 'name': name, 'cmd': cmd}, arg)
 
     def kill(self):
         try:
@@ -133,14 +852,25 @@ class SoftNIC(object):
     def resume_all(self):
         return self._request_softnic('resume_all')
 
-    def list_drivers(self):
-        return self._request_softnic('list_drivers')
+    def pause_worker(self, wid):
+        return self._request_softnic('pause_worker', {'wid': wid})
+
+    def resume_worker(self, wid):
+        return self._request_softnic('resume_worker', {'wid': wid})
+
+    # returns the workers to be paused for changes to the modules
+    def get_affected_workers(self, modules):
+        return self._request_softnic('get_affected_workers',
+                {'modules': list(modules)})
+
+    def list_drivers(self, cached=False):
+        return self._request_cached('list_drivers', cached)
 
     def reset_ports(self):
         return self._request_softnic('reset_ports')
 
-    def list_ports(self):
-        return self._request_softnic('list_ports')
+    def list_ports(self, cached=False):
+        return self._request_cached('list_ports', cached)
 
     def create_port(self, driver = 'PMD', name = None, arg = None):
         kv = {'driver': driver}
@@ -156,11 +886,11 @@ class SoftNIC(object):
     def get_port_stats(self, port):
         return self._request_softnic('get_port_stats', port)
 
-    def list_modules(self):
-        return self._request_softnic('list_modules')
+    def list_modules(self, cached=False):
+        return self._request_cached('list_modules', cached)
 
-    def list_mclasses(self):
-        return self._request_softnic('list_mclasses')
+    def list_mclasses(self, cached=False):
+        return self._request_cached('list_mclasses', cached)
 
     def reset_modules(self):
         return self._request_softnic('reset_modules')
@@ -179,6 +909,14 @@ class SoftNIC(object):
     def get_module_info(self, name):
         return self._request_softnic('get_module_info', name)
 
+    # Counters of all ports and all module gates, with a single timestamp.
+    # Columnar: "ports" and "gates" are maps of parallel lists, e.g.,
+    # ret['ports']['inc_packets'][i] is for the port ret['ports']['name'][i]
+    # and ret['gates']['pkts'][i] is for the gate ret['gates']['gate'][i]
+    # of module ret['gates']['module'][i], connected to ret['gates']['name'][i]
+    def get_all_stats(self):
+        return self._request_softnic('get_all_stats')
+
     def connect_modules(self, m1, m2, gate = 0):
         return self._request_softnic('connect_modules', 
                 {'m1': m1, 'm2': m2, 'gate': gate})
@@ -187,6 +925,11 @@ class SoftNIC(object):
         return self._request_softnic('disconnect_modules', 
                 {'name': name, 'gate': gate})
 
+    # graph: {'modules': [...], 'edges': [...], 'tasks': [...]}
+    # (see core/graph.h). Returns {'modules': [names of the new modules]}.
+    def apply_graph(self, graph):
+        return self._request_softnic('apply_graph', graph)
+
     def query_module(self, name, arg):
         return self._request_module(name, 'query', arg)
 
@@ -198,19 +941,68 @@ class SoftNIC(object):
         args = {'name': m, 'gate': gate}
         return self._request_softnic('disable_tcpdump', args)
 
+    def list_workers(self):
+        return self._request_softnic('list_workers')
+
     def add_worker(self, wid, core):
         args = {'wid': wid, 'core': core}
         return self._request_softnic('add_worker', args)
 
-    def attach_task(self, m, tid, tcid=None, wid=None):
-        if (tcid is None) == (wid is None):
-            raise self.APIError('You should specify either "tcid" or "wid"' \
-                    ', but not both')
+    def delete_worker(self, wid):
+        return self._request_softnic('delete_worker', {'wid': wid})
+
+    def reset_tcs(self):
+        return self._request_softnic('reset_tcs')
+
+    def list_tcs(self):
+        return self._request_softnic('list_tcs')
+
+    # params: priority, share, share_resource ('count', 'cycle', 'packet', or
+    # 'bit'), limit and max_burst (e.g., {'packet': 1000000}, per second)
+    def add_tc(self, name, wid=None, parent=None, **params):
+        args = dict(params, name=name)
+        if wid is not None:
+            args['wid'] = wid
+        if parent is not None:
+            args['parent'] = parent
+
+        return self._request_softnic('add_tc', args)
 
+    # parameters that are not given are left unchanged
+    def update_tc(self, name, **params):
+        return self._request_softnic('update_tc', dict(params, name=name))
+
+    def delete_tc(self, name):
+        return self._request_softnic('delete_tc', name)
+
+    def get_tc_stats(self, name):
+        return self._request_softnic('get_tc_stats', name)
+
+    # tc: the name of a TC created with add_tc()
+    # tcid is the old name of tc, still accepted
+    def attach_task(self, m, tid, tc=None, wid=None, tcid=None):
         if tcid is not None:
-            assert False    # TODO: implement
-            args = {'name': m, 'taskid': tid, 'tcid': tcid}
+            if tc is not None:
+                raise self.APIError('You should specify either "tc" or ' \
+                        '"tcid", but not both')
+            tc = tcid
+
+        if (tc is None) == (wid is None):
+            raise self.APIError('You should specify either "tc" or "wid"' \
+                    ', but not both')
+
+        if tc is not None:
+            args = {'name': m, 'taskid': tid, 'tc': tc}
         else:
             args = {'name': m, 'taskid': tid, 'wid': wid}
 
         return self._request_softnic('attach_task', args)
+
+    # all tasks, with the usage of their TCs ('cycle', 'packet', ...)
+    def list_tasks(self):
+        return self._request_softnic('list_tasks')
+
+    # to a new default TC of worker wid. Only the two workers are paused.
+    def move_task(self, m, tid, wid):
+        args = {'name': m, 'taskid': tid, 'wid': wid}
+        return self._request_softnic('move_task', args)